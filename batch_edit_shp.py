@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+# 按规则文件批量修改Shapefile的属性：一次设置多列，每列的值可以是常量、逐要素表达式，
+# 或按FILE_NAME等键从CSV查找表中连接。每个文件的所有修改在一遍中完成（只重写.dbf，几何文件原样保留），
+# 多个文件在进程池中并行处理。
+import argparse
+import csv
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from file_inventory import FileInventory
+from pipeline_metrics import StageMetrics, file_size
+from shp_dbf_update import find_dbf_path, read_dbf_columns, read_dbf_header, update_dbf_columns
+
+# 查找表默认的连接键
+DEFAULT_LOOKUP_KEY = 'FILE_NAME'
+# 并行处理的进程数
+DEFAULT_EDIT_WORKERS = 4
+# 新增列可以指定的类型
+EDIT_COLUMN_TYPES = ('str', 'date', 'int', 'float')
+# 表达式中可以使用的函数。规则文件视为可信输入，这里只是避免误用，不是安全沙箱
+EXPRESSION_FUNCTIONS = {
+    'str': str, 'int': int, 'float': float, 'bool': bool, 'round': round, 'len': len, 'min': min, 'max': max,
+    'abs': abs, 'date': datetime.date,
+}
+# 表达式中除字段外额外可用的名称：Shapefile文件名（不含扩展名）和要素序号（从0开始）
+EXPRESSION_SHP_NAME = 'SHP_NAME'
+EXPRESSION_ROW = 'ROW'
+
+# 子进程中的规则，由进程池的initializer设置一次，不随每个文件重复传递查找表
+_worker_rules = None
+
+
+def _load_lookup(name, config, base_dir):
+    """
+    读取一个CSV查找表，返回 键 -> 行字典。键重复时后面的行覆盖前面的行。
+    """
+    path = config.get('path')
+    if not path:
+        raise ValueError(f"查找表 {name} 缺少path")
+    path = os.path.join(base_dir, path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"未找到查找表 {name} 的文件: {path}")
+    key = config.get('key', DEFAULT_LOOKUP_KEY)
+    table = {}
+    duplicates = 0
+    with open(path, 'r', newline='', encoding=config.get('encoding', 'utf-8-sig')) as infile:
+        reader = csv.DictReader(infile)
+        if key not in (reader.fieldnames or []):
+            raise ValueError(f"查找表 {name} 的文件 {path} 中没有键列 {key}")
+        for row in reader:
+            row_key = row[key].strip()
+            duplicates += row_key in table
+            table[row_key] = row
+    if duplicates:
+        print(f"警告: 查找表 {name} 中有 {duplicates} 个重复的键，以最后一行为准。")
+    return {'key': key, 'rows': table}
+
+
+def load_rules(rules_file_path):
+    """
+    读取并检查JSON规则文件。文件中的相对路径（查找表、targets）相对于规则文件所在目录。
+
+    规则文件格式:
+        {
+          "encoding": "utf-8",
+          "lookups": {"road_fixes": {"path": "road_fixes.csv", "key": "FILE_NAME", "encoding": "utf-8"}},
+          "columns": [
+            {"name": "data", "value": "2025-08-19"},
+            {"name": "BATCH_ID", "value": "S2025-08", "type": "str"},
+            {"name": "ROAD_NAME", "expression": "ROAD_NAME.replace('合成路', '测试路')"},
+            {"name": "ROAD_NAME", "lookup": "road_fixes", "field": "ROAD_NAME"}
+          ],
+          "targets": ["shp_dir", "other.shp"]
+        }
+
+    每条列规则给出value（常量）、expression（逐要素表达式）或lookup（查找表连接）之一。
+    同一列可以有多条规则，按顺序生效；表达式和查找键读取的都是修改前的原值。
+    查找表中没有对应键的要素保持该列已有的值。
+
+    Returns:
+        dict: encoding、columns（规则列表，表达式已检查语法）、lookups（已读入的查找表）、targets。
+    """
+    with open(rules_file_path, 'r', encoding='utf-8') as infile:
+        config = json.load(infile)
+    base_dir = os.path.dirname(os.path.abspath(rules_file_path))
+    lookups = {name: _load_lookup(name, lookup, base_dir) for name, lookup in config.get('lookups', {}).items()}
+
+    columns = []
+    for i, rule in enumerate(config.get('columns', [])):
+        name = rule.get('name')
+        if not name:
+            raise ValueError(f"第 {i + 1} 条列规则缺少name")
+        kinds = [kind for kind in ('value', 'expression', 'lookup') if kind in rule]
+        if len(kinds) != 1:
+            raise ValueError(f"列 {name} 的规则必须且只能给出value、expression、lookup中的一项")
+        if rule.get('type') is not None and rule['type'] not in EDIT_COLUMN_TYPES:
+            raise ValueError(f"列 {name} 的类型 {rule['type']} 不受支持，可选: {', '.join(EDIT_COLUMN_TYPES)}")
+        if 'expression' in rule:
+            try:
+                compile(rule['expression'], f"<列 {name} 的表达式>", 'eval')
+            except SyntaxError as e:
+                raise ValueError(f"列 {name} 的表达式有语法错误: {e}")
+        if 'lookup' in rule and rule['lookup'] not in lookups:
+            raise ValueError(f"列 {name} 引用了未定义的查找表 {rule['lookup']}")
+        columns.append(dict(rule))
+    if not columns:
+        raise ValueError(f"规则文件 {rules_file_path} 中没有列规则")
+
+    targets = [os.path.join(base_dir, target) for target in config.get('targets', [])]
+    return {'encoding': config.get('encoding', 'utf-8'), 'columns': columns, 'lookups': lookups,
+            'targets': targets}
+
+
+def _constant_value(rule):
+    """
+    常量规则的值。未指定类型时，ISO格式的日期字符串按日期写入（与modify_shapefile一致）。
+    """
+    value = rule['value']
+    if isinstance(value, str) and rule.get('type') in (None, 'date'):
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            if rule.get('type') == 'date':
+                raise ValueError(f"列 {rule['name']} 的值 {value!r} 不是有效的ISO日期")
+    return value
+
+
+def _find_column(source, name):
+    """
+    按列名（不区分大小写）取原值列表，不存在时返回None。
+    """
+    return next((values for key, values in source.items() if key.lower() == name.lower()), None)
+
+
+def _evaluate_expression(rule, source, record_count, shp_name):
+    """
+    对每个要素计算表达式，表达式中可以直接使用字段名（读取原值，不区分大小写）、SHP_NAME、ROW
+    和EXPRESSION_FUNCTIONS中的函数。
+    """
+    code = compile(rule['expression'], f"<列 {rule['name']} 的表达式>", 'eval')
+    namespace = dict(EXPRESSION_FUNCTIONS, __builtins__={})
+    namespace[EXPRESSION_SHP_NAME] = shp_name
+    columns = [(name, _find_column(source, name)) for name in code.co_names
+               if name not in EXPRESSION_FUNCTIONS and _find_column(source, name) is not None]
+    values = []
+    for row in range(record_count):
+        namespace[EXPRESSION_ROW] = row
+        for name, column in columns:
+            namespace[name] = column[row]
+        try:
+            values.append(eval(code, namespace))
+        except Exception as e:
+            raise ValueError(f"列 {rule['name']} 的表达式在第 {row + 1} 个要素上出错: {e!r}")
+    return values
+
+
+def _referenced_fields(rules, lookups, field_names):
+    """
+    规则需要读取的原字段：被修改的列本身（查找不到时保留原值）、表达式中出现的字段、查找表的连接键。
+    """
+    lowered = {name.lower(): name for name in field_names}
+    wanted = set()
+    for rule in rules:
+        wanted.add(rule['name'].lower())
+        if 'expression' in rule:
+            code = compile(rule['expression'], '<expression>', 'eval')
+            wanted.update(name.lower() for name in code.co_names)
+        if 'lookup' in rule:
+            wanted.add(rule.get('key_field', lookups[rule['lookup']]['key']).lower())
+    return [lowered[name] for name in sorted(wanted) if name in lowered]
+
+
+def edit_shapefile(input_shp_path, output_shp_path, rules):
+    """
+    把规则中的所有列修改一遍写入一个Shapefile。
+
+    Args:
+        input_shp_path (str): 输入Shapefile路径。
+        output_shp_path (str): 输出Shapefile路径，可以与输入相同（原地修改）。
+        rules (dict): load_rules的返回值。
+
+    Returns:
+        dict: path、output、records、columns（修改的列名）、changed（值有变化的单元格数）、seconds、bytes_read。
+    """
+    start = time.perf_counter()
+    if not os.path.exists(input_shp_path):
+        raise FileNotFoundError(f"未找到输入Shapefile: {input_shp_path}")
+    encoding = rules['encoding']
+    dbf_path = find_dbf_path(input_shp_path)
+    header_info = read_dbf_header(dbf_path)
+    record_count = header_info['record_count']
+    field_names = [field['name'] for field in header_info['fields']]
+    source = read_dbf_columns(dbf_path, header_info,
+                              _referenced_fields(rules['columns'], rules['lookups'], field_names), encoding)
+    shp_name = os.path.splitext(os.path.basename(input_shp_path))[0]
+
+    values_by_column = {}
+    new_column_types = {}
+    for rule in rules['columns']:
+        name = rule['name']
+        current = values_by_column.get(name)
+        if current is None:
+            original = _find_column(source, name)
+            current = list(original) if original is not None else [None] * record_count
+        if 'value' in rule:
+            current = [_constant_value(rule)] * record_count
+        elif 'expression' in rule:
+            current = _evaluate_expression(rule, source, record_count, shp_name)
+        else:
+            lookup = rules['lookups'][rule['lookup']]
+            key_field = rule.get('key_field', lookup['key'])
+            keys = _find_column(source, key_field)
+            if keys is None:
+                raise ValueError(f"{input_shp_path} 中没有查找表的连接键列 {key_field}")
+            field = rule.get('field', name)
+            rows = lookup['rows']
+            current = [rows[key.strip()].get(field, value) if isinstance(key, str) and key.strip() in rows
+                       else value for key, value in zip(keys, current)]
+        values_by_column[name] = current
+        if rule.get('type'):
+            new_column_types[name] = rule['type']
+
+    changed = 0
+    for name, values in values_by_column.items():
+        original = _find_column(source, name)
+        # 新增的列每个值都算作变化
+        changed += record_count if original is None else sum(1 for old, new in zip(original, values) if old != new)
+    update_dbf_columns(input_shp_path, output_shp_path, values_by_column, new_column_types, encoding)
+    return {'path': input_shp_path, 'output': output_shp_path, 'records': record_count,
+            'columns': list(values_by_column), 'changed': changed,
+            'seconds': time.perf_counter() - start, 'bytes_read': file_size(dbf_path)}
+
+
+def _init_worker(rules):
+    global _worker_rules
+    _worker_rules = rules
+
+
+def _edit_in_worker(input_shp_path, output_shp_path):
+    try:
+        return edit_shapefile(input_shp_path, output_shp_path, _worker_rules)
+    except Exception as e:
+        # 一个文件出错不影响其他文件，错误在主进程中汇总
+        return {'path': input_shp_path, 'output': output_shp_path, 'error': str(e)}
+
+
+def output_paths(input_shapefiles, output_dir=None, input_dirs=()):
+    """
+    各输入的输出路径：未给出output_dir时原地修改；位于input_dirs中某个目录下的文件在output_dir中
+    保持相对该目录的结构，其余文件直接放在output_dir下。
+    """
+    if not output_dir:
+        return list(input_shapefiles)
+    outputs = []
+    for path in input_shapefiles:
+        relative = os.path.basename(path)
+        for input_dir in input_dirs:
+            candidate = os.path.relpath(os.path.abspath(path), os.path.abspath(input_dir))
+            if not candidate.startswith('..'):
+                relative = candidate
+                break
+        outputs.append(os.path.join(output_dir, relative))
+    duplicates = {path for path in outputs if outputs.count(path) > 1}
+    if duplicates:
+        raise ValueError(f"多个输入对应同一个输出路径: {', '.join(sorted(duplicates))}")
+    return outputs
+
+
+def batch_edit_shapefiles(input_shapefiles, rules, output_shapefiles=None, workers=DEFAULT_EDIT_WORKERS,
+                          metrics=None):
+    """
+    按规则并行修改多个Shapefile，每个文件一遍完成所有列的修改。
+
+    Args:
+        input_shapefiles (list): 输入Shapefile路径列表。
+        rules (dict): load_rules的返回值。
+        output_shapefiles (list): 与输入一一对应的输出路径，为None时原地修改。
+        workers (int): 并行进程数，1为串行，0表示使用全部CPU核心。
+        metrics (StageMetrics): 如果提供，每个文件的修改记为modify阶段（行数为记录数）。
+
+    Returns:
+        list: 各文件的结果（见edit_shapefile），顺序与输入一致；出错的文件含'error'。
+    """
+    output_shapefiles = output_shapefiles or list(input_shapefiles)
+    for output_shp in output_shapefiles:
+        output_dir = os.path.dirname(output_shp)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+    workers = (os.cpu_count() or 1) if workers == 0 else max(workers, 1)
+    workers = max(min(workers, len(input_shapefiles)), 1)
+
+    if workers == 1:
+        _init_worker(rules)
+        results = list(map(_edit_in_worker, input_shapefiles, output_shapefiles))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rules,)) as executor:
+            results = list(executor.map(_edit_in_worker, input_shapefiles, output_shapefiles))
+
+    for result in results:
+        if 'error' in result:
+            print(f"错误: 修改 {result['path']} 失败: {result['error']}")
+            continue
+        if metrics is not None:
+            metrics.add('modify', result['seconds'], result['records'], result['bytes_read'])
+        print(f"已修改 {result['output']}: {result['records']} 个要素，列 {', '.join(result['columns'])}，"
+              f"{result['changed']} 个值有变化")
+    return results
+
+
+# 当脚本作为主程序运行时
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch-edit attribute columns of many Shapefiles from a rules file.")
+    parser.add_argument('rules', help='JSON规则文件，格式见load_rules。')
+    parser.add_argument('inputs', nargs='*',
+                        help='要修改的Shapefile路径（也可以在规则文件的targets中给出）。')
+    parser.add_argument('--input_dir', type=str, default=None,
+                        help='包含要修改的Shapefile的目录（递归搜索）。')
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='输出目录，保持相对目录结构。默认为原地修改。')
+    parser.add_argument('--workers', type=int, default=DEFAULT_EDIT_WORKERS,
+                        help=f'并行处理的进程数，0表示使用全部CPU核心。默认为 {DEFAULT_EDIT_WORKERS}。')
+    parser.add_argument('--metrics_report', type=str, default=None,
+                        help='输出JSON运行报告的路径（耗时、要素数、读取字节数和峰值内存）。')
+    args = parser.parse_args()
+
+    rules = load_rules(args.rules)
+    input_shapefiles = []
+    input_dirs = ([args.input_dir] if args.input_dir else []) + [
+        target for target in rules['targets'] if os.path.isdir(target)]
+    for input_dir in input_dirs:
+        input_shapefiles.extend(FileInventory().scan(input_dir).find_files(input_dir, '.shp', ignore_case=True))
+    input_shapefiles.extend(target for target in rules['targets'] if not os.path.isdir(target))
+    input_shapefiles.extend(args.inputs)
+    # 同一个文件（例如既在目录中又在命令行中给出）只处理一次
+    input_shapefiles = list(dict.fromkeys(os.path.abspath(path) for path in input_shapefiles))
+    if not input_shapefiles:
+        parser.error('必须提供至少一个Shapefile或一个目录（命令行或规则文件的targets中）。')
+
+    metrics = StageMetrics()
+    results = batch_edit_shapefiles(input_shapefiles, rules,
+                                    output_paths(input_shapefiles, args.output_dir, input_dirs),
+                                    args.workers, metrics)
+    failed = sum(1 for result in results if 'error' in result)
+    print(f"已处理 {len(results)} 个Shapefile，{failed} 个失败。")
+    metrics.print_summary()
+    if args.metrics_report:
+        metrics.write_report(args.metrics_report)
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# 对比各输出格式（Shapefile / GeoPackage / FlatGeobuf / GeoParquet）的写入耗时、文件大小和bbox查询耗时
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from osgeo import gdal, ogr
+
+from benchmark_shp_write import make_synthetic_columns
+from hdi_to_csv_processor import (DEFAULT_WRITE_BATCH_SIZE, OUTPUT_FORMATS, create_hdi_point_layer,
+                                  write_hdi_features)
+
+# 合成点的范围，与make_synthetic_columns一致
+_MIN_L, _MIN_B, _SPAN = 114.3, 30.6, 0.1
+
+
+def output_size(file_path):
+    """
+    输出文件及其附属文件（Shapefile的.dbf/.shx/.qix等）的总字节数。
+    """
+    stem = os.path.splitext(file_path)[0]
+    directory = os.path.dirname(file_path)
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+               if os.path.join(directory, name).startswith(stem + '.'))
+
+
+def time_write(file_path, output_format, columns, batch_size):
+    """
+    写入所有点并关闭数据源（空间索引在关闭时建立），返回耗时秒。
+    """
+    start = time.perf_counter()
+    data_source, layer = create_hdi_point_layer(file_path, output_format)
+    write_hdi_features(layer, columns, batch_size)
+    data_source = None
+    return time.perf_counter() - start
+
+
+def time_bbox_queries(file_path, bboxes):
+    """
+    依次用每个bbox设置空间过滤并读出命中的要素，返回(平均每次查询毫秒, 平均命中要素数)。
+    """
+    data_source = gdal.OpenEx(file_path, gdal.OF_VECTOR)
+    layer = data_source.GetLayer(0)
+    hits = 0
+    start = time.perf_counter()
+    for min_l, min_b, max_l, max_b in bboxes:
+        layer.SetSpatialFilterRect(min_l, min_b, max_l, max_b)
+        layer.ResetReading()
+        for _ in layer:
+            hits += 1
+    elapsed = time.perf_counter() - start
+    data_source = None
+    return elapsed * 1000 / len(bboxes), hits / len(bboxes)
+
+
+def make_bboxes(count, size_degrees, seed=1):
+    """
+    在合成点范围内随机生成count个边长为size_degrees的查询框。
+    """
+    rng = random.Random(seed)
+    bboxes = []
+    for _ in range(count):
+        min_l = _MIN_L + rng.random() * (_SPAN - size_degrees)
+        min_b = _MIN_B + rng.random() * (_SPAN - size_degrees)
+        bboxes.append((min_l, min_b, min_l + size_degrees, min_b + size_degrees))
+    return bboxes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark write and bbox query time of each output format.")
+    parser.add_argument('--points', type=int, default=1000000,
+                        help='合成点数量。默认为 1000000。')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_WRITE_BATCH_SIZE,
+                        help=f'每个写入事务包含的要素数量。默认为 {DEFAULT_WRITE_BATCH_SIZE}。')
+    parser.add_argument('--formats', nargs='+', choices=tuple(OUTPUT_FORMATS), default=list(OUTPUT_FORMATS),
+                        help='要测试的输出格式。默认为全部。')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='bbox查询次数。默认为 200。')
+    parser.add_argument('--bbox_size', type=float, default=0.002,
+                        help='查询框边长（度）。默认为 0.002（约200米）。')
+    args = parser.parse_args()
+
+    print(f"生成 {args.points} 个合成点...")
+    columns = make_synthetic_columns(args.points)
+    bboxes = make_bboxes(args.queries, args.bbox_size)
+
+    output_dir = tempfile.mkdtemp(prefix='hdi_format_bench_')
+    try:
+        print(f"{'格式':<12}{'写入(秒)':>10}{'大小(MB)':>10}{'查询(毫秒)':>12}{'命中(个)':>10}")
+        for output_format in args.formats:
+            format_info = OUTPUT_FORMATS[output_format]
+            if ogr.GetDriverByName(format_info['driver']) is None:
+                print(f"{format_info['name']:<12}当前GDAL缺少 {format_info['driver']} 驱动，跳过")
+                continue
+            file_path = os.path.join(output_dir, f'bench_{output_format}' + format_info['extension'])
+            write_seconds = time_write(file_path, output_format, columns, args.batch_size)
+            query_ms, mean_hits = time_bbox_queries(file_path, bboxes)
+            print(f"{format_info['name']:<12}{write_seconds:>10.2f}{output_size(file_path) / 1e6:>10.1f}"
+                  f"{query_ms:>12.3f}{mean_hits:>10.1f}")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# 端到端基准测试：在合成HDI/CCD数据（见synthetic_hdi_data.py）上依次运行处理流程的各阶段，
+# 记录每个阶段的耗时、吞吐量（行/秒）和峰值内存，输出机器可读的JSON报告，便于跟踪性能回退。
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from hdi_to_csv_processor import (DEFAULT_WRITE_BATCH_SIZE, HDI_CSV_HEADER, OUTPUT_FORMATS, OUTPUT_FORMAT_SHP,
+                                  batch_process_hdi_files, convert_csv_to_shp)
+from pipeline_metrics import peak_rss_mb
+from synthetic_hdi_data import generate_dataset
+
+# 可运行的阶段，按执行顺序排列。后面的阶段依赖前面阶段的输出
+BENCHMARK_STAGES = ('generate', 'parse', 'csv_write', 'ogr_write', 'merge', 'modify')
+# 报告格式版本
+REPORT_VERSION = 1
+
+
+def run_stage(stages, name, row_count, func):
+    """
+    运行一个阶段并把计时结果追加到stages。row_count为该阶段处理的行数（可以是返回值的函数）。
+    """
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    rows = row_count(result) if callable(row_count) else row_count
+    stages.append({
+        'stage': name,
+        'seconds': round(seconds, 4),
+        'rows': rows,
+        'rows_per_second': round(rows / seconds, 1) if seconds > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+    })
+    print(f"{name}: {seconds:.2f} 秒, {rows} 行")
+    return result
+
+
+def run_benchmark(data_dir, work_dir, stages_to_run, rows, folders, seed, workers, batch_size, output_format,
+                  merge_copies):
+    """
+    依次运行选中的阶段，返回报告字典。
+
+    Args:
+        data_dir (str): 合成数据目录；包含generate阶段时在此生成。
+        work_dir (str): 输出CSV/Shapefile的目录。
+        stages_to_run (list): 要运行的阶段，取值见BENCHMARK_STAGES。
+        merge_copies (int): merge阶段合并的输入份数（同一个Shapefile重复多次）。
+    """
+    stages = []
+    dataset = None
+    csv_file_path = os.path.join(work_dir, 'benchmark.csv')
+    shp_file_path = os.path.join(work_dir, f"benchmark{OUTPUT_FORMATS[output_format]['extension']}")
+    total_start = time.perf_counter()
+
+    if 'generate' in stages_to_run:
+        dataset = run_stage(stages, 'generate', lambda summary: summary['rows'],
+                            lambda: generate_dataset(data_dir, rows, folders, seed))
+
+    processed_rows = None
+    if 'parse' in stages_to_run:
+        processed_rows = run_stage(stages, 'parse', len,
+                                   lambda: batch_process_hdi_files(data_dir, data_dir, workers))
+    row_count = len(processed_rows) if processed_rows is not None else 0
+
+    if 'csv_write' in stages_to_run:
+        if processed_rows is None:
+            raise ValueError("csv_write阶段需要先运行parse阶段。")
+
+        def write_csv():
+            with open(csv_file_path, 'w', newline='') as outfile:
+                writer = csv.writer(outfile)
+                writer.writerow(HDI_CSV_HEADER)
+                writer.writerows(processed_rows)
+        run_stage(stages, 'csv_write', row_count, write_csv)
+        processed_rows = None # 释放内存，后续阶段从CSV/Shapefile读取
+
+    if 'ogr_write' in stages_to_run:
+        if not os.path.exists(csv_file_path):
+            raise ValueError("ogr_write阶段需要先运行csv_write阶段。")
+        run_stage(stages, 'ogr_write', row_count,
+                  lambda: convert_csv_to_shp(csv_file_path, shp_file_path, batch_size, output_format))
+
+    if 'merge' in stages_to_run:
+        if output_format != OUTPUT_FORMAT_SHP or not os.path.exists(shp_file_path):
+            raise ValueError("merge阶段需要先以Shapefile格式运行ogr_write阶段。")
+        from merge_shp_data import merge_shapefiles
+        run_stage(stages, 'merge', lambda feature_count: feature_count,
+                  lambda: merge_shapefiles([shp_file_path] * merge_copies,
+                                           os.path.join(work_dir, 'benchmark_merged.shp')))
+
+    if 'modify' in stages_to_run:
+        if output_format != OUTPUT_FORMAT_SHP or not os.path.exists(shp_file_path):
+            raise ValueError("modify阶段需要先以Shapefile格式运行ogr_write阶段。")
+        from modify_shp_data import modify_shapefile
+        run_stage(stages, 'modify', row_count,
+                  lambda: modify_shapefile(shp_file_path, os.path.join(work_dir, 'benchmark_modified.shp'),
+                                           '2025-08-19'))
+
+    return {
+        'version': REPORT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': {'python': platform.python_version(), 'system': platform.platform(),
+                     'cpu_count': os.cpu_count()},
+        'options': {'workers': workers, 'batch_size': batch_size, 'format': output_format,
+                    'merge_copies': merge_copies},
+        'dataset': dataset or {'output_dir': os.path.abspath(data_dir)},
+        'stages': stages,
+        'total_seconds': round(time.perf_counter() - total_start, 4),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the HDI pipeline on synthetic data and report JSON.")
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='合成数据的HDI总行数。默认为 100000。')
+    parser.add_argument('--folders', type=int, default=10,
+                        help='合成数据的HDI文件夹数。默认为 10。')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='合成数据的随机种子。默认为 0。')
+    parser.add_argument('--data_dir', type=str, default=None,
+                        help='使用已有的数据目录（不运行generate阶段）。默认在临时目录中生成合成数据。')
+    parser.add_argument('--stages', nargs='+', choices=BENCHMARK_STAGES, default=list(BENCHMARK_STAGES),
+                        help='要运行的阶段。默认为全部。')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='parse阶段的并行进程数。默认为 1。')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_WRITE_BATCH_SIZE,
+                        help=f'ogr_write阶段每个事务的要素数量。默认为 {DEFAULT_WRITE_BATCH_SIZE}。')
+    parser.add_argument('--format', choices=tuple(OUTPUT_FORMATS), default=OUTPUT_FORMAT_SHP,
+                        help='ogr_write阶段的输出格式。merge/modify阶段要求shp。默认为 shp。')
+    parser.add_argument('--merge_copies', type=int, default=2,
+                        help='merge阶段合并的输入份数。默认为 2。')
+    parser.add_argument('--output', type=str, default=None,
+                        help='JSON报告的输出路径。默认打印到标准输出。')
+    parser.add_argument('--keep', action='store_true',
+                        help='保留生成的数据和输出文件（默认在结束后删除临时目录）。')
+    args = parser.parse_args()
+
+    stages_to_run = list(args.stages)
+    temp_dir = tempfile.mkdtemp(prefix='hdi_pipeline_bench_')
+    data_dir = args.data_dir
+    if data_dir:
+        stages_to_run = [stage for stage in stages_to_run if stage != 'generate']
+    else:
+        data_dir = os.path.join(temp_dir, 'data')
+    try:
+        # 报告打印到标准输出时，处理过程中的提示信息改写到标准错误，保证标准输出只有JSON
+        with contextlib.redirect_stdout(sys.stdout if args.output else sys.stderr):
+            report = run_benchmark(data_dir, temp_dir, stages_to_run, args.rows, args.folders, args.seed,
+                                   args.workers, args.batch_size, args.format, args.merge_copies)
+    finally:
+        if args.keep:
+            print(f"数据和输出文件保留在 {temp_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report_text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as outfile:
+            outfile.write(report_text)
+        print(f"基准测试报告已写入 {args.output}")
+    else:
+        print(report_text)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# 对比逐要素写入与按事务批量写入Shapefile的吞吐量（要素/秒）
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from osgeo import ogr
+
+from hdi_to_csv_processor import (DEFAULT_WRITE_BATCH_SIZE, create_hdi_point_layer,
+                                  write_hdi_features)
+
+
+def make_synthetic_columns(point_count, seed=0):
+    """
+    生成合成的HDI点列数据，顺序与HDI_CSV_HEADER一致。
+
+    Args:
+        point_count (int): 点数量。
+        seed (int): 随机种子，保证多次运行数据一致。
+    """
+    rng = random.Random(seed)
+    file_names = [f"00000000-01-{20250819111548477 + i * 1200}.jpg" for i in range(point_count)]
+    file_paths = [f"20250819_1（轨迹）/20250819_1-1(卢沟桥路）/CCD/{name}" for name in file_names]
+    road_names = ['卢沟桥路'] * point_count
+    b_values = [30.6 + rng.random() * 0.1 for _ in range(point_count)]
+    l_values = [114.3 + rng.random() * 0.1 for _ in range(point_count)]
+    h_values = [10.0 + rng.random() for _ in range(point_count)]
+    heading_values = [rng.uniform(-180.0, 180.0) for _ in range(point_count)]
+    return [file_names, file_paths, road_names, b_values, l_values, h_values, heading_values]
+
+
+def write_per_feature(layer, columns):
+    """
+    原实现的写法：每行新建一个要素和一个点几何，不使用事务。
+    """
+    file_names, file_paths, road_names, b_values, l_values, h_values, heading_values = columns
+    for i in range(len(file_names)):
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField("FILE_NAME", file_names[i])
+        feature.SetField("FILE_PATH", file_paths[i])
+        feature.SetField("ROAD_NAME", road_names[i])
+        feature.SetField("B", b_values[i])
+        feature.SetField("L", l_values[i])
+        feature.SetField("H", h_values[i])
+        feature.SetField("HEADING", heading_values[i])
+
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.SetPoint(0, l_values[i], b_values[i])
+        feature.SetGeometry(point)
+
+        layer.CreateFeature(feature)
+        feature = None
+    return len(file_names)
+
+
+def time_write(shp_file_path, write_func):
+    """
+    创建图层并调用write_func写入，返回(要素数量, 耗时秒)。计时包含关闭数据源时的落盘。
+    """
+    start = time.perf_counter()
+    data_source, layer = create_hdi_point_layer(shp_file_path)
+    feature_count = write_func(layer)
+    data_source = None
+    return feature_count, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-feature vs batched Shapefile writes.")
+    parser.add_argument('--points', type=int, default=1000000,
+                        help='合成点数量。默认为 1000000。')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_WRITE_BATCH_SIZE,
+                        help=f'批量写入时每个事务包含的要素数量。默认为 {DEFAULT_WRITE_BATCH_SIZE}。')
+    args = parser.parse_args()
+
+    print(f"生成 {args.points} 个合成点...")
+    columns = make_synthetic_columns(args.points)
+
+    output_dir = tempfile.mkdtemp(prefix='hdi_bench_')
+    try:
+        before_count, before_seconds = time_write(
+            os.path.join(output_dir, 'before.shp'),
+            lambda layer: write_per_feature(layer, columns))
+        after_count, after_seconds = time_write(
+            os.path.join(output_dir, 'after.shp'),
+            lambda layer: write_hdi_features(layer, columns, args.batch_size))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    before_rate = before_count / before_seconds
+    after_rate = after_count / after_seconds
+    print(f"逐要素写入: {before_count} 个要素, {before_seconds:.2f} 秒, {before_rate:,.0f} 要素/秒")
+    print(f"批量写入:   {after_count} 个要素, {after_seconds:.2f} 秒, {after_rate:,.0f} 要素/秒 (batch_size={args.batch_size})")
+    print(f"加速比: {after_rate / before_rate:.2f}x")
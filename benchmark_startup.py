@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# 启动耗时基准测试：为每个入口脚本多次启动新的Python进程（命令行脚本运行--help，GUI脚本只导入模块、不创建窗口），
+# 记录从启动到退出的耗时，并检查启动过程中加载了哪些重量级模块（GDAL、fiona、tkinter），输出JSON报告。
+# 批处理脚本成百上千次调用命令行工具时，启动耗时直接决定总耗时。
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic_hdi_data import generate_dataset
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# 需要检查是否在启动时加载的重量级模块
+HEAVY_MODULES = ('osgeo', 'fiona', 'tkinter')
+# 入口名称 -> (脚本, 参数)。参数为None时只导入模块；参数中的{data_dir}替换为合成数据目录
+STARTUP_ENTRY_POINTS = {
+    'hdi_to_csv_processor': ('hdi_to_csv_processor.py', ['--help']),
+    'hdi_to_csv_processor_csv_only': ('hdi_to_csv_processor.py',
+                                      ['--csv_only', '--input_dir', '{data_dir}', '--base_path', '{data_dir}']),
+    'merge_shp_data': ('merge_shp_data.py', ['--help']),
+    'modify_shp_data': ('modify_shp_data.py', []), # 参数不足时打印用法后退出
+    'panorama_index': ('panorama_index.py', ['--help']),
+    'synthetic_hdi_data': ('synthetic_hdi_data.py', ['--help']),
+    'hdi_processor_gui': ('hdi_processor_gui.py', None),
+    'merge_shp_gui': ('merge_shp_gui.py', None),
+    'modify_shp_gui': ('modify_shp_gui.py', None),
+}
+# csv_only入口使用的合成数据行数
+CSV_RUN_ROWS = 2000
+# 报告格式版本
+REPORT_VERSION = 1
+
+# 子进程中运行入口脚本，结束后把已加载的重量级模块写入STARTUP_PROBE_OUTPUT指定的文件
+_PROBE_CODE = '''
+import json, os, runpy, sys
+script, as_main = sys.argv[1], sys.argv[2] == '1'
+sys.argv = [script] + sys.argv[3:]
+sys.path.insert(0, os.path.dirname(script))
+status = 0
+try:
+    runpy.run_path(script, run_name='__main__' if as_main else 'startup_probe')
+except SystemExit as e:
+    status = e.code if isinstance(e.code, int) else 0
+heavy = sorted({name.split('.')[0] for name in sys.modules} & set(json.loads(os.environ['STARTUP_PROBE_HEAVY'])))
+with open(os.environ['STARTUP_PROBE_OUTPUT'], 'w') as outfile:
+    json.dump({'status': status, 'heavy_modules': heavy}, outfile)
+'''
+
+
+def probe_command(script, args):
+    """
+    启动一个入口脚本的命令行。args为None时只导入模块，否则以__main__运行并传入args。
+    """
+    return [sys.executable, '-c', _PROBE_CODE, os.path.join(SCRIPT_DIR, script),
+            '0' if args is None else '1'] + list(args or [])
+
+
+def time_entry_point(script, args, runs, work_dir):
+    """
+    运行runs次，返回该入口的计时结果字典。每次都是新的进程，计时包含解释器启动。
+    """
+    probe_output = os.path.join(work_dir, 'probe.json')
+    env = dict(os.environ, STARTUP_PROBE_OUTPUT=probe_output, STARTUP_PROBE_HEAVY=json.dumps(HEAVY_MODULES))
+    seconds = []
+    probe = None
+    error = None
+    for _ in range(runs):
+        if os.path.exists(probe_output):
+            os.remove(probe_output)
+        start = time.perf_counter()
+        completed = subprocess.run(probe_command(script, args), cwd=work_dir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        seconds.append(time.perf_counter() - start)
+        if not os.path.exists(probe_output):
+            # 导入失败（例如缺少依赖）时子进程没有写出结果
+            stderr_lines = completed.stderr.decode('utf-8', 'replace').strip().splitlines()
+            error = stderr_lines[-1] if stderr_lines else '未知错误'
+            break
+        with open(probe_output, encoding='utf-8') as infile:
+            probe = json.load(infile)
+    return {
+        'script': script,
+        'args': args,
+        'runs': len(seconds),
+        'median_seconds': round(statistics.median(seconds), 4),
+        'min_seconds': round(min(seconds), 4),
+        'heavy_modules': probe['heavy_modules'] if probe else None,
+        'exit_status': probe['status'] if probe else None,
+        'error': error,
+    }
+
+
+def run_startup_benchmark(entry_names, runs, work_dir):
+    """
+    依次测试选中的入口，返回报告字典。
+    """
+    data_dir = os.path.join(work_dir, 'data')
+    if any('{data_dir}' in ' '.join(STARTUP_ENTRY_POINTS[name][1] or []) for name in entry_names):
+        generate_dataset(data_dir, CSV_RUN_ROWS, folders=2)
+
+    entries = {}
+    for name in entry_names:
+        script, args = STARTUP_ENTRY_POINTS[name]
+        if args is not None:
+            args = [arg.replace('{data_dir}', data_dir) for arg in args]
+        entries[name] = result = time_entry_point(script, args, runs, work_dir)
+        loaded = ', '.join(result['heavy_modules'] or []) or '无'
+        print(f"{name}: {result['median_seconds']:.3f} 秒（中位数），加载的重量级模块: {loaded}"
+              + (f"，失败: {result['error']}" if result['error'] else ''))
+
+    return {
+        'version': REPORT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': {'python': platform.python_version(), 'system': platform.platform(),
+                     'executable': sys.executable},
+        'runs': runs,
+        'entries': entries,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure start-up time of each entry point and report JSON.")
+    parser.add_argument('--entries', nargs='+', choices=tuple(STARTUP_ENTRY_POINTS),
+                        default=list(STARTUP_ENTRY_POINTS),
+                        help='要测试的入口。默认为全部。')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='每个入口启动的次数，报告中位数和最小值。默认为 5。')
+    parser.add_argument('--output', type=str, default=None,
+                        help='JSON报告的输出路径。默认打印到标准输出。')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix='hdi_startup_bench_')
+    try:
+        # 报告打印到标准输出时，进度信息改写到标准错误，保证标准输出只有JSON
+        with contextlib.redirect_stdout(sys.stdout if args.output else sys.stderr):
+            report = run_startup_benchmark(args.entries, max(args.runs, 1), temp_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report_text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as outfile:
+            outfile.write(report_text)
+        print(f"启动耗时报告已写入 {args.output}")
+    else:
+        print(report_text)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# 要素键索引：更新模式下记录输出图层中每个键（FILE_NAME或FILE_PATH）对应的要素FID和内容摘要，
+# 判断新要素是否已存在时只需在磁盘上的排序数组中二分查找，不必扫描已有图层。
+# 索引以.npy文件保存在输出文件旁的 <输出文件>.keyidx 目录中，以内存映射方式打开。
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# 索引格式版本
+KEY_INDEX_VERSION = 2
+# 可用作更新键的字段
+UPSERT_KEY_FIELDS = ('FILE_NAME', 'FILE_PATH')
+# 索引目录的后缀
+KEY_INDEX_SUFFIX = '.keyidx'
+
+_META_FILE_NAME = 'meta.json'
+_ARRAY_NAMES = ('keys', 'fids', 'digests')
+# 空键的哈希值：没有配对照片的行FILE_NAME/FILE_PATH为空，改用内容键（见content_keys）
+EMPTY_KEY = 0
+# 摘要中数值保留的小数位数：Shapefile的实数字段读回时精度有限，按此舍入后写入时和读回时的摘要一致
+_DIGEST_DECIMALS = 9
+# 查找不到的键的摘要值，实际的摘要不为0，与它都不同
+UNKNOWN_DIGEST = 0
+
+
+def key_index_dir(output_file_path):
+    """
+    输出文件对应的键索引目录，例如 merged_hdi_data.shp.keyidx。
+    """
+    return output_file_path + KEY_INDEX_SUFFIX
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def hash_keys(values):
+    """
+    把键（字符串）转换为64位哈希值数组，空键为EMPTY_KEY。
+    """
+    hashes = np.empty(len(values), dtype=np.uint64)
+    for i, value in enumerate(values):
+        hashes[i] = _hash64(str(value).encode('utf-8')) if value else EMPTY_KEY
+    return hashes
+
+
+def _normalize_value(value):
+    """
+    把属性值规范为文本：空值与空字符串相同，数值（包括写成文本的数值，例如CSV中的IMG_WIDTH）按固定小数位数格式化。
+    """
+    if value is None:
+        return ''
+    if isinstance(value, (str, int, float)):
+        try:
+            number = float(value)
+        except ValueError:
+            return value.strip()
+        if np.isfinite(number):
+            return f'{round(number, _DIGEST_DECIMALS):.{_DIGEST_DECIMALS}f}'
+    return repr(value)
+
+
+def feature_digest(values):
+    """
+    要素内容（属性值和坐标）的64位摘要，用于判断已存在的要素是否有变化。值先经过规范化，
+    因此写入时由原始数据计算的摘要与从图层读回要素计算的摘要相同（见FeatureKeyIndex.build）。
+    """
+    return _hash64('\x1f'.join(_normalize_value(value) for value in values).encode('utf-8')) or 1
+
+
+def _output_signature(output_file_path):
+    """
+    输出文件的大小和修改时间。Shapefile只改属性时只有.dbf变化，因此一并记录。
+    与保存索引时不一致说明文件被其他程序改过，索引需要重建。
+    """
+    stem, extension = os.path.splitext(output_file_path)
+    paths = [output_file_path] + ([stem + '.dbf'] if extension.lower() == '.shp' else [])
+    signature = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append([stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+class FeatureKeyIndex:
+    """
+    键 -> (FID, 内容摘要) 的索引。已保存的部分为按键排序的数组（内存映射），
+    本次运行新增或替换的要素记录在pending中，save时合并成新的排序数组。
+    """
+
+    def __init__(self, key_field, keys, fids, digests):
+        self.key_field = key_field
+        self.keys = keys
+        self.fids = fids
+        self.digests = digests
+        # 键哈希 -> (FID, 摘要)，覆盖已保存的部分
+        self.pending = {}
+        # 无键行的内容摘要 -> 本次已出现的次数，内容完全相同的多行按出现顺序得到不同的内容键
+        self.content_seen = {}
+
+    @classmethod
+    def load(cls, output_file_path, key_field):
+        """
+        打开输出文件的键索引；索引不存在、版本或键字段不同、或输出文件在保存索引后被改过时返回None。
+        """
+        index_dir = key_index_dir(output_file_path)
+        meta_path = os.path.join(index_dir, _META_FILE_NAME)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as infile:
+                meta = json.load(infile)
+            if (meta.get('version') != KEY_INDEX_VERSION or meta.get('key_field') != key_field
+                    or meta.get('signature') != _output_signature(output_file_path)):
+                return None
+            arrays = [np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r') for name in _ARRAY_NAMES]
+        except (OSError, ValueError):
+            return None
+        return cls(key_field, *arrays)
+
+    @classmethod
+    def build(cls, layer, key_field, feature_values):
+        """
+        扫描已有图层建立索引（只在索引缺失或过期时进行一次）。feature_values(feature)返回计算摘要用的值，
+        应与写入时计算摘要的值一致，重建后未变化的要素（包括无键的行）仍能识别。图层中已有重复键时保留FID最大的一个。
+        """
+        field_index = layer.GetLayerDefn().GetFieldIndex(key_field)
+        if field_index < 0:
+            raise ValueError(f"输出图层中没有键字段 {key_field}")
+        keys = []
+        fids = []
+        digests = []
+        layer.ResetReading()
+        for feature in layer:
+            keys.append(feature.GetField(field_index))
+            fids.append(feature.GetFID())
+            digests.append(feature_digest(feature_values(feature)))
+        layer.ResetReading()
+        index = cls(key_field, np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64),
+                    np.empty(0, dtype=np.uint64))
+        digests = np.array(digests, dtype=np.uint64)
+        index.record(index.content_keys(hash_keys(keys), digests), fids, digests)
+        # 出现次数只在一次运行内计数
+        index.content_seen = {}
+        return index
+
+    @classmethod
+    def load_or_build(cls, output_file_path, layer, key_field, feature_values):
+        """
+        打开保存的索引，不可用时扫描layer重建（feature_values见build）。需在向layer写入要素之前调用。
+        """
+        index = cls.load(output_file_path, key_field)
+        if index is None:
+            if layer.GetFeatureCount() > 0:
+                print(f"键索引不存在或已过期，扫描已有图层重建: {output_file_path}")
+            index = cls.build(layer, key_field, feature_values)
+        return index
+
+    def content_keys(self, key_hashes, digests):
+        """
+        为空键的行生成内容键：由内容摘要和该内容在本次运行中第几次出现得到。重复运行同一批数据时内容键不变，
+        未配对照片的行不会被重复追加；内容有变化的无键行无法对应到原来的要素，作为新要素追加。
+        """
+        key_hashes = np.array(key_hashes, dtype=np.uint64)
+        for i in np.flatnonzero(key_hashes == EMPTY_KEY).tolist():
+            digest = int(digests[i])
+            occurrence = self.content_seen.get(digest, 0)
+            self.content_seen[digest] = occurrence + 1
+            key_hashes[i] = _hash64(b'content' + digest.to_bytes(8, 'little') + occurrence.to_bytes(8, 'little')) or 1
+        return key_hashes
+
+    def _lookup_saved(self, key_hashes):
+        """
+        在已保存的排序数组中查找，返回(FID数组, 摘要数组)，不存在的键FID为-1。
+        """
+        fids = np.full(key_hashes.size, -1, dtype=np.int64)
+        digests = np.full(key_hashes.size, UNKNOWN_DIGEST, dtype=np.uint64)
+        if self.keys.size and key_hashes.size:
+            positions = np.minimum(np.searchsorted(self.keys, key_hashes), self.keys.size - 1)
+            found = self.keys[positions] == key_hashes
+            fids[found] = self.fids[positions[found]]
+            digests[found] = self.digests[positions[found]]
+        return fids, digests
+
+    def plan(self, key_hashes, digests):
+        """
+        决定一批要素如何写入。空键的行使用内容键（见content_keys）；同一批中重复的键只写最后一个；
+        已存在且摘要相同的要素跳过。
+
+        Returns:
+            tuple: (keys, fids, write, counts)。keys为实际使用的键（空键已换成内容键），写入后传给record；
+                   fids为要替换的已有要素FID（新要素为-1），write为需要写入的行的布尔数组，
+                   counts为 {'added', 'replaced', 'unchanged', 'duplicate', 'unkeyed'} 各类要素的数量，
+                   unkeyed为使用内容键的行数（这些行同时计入前几类）。
+        """
+        counts = dict.fromkeys(('added', 'replaced', 'unchanged', 'duplicate', 'unkeyed'), 0)
+        counts['unkeyed'] = int(np.count_nonzero(np.asarray(key_hashes, dtype=np.uint64) == EMPTY_KEY))
+        key_hashes = self.content_keys(key_hashes, digests)
+        fids, saved_digests = self._lookup_saved(key_hashes)
+        write = np.ones(key_hashes.size, dtype=bool)
+        last_row = {key_hash: i for i, key_hash in enumerate(key_hashes.tolist())}
+        for i, key_hash in enumerate(key_hashes.tolist()):
+            if last_row[key_hash] != i:
+                write[i] = False
+                counts['duplicate'] += 1
+                continue
+            entry = self.pending.get(key_hash)
+            fid, saved_digest = entry if entry is not None else (int(fids[i]), int(saved_digests[i]))
+            fids[i] = fid
+            if fid < 0:
+                counts['added'] += 1
+            elif saved_digest == digests[i]:
+                write[i] = False
+                counts['unchanged'] += 1
+            else:
+                counts['replaced'] += 1
+        return key_hashes, fids, write, counts
+
+    def record(self, key_hashes, fids, digests):
+        """
+        记录写入后的要素（新要素的FID由图层分配）。key_hashes为plan返回的键。
+        """
+        for key_hash, fid, digest in zip(np.asarray(key_hashes).tolist(), fids, digests):
+            self.pending[key_hash] = (int(fid), int(digest))
+
+    def save(self, output_file_path):
+        """
+        合并本次的变化并保存索引。需在输出数据源关闭（写入磁盘）之后调用，以记录输出文件的最终状态。
+        """
+        keys = np.array(self.keys, dtype=np.uint64)
+        fids = np.array(self.fids, dtype=np.int64)
+        digests = np.array(self.digests, dtype=np.uint64)
+        if self.pending:
+            pending_keys = np.fromiter(self.pending.keys(), dtype=np.uint64, count=len(self.pending))
+            pending_fids = np.fromiter((fid for fid, _ in self.pending.values()), dtype=np.int64,
+                                       count=len(self.pending))
+            pending_digests = np.fromiter((digest for _, digest in self.pending.values()), dtype=np.uint64,
+                                          count=len(self.pending))
+            keep = ~np.isin(keys, pending_keys)
+            keys = np.concatenate([keys[keep], pending_keys])
+            fids = np.concatenate([fids[keep], pending_fids])
+            digests = np.concatenate([digests[keep], pending_digests])
+            order = np.argsort(keys, kind='stable')
+            keys, fids, digests = keys[order], fids[order], digests[order]
+
+        index_dir = key_index_dir(output_file_path)
+        temp_dir = index_dir + '.tmp'
+        if os.path.isdir(temp_dir):
+            shutil.rmtree(temp_dir)
+        os.makedirs(temp_dir)
+        for name, values in zip(_ARRAY_NAMES, (keys, fids, digests)):
+            np.save(os.path.join(temp_dir, f'{name}.npy'), values)
+        meta = {'version': KEY_INDEX_VERSION, 'key_field': self.key_field, 'count': int(keys.size),
+                'signature': _output_signature(output_file_path)}
+        with open(os.path.join(temp_dir, _META_FILE_NAME), 'w', encoding='utf-8') as outfile:
+            json.dump(meta, outfile)
+        # 先释放内存映射再替换目录（Windows上被映射的文件不能删除）
+        self.keys, self.fids, self.digests = keys, fids, digests
+        self.pending = {}
+        if os.path.isdir(index_dir):
+            shutil.rmtree(index_dir)
+        os.replace(temp_dir, index_dir)
+
+
+def merge_upsert_counts(total, counts):
+    """
+    把一批的计数累加到total中。
+    """
+    for name, count in counts.items():
+        total[name] = total.get(name, 0) + count
+    return total
+
+
+def format_upsert_counts(counts):
+    return (f"新增 {counts.get('added', 0)}，替换 {counts.get('replaced', 0)}，未变化 {counts.get('unchanged', 0)}，"
+            f"同批重复 {counts.get('duplicate', 0)}（其中 {counts.get('unkeyed', 0)} 行无键，按内容识别）")
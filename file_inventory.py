@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# 文件清单：用线程池并行os.scandir扫描目录树，记录每个文件的大小和修改时间，并可保存到磁盘。
+# 再次扫描时，修改时间未变化的目录直接沿用清单中的列表，只重新列出发生变化的目录。
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 清单格式版本
+INVENTORY_VERSION = 1
+# 默认清单文件名称（位于缓存目录下）
+DEFAULT_INVENTORY_FILE_NAME = 'inventory.json'
+# 默认扫描线程数。扫描主要在等待文件系统（尤其是网络存储）返回，线程数可以远多于CPU核心数。
+DEFAULT_SCAN_WORKERS = 16
+
+# 修改时间距扫描时刻不足该值（纳秒）的目录，下次扫描时不信任其修改时间：
+# 同一时间精度内的后续改动不会再改变目录的修改时间。
+_UNSTABLE_MTIME_NS = 2 * 10 ** 9
+
+
+class FileInventory:
+    """
+    目录树的文件清单。
+
+    directories以目录绝对路径为键，值为{'mtime_ns': 目录修改时间, 'files': {文件名: [大小, 修改时间]},
+    'dirs': [子目录名]}。目录的修改时间只在其直接包含的条目增删或改名时变化，
+    因此修改时间未变的目录可以沿用上次的列表；但其中文件内容被原地改写时，记录的大小和修改时间可能过期。
+    """
+
+    def __init__(self, inventory_path=None, workers=DEFAULT_SCAN_WORKERS):
+        self.inventory_path = inventory_path
+        self.workers = max(int(workers), 1)
+        self.directories = {}
+        self.scanned = 0
+        self.reused = 0
+        self._dirty = False
+        if inventory_path and os.path.exists(inventory_path):
+            try:
+                with open(inventory_path, 'r', encoding='utf-8') as infile:
+                    inventory = json.load(infile)
+                if inventory.get('version') == INVENTORY_VERSION:
+                    self.directories = inventory.get('directories', {})
+            except (OSError, ValueError):
+                print(f"警告: 文件清单 {inventory_path} 无法读取，将重新扫描。")
+
+    def _refresh_directory(self, directory, now_ns):
+        """
+        刷新一个目录的记录（不递归），返回其子目录的绝对路径列表。
+        """
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            return directory, None, False
+        entry = self.directories.get(directory)
+        if entry is not None and entry['mtime_ns'] == mtime_ns:
+            return directory, entry, True
+
+        files = {}
+        dirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for item in entries:
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            dirs.append(item.name)
+                        else:
+                            stat = item.stat(follow_symlinks=False)
+                            files[item.name] = [stat.st_size, stat.st_mtime_ns]
+                    except OSError:
+                        # 扫描过程中被删除的条目
+                        continue
+        except OSError as e:
+            print(f"警告: 无法列出目录 {directory}: {e}")
+            return directory, None, False
+        if now_ns - mtime_ns < _UNSTABLE_MTIME_NS:
+            mtime_ns = -1
+        return directory, {'mtime_ns': mtime_ns, 'files': files, 'dirs': sorted(dirs)}, False
+
+    def scan(self, root):
+        """
+        扫描root下的整个目录树：逐层把各目录分发到线程池中并行处理。
+
+        Returns:
+            FileInventory: self，便于链式调用。
+        """
+        root = os.path.abspath(root)
+        visited = set()
+        level = [root]
+        now_ns = time.time_ns()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while level:
+                next_level = []
+                for directory, entry, reused in executor.map(
+                        lambda path: self._refresh_directory(path, now_ns), level):
+                    if entry is None:
+                        if self.directories.pop(directory, None) is not None:
+                            self._dirty = True
+                        continue
+                    visited.add(directory)
+                    if reused:
+                        self.reused += 1
+                    else:
+                        self.scanned += 1
+                        self.directories[directory] = entry
+                        self._dirty = True
+                    next_level.extend(os.path.join(directory, name) for name in entry['dirs'])
+                level = next_level
+
+        # root下已经不存在的目录不再保留
+        prefix = os.path.join(root, '')
+        for directory in list(self.directories):
+            if (directory == root or directory.startswith(prefix)) and directory not in visited:
+                del self.directories[directory]
+                self._dirty = True
+        return self
+
+    def list_files(self, directory):
+        """
+        返回目录中的文件{文件名: [大小, 修改时间]}；目录不在清单中时返回None。
+        """
+        entry = self.directories.get(os.path.abspath(directory))
+        return None if entry is None else entry['files']
+
+    def find_files(self, root, suffix, ignore_case=False):
+        """
+        返回root下（递归）所有以suffix结尾的文件路径，按目录和文件名排序。需先调用scan(root)。
+        """
+        root = os.path.abspath(root)
+        prefix = os.path.join(root, '')
+        if ignore_case:
+            suffix = suffix.lower()
+        found = []
+        for directory in sorted(self.directories):
+            if directory != root and not directory.startswith(prefix):
+                continue
+            for name in sorted(self.directories[directory]['files']):
+                if (name.lower() if ignore_case else name).endswith(suffix):
+                    found.append(os.path.join(directory, name))
+        return found
+
+    def save(self):
+        """
+        将清单写回磁盘（先写临时文件再替换）。
+        """
+        if not self.inventory_path or not self._dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.inventory_path)), exist_ok=True)
+        temp_path = self.inventory_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as outfile:
+            json.dump({'version': INVENTORY_VERSION, 'directories': self.directories}, outfile,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, self.inventory_path)
+        self._dirty = False
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# 按HDI文件缓存处理结果，重复运行时只重新解析新增或变更的文件夹。
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# 缓存格式版本，处理逻辑或存储格式变化时递增，旧缓存自动失效
+CACHE_VERSION = 2
+# 默认缓存目录名称（位于输入目录下）
+DEFAULT_CACHE_DIR_NAME = '.hdi_cache'
+
+_INDEX_FILE_NAME = 'index.json'
+_HASH_CHUNK_BYTES = 1 << 20
+_NUMERIC_COLUMNS = ('B', 'L', 'H', 'HEADING')
+# 附加HDI列在npz中的名称前缀，避免与上面的列重名
+_TRACK_PREFIX = 'track_'
+
+
+def hash_file_content(file_path):
+    """
+    计算文件内容的哈希值（blake2b，128位）。
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(_HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_ccd_listing(hdi_file_path, photo_names=None):
+    """
+    计算HDI文件同级CCD文件夹中JPG文件名列表的哈希值；没有CCD文件夹时返回空字符串。
+    photo_names为已排序的JPG名称列表（例如取自文件清单）时直接使用，不再列出目录。
+    """
+    if photo_names is not None:
+        names = photo_names
+    else:
+        ccd_dir = os.path.join(os.path.dirname(hdi_file_path), 'CCD')
+        if not os.path.isdir(ccd_dir):
+            return ''
+        names = sorted(name for name in os.listdir(ccd_dir) if name.lower().endswith('.jpg'))
+    return hashlib.blake2b('\n'.join(names).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _encode_strings(values):
+    """
+    将字符串列表编码为以换行分隔的UTF-8字节数组，比定长Unicode数组紧凑得多。
+    """
+    return np.frombuffer('\n'.join(values).encode('utf-8'), dtype=np.uint8)
+
+
+def _decode_strings(encoded, count):
+    if count == 0:
+        return []
+    return encoded.tobytes().decode('utf-8').split('\n')
+
+
+class HdiResultCache:
+    """
+    HDI处理结果的磁盘缓存。
+
+    缓存键由HDI路径、文件大小、修改时间、内容哈希、CCD照片列表和base_path以及处理选项组成。
+    大小和修改时间都未变化时直接认为命中；任一变化时重新计算内容哈希，内容相同仍视为命中
+    （例如文件被重新拷贝）。每个文件的结果以npz二进制格式单独存放。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, _INDEX_FILE_NAME)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as infile:
+                    index = json.load(infile)
+                if index.get('version') == CACHE_VERSION:
+                    self.entries = index.get('entries', {})
+            except (OSError, ValueError):
+                print(f"警告: 缓存索引 {self.index_path} 无法读取，将重建缓存。")
+
+    def _entry_file(self, hdi_file_path):
+        name = hashlib.blake2b(os.path.abspath(hdi_file_path).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, name + '.npz')
+
+    def _make_key(self, hdi_file_path, base_path_for_photos, options, photo_names=None):
+        stat = os.stat(hdi_file_path)
+        return {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'ccd': hash_ccd_listing(hdi_file_path, photo_names),
+            'base_path': os.path.abspath(base_path_for_photos),
+            'options': json.dumps(options, sort_keys=True),
+        }
+
+    def lookup(self, hdi_file_path, base_path_for_photos, options, photo_names=None, track_columns=(),
+               need_warnings=False):
+        """
+        查找缓存。photo_names为CCD文件夹中已排序的JPG名称（可选），见hash_ccd_listing。
+        track_columns为需要的附加HDI列（如X、Y、TIMESTAMP），缓存中缺少其中任一列时视为未命中。
+        need_warnings为True时，保存时没有记录警告的条目视为未命中，保证命中缓存时警告汇总和错误报告不少计。
+
+        Returns:
+            tuple: 命中时返回(列, 匹配报告列表, 附加列字典, 警告)，列的格式同process_hdi_to_columns，
+                   警告为该文件WarningLog的categories（保存时没有记录则为None）；未命中返回None。
+        """
+        key = self._make_key(hdi_file_path, base_path_for_photos, options, photo_names)
+        entry = self.entries.get(os.path.abspath(hdi_file_path))
+        result = None
+        if (entry is not None and all(entry.get(name) == key[name] for name in ('ccd', 'base_path', 'options'))
+                and set(track_columns) <= set(entry.get('track_columns', []))
+                and (not need_warnings or entry.get('warnings') is not None)):
+            unchanged = entry['size'] == key['size'] and entry['mtime_ns'] == key['mtime_ns']
+            if not unchanged and entry['size'] == key['size']:
+                # 修改时间变了但内容可能没变（例如重新拷贝），比较内容哈希
+                unchanged = entry['content_hash'] == hash_file_content(hdi_file_path)
+                if unchanged:
+                    entry['mtime_ns'] = key['mtime_ns']
+                    self._dirty = True
+            if unchanged:
+                result = self._load(hdi_file_path, entry, track_columns)
+
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def _load(self, hdi_file_path, entry, track_columns=()):
+        try:
+            with np.load(self._entry_file(hdi_file_path)) as data:
+                count = int(data['count'])
+                columns = [_decode_strings(data['FILE_NAME'], count),
+                           _decode_strings(data['FILE_PATH'], count),
+                           [entry['road_name']] * count]
+                columns.extend(data[name] for name in _NUMERIC_COLUMNS)
+                track = {name: data[_TRACK_PREFIX + name] for name in track_columns}
+        except (OSError, KeyError, ValueError):
+            return None
+        return columns, entry.get('match_reports', []), track, entry.get('warnings')
+
+    def store(self, hdi_file_path, base_path_for_photos, options, columns, match_reports, photo_names=None,
+              track=None, warnings=None):
+        """
+        保存单个HDI文件的处理结果。track为附加HDI列的字典（可选），一并保存。
+        warnings为处理该文件时WarningLog的categories（可选），命中缓存时重新合并到本次的警告日志中。
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        key = self._make_key(hdi_file_path, base_path_for_photos, options, photo_names)
+        key['content_hash'] = hash_file_content(hdi_file_path)
+        file_names, file_paths, road_names = columns[0], columns[1], columns[2]
+        key['road_name'] = road_names[0] if len(road_names) else ''
+        key['match_reports'] = match_reports
+        track = track or {}
+        key['track_columns'] = sorted(track)
+        key['warnings'] = warnings
+
+        with open(self._entry_file(hdi_file_path), 'wb') as outfile:
+            np.savez(outfile,
+                     count=np.int64(len(file_names)),
+                     FILE_NAME=_encode_strings(file_names),
+                     FILE_PATH=_encode_strings(file_paths),
+                     **{name: np.asarray(values, dtype=np.float64)
+                        for name, values in zip(_NUMERIC_COLUMNS, columns[3:])},
+                     **{_TRACK_PREFIX + name: np.asarray(values) for name, values in track.items()})
+        self.entries[os.path.abspath(hdi_file_path)] = key
+        self._dirty = True
+
+    def prune(self, hdi_file_paths):
+        """
+        删除不在hdi_file_paths中的缓存条目（对应的HDI文件已被删除或移走）。
+        """
+        keep = {os.path.abspath(path) for path in hdi_file_paths}
+        for cached_path in list(self.entries):
+            if cached_path not in keep:
+                del self.entries[cached_path]
+                entry_file = self._entry_file(cached_path)
+                if os.path.exists(entry_file):
+                    os.remove(entry_file)
+                self._dirty = True
+
+    def save(self):
+        """
+        将缓存索引写回磁盘（先写临时文件再替换，避免中途中断损坏索引）。
+        """
+        if not self._dirty:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as outfile:
+            json.dump({'version': CACHE_VERSION, 'entries': self.entries}, outfile, ensure_ascii=False)
+        os.replace(temp_path, self.index_path)
+        self._dirty = False
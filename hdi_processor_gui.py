@@ -1,13 +1,24 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 import os
 import sys
+import queue
+import threading
+import multiprocessing
 
 # 确保可以导入 hdi_to_csv_processor.py
 # 如果 hdi_to_csv_processor.py 不在当前目录，需要调整 sys.path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from hdi_to_csv_processor import run_hdi_processing
+from hdi_to_csv_processor import ProcessingCancelled, run_hdi_processing
+from pipeline_metrics import StageMetrics
+from run_log import WarningLog
+
+# 日志泵的刷新间隔（毫秒）以及每次刷新最多处理的消息数
+LOG_PUMP_INTERVAL_MS = 100
+LOG_PUMP_MAX_MESSAGES = 2000
+# 日志窗口最多保留的行数，超出后删除最早的行，避免Text控件越来越慢
+LOG_MAX_LINES = 5000
 
 class HDIProcessorGUI:
     def __init__(self, master):
@@ -38,15 +49,61 @@ class HDIProcessorGUI:
         self.entry_output_name.insert(0, "merged_hdi_data") # Default value
         self.entry_output_name.grid(row=2, column=1, padx=5, pady=5)
 
-        # Process Button
-        self.button_process = tk.Button(master, text="开始处理", command=self.process_files)
-        self.button_process.grid(row=3, column=0, columnspan=3, pady=10)
+        # Trajectory Lines
+        self.var_write_tracks = tk.BooleanVar(value=False)
+        self.check_write_tracks = tk.Checkbutton(master, text="输出轨迹线", variable=self.var_write_tracks)
+        self.check_write_tracks.grid(row=2, column=2, sticky="w", padx=5, pady=5)
+
+        # Worker Processes
+        self.label_workers = tk.Label(master, text="并行进程数 (0=全部核心):")
+        self.label_workers.grid(row=3, column=0, sticky="w", padx=5, pady=5)
+        self.spinbox_workers = tk.Spinbox(master, from_=0, to=max(os.cpu_count() or 1, 1), width=10)
+        self.spinbox_workers.delete(0, tk.END)
+        self.spinbox_workers.insert(0, "1") # Default value
+        self.spinbox_workers.grid(row=3, column=1, sticky="w", padx=5, pady=5)
+
+        # CSV Only
+        self.var_csv_only = tk.BooleanVar(value=False)
+        self.check_csv_only = tk.Checkbutton(master, text="仅输出CSV", variable=self.var_csv_only)
+        self.check_csv_only.grid(row=3, column=2, sticky="w", padx=5, pady=5)
+
+        # Incremental Options: 缓存和文件清单各占一行，放在单独的Frame中，不与其他控件共用网格单元
+        self.frame_options = tk.Frame(master)
+        self.frame_options.grid(row=4, column=0, columnspan=3, sticky="w", padx=5, pady=5)
+        self.var_use_cache = tk.BooleanVar(value=False)
+        self.check_use_cache = tk.Checkbutton(self.frame_options, text="使用缓存（只处理新增或变更的文件夹）",
+                                              variable=self.var_use_cache)
+        self.check_use_cache.pack(side=tk.TOP, anchor="w")
+        self.var_use_inventory = tk.BooleanVar(value=False)
+        self.check_use_inventory = tk.Checkbutton(
+            self.frame_options, text="使用文件清单（记录目录扫描结果，只重新列出有变化的目录）",
+            variable=self.var_use_inventory)
+        self.check_use_inventory.pack(side=tk.TOP, anchor="w")
+
+        # Process / Cancel Buttons
+        self.frame_buttons = tk.Frame(master)
+        self.frame_buttons.grid(row=5, column=0, columnspan=3, pady=10)
+        self.button_process = tk.Button(self.frame_buttons, text="开始处理", command=self.process_files)
+        self.button_process.pack(side=tk.LEFT, padx=5)
+        self.button_cancel = tk.Button(self.frame_buttons, text="取消", command=self.cancel_processing, state=tk.DISABLED)
+        self.button_cancel.pack(side=tk.LEFT, padx=5)
+
+        # Progress
+        self.progress_bar = ttk.Progressbar(master, orient=tk.HORIZONTAL, length=400, mode='determinate')
+        self.progress_bar.grid(row=6, column=0, columnspan=2, sticky="we", padx=5, pady=5)
+        self.label_progress = tk.Label(master, text="")
+        self.label_progress.grid(row=6, column=2, sticky="w", padx=5, pady=5)
 
         # Log Output
         self.log_text = tk.Text(master, height=10, width=70)
-        self.log_text.grid(row=4, column=0, columnspan=3, padx=5, pady=5)
+        self.log_text.grid(row=7, column=0, columnspan=3, padx=5, pady=5)
         self.log_text.config(state=tk.DISABLED) # Make it read-only
 
+        # 后台处理线程与主线程之间的消息队列：("log", 文本) / ("progress", ...) / ("done", ...)
+        self.message_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker_thread = None
+
     def browse_input_dir(self):
         directory = filedialog.askdirectory()
         if directory:
@@ -60,8 +117,15 @@ class HDIProcessorGUI:
             self.entry_base_path.insert(0, directory)
 
     def log_message(self, message):
+        self.append_log(message + "\n")
+
+    def append_log(self, text):
         self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, message + "\n")
+        self.log_text.insert(tk.END, text)
+        # 只保留最近的LOG_MAX_LINES行
+        line_count = int(self.log_text.index('end-1c').split('.')[0])
+        if line_count > LOG_MAX_LINES:
+            self.log_text.delete(1.0, f"{line_count - LOG_MAX_LINES + 1}.0")
         self.log_text.see(tk.END) # Scroll to the end
         self.log_text.config(state=tk.DISABLED)
 
@@ -74,41 +138,133 @@ class HDIProcessorGUI:
             messagebox.showerror("错误", "请选择 HDI 文件目录！")
             return
 
+        try:
+            workers = int(self.spinbox_workers.get())
+        except ValueError:
+            messagebox.showerror("错误", "并行进程数必须是整数！")
+            return
+
         self.log_text.config(state=tk.NORMAL)
         self.log_text.delete(1.0, tk.END)
         self.log_text.config(state=tk.DISABLED)
         self.log_message("开始处理...")
 
-        try:
-            # Redirect stdout to capture print statements
-            old_stdout = sys.stdout
-            sys.stdout = TextRedirector(self.log_text, "stdout")
+        self.progress_bar.config(value=0, maximum=1)
+        self.label_progress.config(text="")
+        self.button_process.config(state=tk.DISABLED)
+        self.button_cancel.config(state=tk.NORMAL)
+        self.cancel_event.clear()
 
-            run_hdi_processing(input_dir, base_path, output_name)
-            self.log_message("处理完成！")
-            messagebox.showinfo("完成", "文件处理成功完成！")
+        # 在后台线程中运行，避免界面在处理期间冻结
+        self.worker_thread = threading.Thread(
+            target=self.run_in_background,
+            args=(input_dir, base_path, output_name, workers, self.var_use_cache.get(), self.var_write_tracks.get(),
+                  self.var_csv_only.get(), self.var_use_inventory.get()),
+            daemon=True)
+        self.worker_thread.start()
+        self.master.after(LOG_PUMP_INTERVAL_MS, self.pump_messages)
+
+    def run_in_background(self, input_dir, base_path, output_name, workers, use_cache, write_tracks, csv_only,
+                          use_inventory):
+        # Redirect stdout to capture print statements
+        old_stdout = sys.stdout
+        sys.stdout = QueueRedirector(self.message_queue)
+        try:
+            run_hdi_processing(input_dir, base_path, output_name, workers=workers, use_cache=use_cache,
+                               progress_callback=self.report_progress, cancel_event=self.cancel_event,
+                               use_inventory=use_inventory, write_tracks=write_tracks, write_shp=not csv_only,
+                               # 处理结束时各阶段耗时摘要和警告汇总打印到日志窗口；同类警告只显示前几条
+                               metrics=StageMetrics(), warning_log=WarningLog())
+            self.message_queue.put(("done", "success", None))
+        except ProcessingCancelled as e:
+            self.message_queue.put(("done", "cancelled", e))
         except Exception as e:
-            self.log_message(f"处理失败: {e}")
-            messagebox.showerror("错误", f"文件处理失败: {e}")
+            self.message_queue.put(("done", "error", e))
         finally:
             sys.stdout = old_stdout # Restore stdout
 
-# Custom class to redirect stdout to tkinter Text widget
-class TextRedirector(object):
-    def __init__(self, widget, tag="stdout"):
-        self.widget = widget
-        self.tag = tag
+    def report_progress(self, files_done, files_total, rows_done):
+        # 在后台线程中调用，只放入队列，由主线程更新界面
+        self.message_queue.put(("progress", files_done, files_total, rows_done))
+
+    def cancel_processing(self):
+        self.cancel_event.set()
+        self.button_cancel.config(state=tk.DISABLED)
+        self.log_message("正在取消，等待当前文件或当前写入批次完成...")
+
+    def pump_messages(self):
+        """
+        定时从队列中取出消息：日志文本合并后一次性插入，进度只取最新的一条。
+        """
+        log_chunks = []
+        latest_progress = None
+        done_message = None
+        for _ in range(LOG_PUMP_MAX_MESSAGES):
+            try:
+                message = self.message_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "log":
+                log_chunks.append(message[1])
+            elif message[0] == "progress":
+                latest_progress = message[1:]
+            else:
+                done_message = message
+                break
+
+        if log_chunks:
+            self.append_log("".join(log_chunks))
+        if latest_progress is not None:
+            files_done, files_total, rows_done = latest_progress
+            self.progress_bar.config(maximum=max(files_total, 1), value=files_done)
+            self.label_progress.config(text=f"文件 {files_done}/{files_total}，{rows_done:,} 行")
+
+        if done_message is None:
+            self.master.after(LOG_PUMP_INTERVAL_MS, self.pump_messages)
+            return
+
+        # 处理结束前再取一次剩余的日志
+        remaining = []
+        while True:
+            try:
+                message = self.message_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "log":
+                remaining.append(message[1])
+        if remaining:
+            self.append_log("".join(remaining))
+        self.finish_processing(done_message[1], done_message[2])
+
+    def finish_processing(self, status, error):
+        self.button_process.config(state=tk.NORMAL)
+        self.button_cancel.config(state=tk.DISABLED)
+        self.worker_thread = None
+        if status == "success":
+            self.log_message("处理完成！")
+            messagebox.showinfo("完成", "文件处理成功完成！")
+        elif status == "cancelled":
+            self.log_message("处理已取消，输出文件可能不完整。")
+            messagebox.showwarning("已取消", "处理已取消，输出文件可能不完整。")
+        else:
+            self.log_message(f"处理失败: {error}")
+            messagebox.showerror("错误", f"文件处理失败: {error}")
+
+# Custom class to redirect stdout to a queue, drained by HDIProcessorGUI.pump_messages
+class QueueRedirector(object):
+    def __init__(self, message_queue):
+        self.message_queue = message_queue
 
     def write(self, str):
-        self.widget.config(state=tk.NORMAL)
-        self.widget.insert(tk.END, str, (self.tag,))
-        self.widget.see(tk.END)
-        self.widget.config(state=tk.DISABLED)
+        if str:
+            self.message_queue.put(("log", str))
 
     def flush(self):
         pass
 
 if __name__ == "__main__":
+    # 打包为exe后，进程池的子进程需要此调用才能正常启动
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = HDIProcessorGUI(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+# 基于NumPy的HDI列式读取器：把文件内存映射后直接在原始字节上定位行和字段边界，
+# 只把需要的列转换为带类型的数组，不再为每行构造字符串列表。
+# 支持按字节范围读取，一个很大的HDI文件可以切成若干段由多个进程分别解析。
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# HDI文件每行至少需要的列数（到HEADING为止）
+HDI_MIN_COLUMNS = 15
+
+# HDI固定列布局：列名 -> (列号, 数据类型)
+HDI_COLUMN_LAYOUT = {
+    'ID': (0, 'S'),             # 形如 00000000-01-20250819111548477，末尾17位为毫秒时间戳
+    'YEAR': (2, np.int16),
+    'MONTH': (3, np.int8),
+    'DAY': (4, np.int8),
+    'HOUR': (5, np.int8),
+    'MINUTE': (6, np.int8),
+    'SECOND': (7, np.int8),
+    'MILLISECOND': (8, np.int16),
+    'X': (9, np.float64),        # 投影坐标X
+    'Y': (10, np.float64),       # 投影坐标Y
+    'H': (11, np.float64),       # 高程
+    'L': (12, np.float64),       # 经度
+    'B': (13, np.float64),       # 纬度
+    'HEADING': (14, np.float64),
+    'PITCH': (15, np.float64),
+    'ROLL': (16, np.float64),
+}
+
+# 输出Shapefile默认需要的列
+DEFAULT_HDI_COLUMNS = ('B', 'L', 'H', 'HEADING')
+
+# ID中时间戳部分的长度：YYYYMMDDhhmmssfff
+_ID_TIMESTAMP_DIGITS = 17
+_EPOCH_DIGITS = np.frombuffer(b'19700101000000000', dtype=np.uint8).astype(np.int16) - ord('0')
+
+# 列数不足的行最多记录多少个行号（用于警告中的示例）
+SKIPPED_LINE_SAMPLES = 5
+
+# 解析时每块的字节数
+_PARSE_CHUNK_BYTES = 32 << 20
+
+# 文件至少多大时才按字节范围拆给多个进程解析（更小的文件启动进程的开销大于收益）
+PARALLEL_PARSE_MIN_BYTES = 64 << 20
+
+# 查找换行符时每次检查的字节数
+_NEWLINE_SEARCH_BYTES = 64 << 10
+
+# 解析前在每块末尾补齐的字节数，不超过此长度的字段可以直接从滑动窗口视图中取出
+_FIELD_PADDING = 64
+
+_TAB = 9
+_LF = 10
+_CR = 13
+
+
+def _locate_fields(buf):
+    """
+    在原始字节上定位行和字段边界。
+
+    Returns:
+        tuple: (line_starts, field_counts, first_sep, sep)
+            line_starts: 每行起始字节位置
+            field_counts: 每行字段数（制表符数+1）
+            first_sep: 每行第一个分隔符在sep中的下标
+            sep: 所有分隔符（制表符和换行符）的字节位置，文件末尾无换行时补上文件长度
+    """
+    is_lf = buf == _LF
+    sep = np.flatnonzero(is_lf | (buf == _TAB))
+    line_ends = np.flatnonzero(is_lf)
+    if buf.size and buf[-1] != _LF:
+        # 最后一行没有换行符，补一个虚拟的行尾
+        line_ends = np.append(line_ends, buf.size)
+        sep = np.append(sep, buf.size)
+
+    line_starts = np.empty_like(line_ends)
+    if line_ends.size:
+        line_starts[0] = 0
+        line_starts[1:] = line_ends[:-1] + 1
+
+    first_sep = np.searchsorted(sep, line_starts)
+    last_sep = np.searchsorted(sep, line_ends)
+    field_counts = last_sep - first_sep + 1
+    return line_starts, field_counts, first_sep, sep
+
+
+def _gather_field_bytes(buf, starts, ends):
+    """
+    把若干字段的字节收集到定长的'S'数组中（不足部分以\\0填充，回车符也置为\\0）。
+    buf末尾需留有_FIELD_PADDING字节的填充，这样可以直接在滑动窗口视图上按起始位置取行，
+    不必构造逐字节的索引矩阵。
+    """
+    if starts.size == 0:
+        return np.empty(0, dtype='S1')
+    lengths = ends - starts
+    width = max(int(lengths.max()), 1)
+    if width <= _FIELD_PADDING:
+        matrix = sliding_window_view(buf, width)[starts]
+    else:
+        # 异常长的字段（通常是损坏的行），退回索引矩阵的方式
+        index = starts[:, None] + np.arange(width)
+        np.minimum(index, buf.size - 1, out=index)
+        matrix = buf[index]
+    matrix[np.arange(width) >= lengths[:, None]] = 0
+    matrix[matrix == _CR] = 0
+    return matrix.view(f'S{width}').ravel()
+
+
+def _digits_to_int(digits):
+    """
+    将形如(n, k)的十进制数字矩阵转换为int64。
+    """
+    powers = 10 ** np.arange(digits.shape[1] - 1, -1, -1, dtype=np.int64)
+    return digits.astype(np.int64) @ powers
+
+
+def hdi_timestamps_to_epoch_ms(year, month, day, hour, minute, second, millisecond):
+    """
+    将拆开的日期时间字段向量化地转换为自1970-01-01以来的毫秒数（不做时区换算）。
+    """
+    months = (np.asarray(year, dtype=np.int64) - 1970) * 12 + (np.asarray(month, dtype=np.int64) - 1)
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    days = days + np.asarray(day, dtype=np.int64) - 1
+    return (days * 86400000
+            + np.asarray(hour, dtype=np.int64) * 3600000
+            + np.asarray(minute, dtype=np.int64) * 60000
+            + np.asarray(second, dtype=np.int64) * 1000
+            + np.asarray(millisecond, dtype=np.int64))
+
+
+def digit_strings_to_epoch_ms(digits):
+    """
+    将(n, 17)的YYYYMMDDhhmmssfff数字矩阵转换为毫秒时间戳，含非数字字符的行返回-1。
+    """
+    digits = np.asarray(digits, dtype=np.int16)
+    if digits.shape[0] == 0:
+        return np.empty(0, dtype=np.int64)
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    # 非法行先替换为1970-01-01 00:00:00.000，算完后再置为-1
+    safe = np.where(valid[:, None], digits, _EPOCH_DIGITS)
+    epoch_ms = hdi_timestamps_to_epoch_ms(
+        _digits_to_int(safe[:, 0:4]),
+        _digits_to_int(safe[:, 4:6]),
+        _digits_to_int(safe[:, 6:8]),
+        _digits_to_int(safe[:, 8:10]),
+        _digits_to_int(safe[:, 10:12]),
+        _digits_to_int(safe[:, 12:14]),
+        _digits_to_int(safe[:, 14:17]),
+    )
+    epoch_ms[~valid] = -1
+    return epoch_ms
+
+
+def _id_timestamps(buf, starts, ends):
+    """
+    从ID字段末尾的17位数字中解析毫秒时间戳。
+    """
+    short = (ends - starts) < _ID_TIMESTAMP_DIGITS
+    digits = sliding_window_view(buf, _ID_TIMESTAMP_DIGITS)[np.maximum(ends - _ID_TIMESTAMP_DIGITS, 0)]
+    digits = digits.astype(np.int16) - ord('0')
+    digits[short] = -1
+    return digit_strings_to_epoch_ms(digits)
+
+
+def _parse_hdi_chunk(buf, columns, with_timestamp, skipped_lines=None, line_offset=0):
+    """
+    解析一段以完整行结尾的HDI字节，返回(列字典, 跳过的行数, 本段的总行数)。
+    skipped_lines不为None时，把跳过的行的行号（从1开始，加上line_offset）追加到其中，总数不超过SKIPPED_LINE_SAMPLES。
+    """
+    line_starts, field_counts, first_sep, sep = _locate_fields(buf)
+    buf = np.concatenate([buf, np.zeros(_FIELD_PADDING, dtype=np.uint8)])
+
+    valid = field_counts >= HDI_MIN_COLUMNS
+    skipped_rows = int(valid.size - np.count_nonzero(valid))
+    line_count = int(valid.size)
+    if skipped_rows and skipped_lines is not None and len(skipped_lines) < SKIPPED_LINE_SAMPLES:
+        samples = np.flatnonzero(~valid)[:SKIPPED_LINE_SAMPLES - len(skipped_lines)]
+        skipped_lines.extend((samples + 1 + line_offset).tolist())
+    line_starts = line_starts[valid]
+    field_counts = field_counts[valid]
+    first_sep = first_sep[valid]
+
+    def field_bounds(column_index):
+        present = field_counts > column_index
+        sep_index = np.where(present, first_sep + column_index, first_sep)
+        ends = sep[sep_index]
+        if column_index == 0:
+            starts = line_starts
+        else:
+            starts = np.where(present, sep[np.maximum(sep_index - 1, 0)] + 1, ends)
+        return present, starts, ends
+
+    result = {}
+    for name in columns:
+        column_index, dtype = HDI_COLUMN_LAYOUT[name]
+        present, starts, ends = field_bounds(column_index)
+        raw = _gather_field_bytes(buf, starts, ends)
+        if dtype == 'S':
+            result[name] = raw
+            continue
+        if present.all():
+            result[name] = raw.astype(dtype)
+            continue
+        filled = np.where(present, raw, b'nan' if np.issubdtype(dtype, np.floating) else b'-1')
+        result[name] = filled.astype(dtype)
+
+    if with_timestamp:
+        _, starts, ends = field_bounds(0)
+        result['TIMESTAMP'] = _id_timestamps(buf, starts, ends)
+
+    return result, skipped_rows, line_count
+
+
+def _next_line_start(buf, position):
+    """
+    返回position处或之后第一个换行符的下一个字节位置（即下一行的起始位置），没有换行符时返回buf.size。
+    分段查找，避免对整个剩余部分做比较。
+    """
+    while position < buf.size:
+        window = buf[position:position + _NEWLINE_SEARCH_BYTES]
+        newline = np.flatnonzero(window == _LF)
+        if newline.size:
+            return position + int(newline[0]) + 1
+        position += window.size
+    return buf.size
+
+
+def _parse_hdi_buffer(buf, columns, with_timestamp, skipped_lines=None):
+    """
+    按整行切分成不超过_PARSE_CHUNK_BYTES的块依次解析，返回(列字典, 跳过的行数, 总行数)。
+    """
+    if buf.size <= _PARSE_CHUNK_BYTES:
+        return _parse_hdi_chunk(buf, columns, with_timestamp, skipped_lines)
+
+    pieces = []
+    skipped_rows = 0
+    line_offset = 0
+    chunk_start = 0
+    while chunk_start < buf.size:
+        chunk_end = chunk_start + _PARSE_CHUNK_BYTES
+        # 把块尾对齐到下一个换行符之后
+        chunk_end = _next_line_start(buf, chunk_end - 1) if chunk_end < buf.size else buf.size
+        chunk_result, chunk_skipped, chunk_lines = _parse_hdi_chunk(buf[chunk_start:chunk_end], columns,
+                                                                    with_timestamp, skipped_lines, line_offset)
+        pieces.append(chunk_result)
+        skipped_rows += chunk_skipped
+        line_offset += chunk_lines
+        chunk_start = chunk_end
+
+    return _concatenate_columns(pieces), skipped_rows, line_offset
+
+
+def _concatenate_columns(pieces):
+    return {name: np.concatenate([piece[name] for piece in pieces]) for name in pieces[0]}
+
+
+def parse_hdi_bytes(data, columns=DEFAULT_HDI_COLUMNS, with_timestamp=False, skipped_lines=None):
+    """
+    解析HDI文件内容（bytes或uint8数组），返回按列组织的NumPy数组。
+    列数不足HDI_MIN_COLUMNS的行通过掩码整体过滤，而不是逐行判断。
+    大文件按整行切分成若干块依次解析，中间数组的内存占用与块大小而非文件大小相关。
+
+    Args:
+        data (bytes | numpy.ndarray): HDI文件的原始内容。
+        columns (tuple): 需要转换的列名，取值见HDI_COLUMN_LAYOUT。
+        with_timestamp (bool): 为True时额外返回'TIMESTAMP'列（由ID解析出的毫秒时间戳，int64）。
+        skipped_lines (list): 如果提供，追加前SKIPPED_LINE_SAMPLES个被跳过的行的行号（从1开始）。
+
+    Returns:
+        tuple: (列名到数组的字典, 因列数不足而跳过的行数)
+            列号超出某行实际列数时，数值列填NaN（整数列填-1），ID列填空字节串。
+    """
+    buf = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    result, skipped_rows, _ = _parse_hdi_buffer(buf, columns, with_timestamp, skipped_lines)
+    return result, skipped_rows
+
+
+def _read_mapped_range(hdi_file_path, start, stop, columns, with_timestamp, skipped_lines):
+    """
+    内存映射HDI文件，解析起始位置落在[start, stop)内的完整行，返回(列字典, 跳过的行数, 总行数)。
+    stop为None表示到文件末尾。数组直接建立在映射上，只有解析中的一块会被复制。
+    """
+    with open(hdi_file_path, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        stop = size if stop is None else min(stop, size)
+        if size == 0 or start >= stop:
+            # 空文件不能映射；空范围同样没有任何行
+            return _parse_hdi_chunk(np.empty(0, dtype=np.uint8), columns, with_timestamp)
+        mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        buf = np.frombuffer(mapped, dtype=np.uint8)
+        # 一行属于其起始字节所在的范围：起点跳过上一范围延续过来的半行，终点延伸到该行结束
+        begin = _next_line_start(buf, start - 1) if start > 0 else 0
+        end = _next_line_start(buf, stop - 1) if stop < size else size
+        return _parse_hdi_buffer(buf[begin:max(begin, end)], columns, with_timestamp, skipped_lines)
+    finally:
+        # 先释放映射上的所有视图，否则映射无法关闭
+        buf = None
+        try:
+            mapped.close()
+        except BufferError: # 异常回溯中仍引用着映射上的视图，留给垃圾回收关闭
+            pass
+
+
+def split_hdi_byte_ranges(hdi_file_path, parts):
+    """
+    把HDI文件按字节均分为parts个范围[(start, stop), ...]。范围边界不必落在行尾，
+    read_hdi_byte_range会把每个范围对齐到整行，各范围读到的行互不重叠且覆盖整个文件。
+    """
+    size = os.path.getsize(hdi_file_path)
+    parts = max(1, min(parts, size // _NEWLINE_SEARCH_BYTES or 1))
+    bounds = [size * i // parts for i in range(parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_hdi_byte_range(hdi_file_path, start, stop, columns=DEFAULT_HDI_COLUMNS, with_timestamp=False,
+                        skipped_lines=None):
+    """
+    只读取HDI文件中起始位置落在[start, stop)内的行，用于把一个大文件拆给多个进程解析。
+
+    Args:
+        hdi_file_path (str): HDI文件的完整路径。
+        start (int): 范围起点（字节）。不在行首时从下一行开始。
+        stop (int): 范围终点（字节），None表示到文件末尾。跨过终点的最后一行完整读入。
+        columns (tuple): 需要转换的列名，取值见HDI_COLUMN_LAYOUT。
+        with_timestamp (bool): 为True时额外返回'TIMESTAMP'列。
+        skipped_lines (list): 如果提供，追加前几个被跳过的行在本范围内的行号（从1开始）。
+
+    Returns:
+        tuple: (列名到数组的字典, 因列数不足而跳过的行数)
+    """
+    result, skipped_rows, _ = _read_mapped_range(hdi_file_path, start, stop, columns, with_timestamp,
+                                                 skipped_lines)
+    return result, skipped_rows
+
+
+def _read_range_in_worker(hdi_file_path, start, stop, columns, with_timestamp):
+    skipped_lines = []
+    result, skipped_rows, line_count = _read_mapped_range(hdi_file_path, start, stop, columns, with_timestamp,
+                                                          skipped_lines)
+    return result, skipped_rows, line_count, skipped_lines
+
+
+def read_hdi_columns(hdi_file_path, columns=DEFAULT_HDI_COLUMNS, with_timestamp=False, skipped_lines=None,
+                     workers=1):
+    """
+    读取HDI文件并返回按列组织的NumPy数组。文件以内存映射方式读取，不把整个文件复制到内存中。
+
+    Args:
+        hdi_file_path (str): HDI文件的完整路径。
+        columns (tuple): 需要转换的列名，取值见HDI_COLUMN_LAYOUT。
+        with_timestamp (bool): 为True时额外返回'TIMESTAMP'列。
+        skipped_lines (list): 如果提供，追加前几个被跳过的行的行号，见parse_hdi_bytes。
+        workers (int): 大于1且文件不小于PARALLEL_PARSE_MIN_BYTES时，按字节范围拆给多个进程解析，
+                       结果按文件顺序拼接，与单进程读取相同。
+
+    Returns:
+        tuple: (列名到数组的字典, 因列数不足而跳过的行数)
+    """
+    if workers <= 1 or os.path.getsize(hdi_file_path) < PARALLEL_PARSE_MIN_BYTES:
+        result, skipped_rows, _ = _read_mapped_range(hdi_file_path, 0, None, columns, with_timestamp,
+                                                     skipped_lines)
+        return result, skipped_rows
+
+    ranges = split_hdi_byte_ranges(hdi_file_path, workers)
+    with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_read_range_in_worker, hdi_file_path, start, stop, columns, with_timestamp)
+                   for start, stop in ranges]
+        pieces = [future.result() for future in futures]
+
+    skipped_rows = 0
+    line_offset = 0
+    for _, range_skipped, range_lines, range_skipped_lines in pieces:
+        if skipped_lines is not None:
+            # 各范围内的行号加上前面各范围的总行数，换算为整个文件中的行号
+            room = SKIPPED_LINE_SAMPLES - len(skipped_lines)
+            skipped_lines.extend(line + line_offset for line in range_skipped_lines[:max(room, 0)])
+        skipped_rows += range_skipped
+        line_offset += range_lines
+    return _concatenate_columns([piece[0] for piece in pieces]), skipped_rows
@@ -1,132 +1,548 @@
 import os
+import sys
+import io
 import csv
 import re
-from osgeo import ogr, osr, gdal
+import contextlib
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 
-def process_hdi_to_csv(hdi_file_path, base_path_for_photos):
+import numpy as np
+
+from feature_key_index import (UPSERT_KEY_FIELDS, FeatureKeyIndex, feature_digest, format_upsert_counts, hash_keys,
+                               merge_upsert_counts)
+from file_inventory import DEFAULT_INVENTORY_FILE_NAME, DEFAULT_SCAN_WORKERS, FileInventory
+from hdi_cache import DEFAULT_CACHE_DIR_NAME, HdiResultCache
+from hdi_reader import DEFAULT_HDI_COLUMNS, read_hdi_columns
+from output_crs import WGS84_EPSG, crs_output_path, output_coordinates, parse_output_crs_list
+from photo_metadata import (DEFAULT_THUMB_SIZE, PHOTO_METADATA_FIELDS, PHOTO_METADATA_HEADER, PhotoMetadataExtractor,
+                            pillow_available)
+from pipeline_metrics import PIPELINE_STAGES, StageMetrics, file_size, measure
+from run_log import WarningLog, warn
+from trajectory_lines import DEFAULT_TRACK_GAP_SECONDS, TRACK_LINE_COLUMNS, build_track_segments
+from trajectory_thinning import THINNING_TRACK_COLUMNS, take_rows, thin_levels
+from photo_matcher import (DEFAULT_MATCH_TOLERANCE_MS, MATCH_REPORT_HEADER, PHOTO_MATCH_AUTO,
+                           PHOTO_MATCH_INDEX, PHOTO_MATCH_MODES, PHOTO_MATCH_TIMESTAMP,
+                           build_photo_index, make_match_report, match_timestamps)
+
+# 合并CSV的标题行，也是Shapefile中的字段顺序
+HDI_CSV_HEADER = ['FILE_NAME', 'FILE_PATH', 'ROAD_NAME', 'B', 'L', 'H', 'HEADING']
+# 轨迹线图层的字段（字段名, OGR字段类型），顺序与build_track_segments返回的元组一致
+HDI_TRACK_FIELDS = [('HDI_FILE', 'OFTString'), ('ROAD_NAME', 'OFTString'), ('SEGMENT', 'OFTInteger'),
+                    ('START_TIME', 'OFTString'), ('END_TIME', 'OFTString'), ('LENGTH_M', 'OFTReal'),
+                    ('POINT_CNT', 'OFTInteger')]
+# 写入Shapefile时每个事务包含的要素数量
+DEFAULT_WRITE_BATCH_SIZE = 50000
+# 写入要素时每隔多少行检查一次取消标志
+CANCEL_CHECK_ROWS = 1000
+
+# 输出格式：格式名 -> OGR驱动、扩展名和图层创建选项。各格式都在写出时建立空间索引：
+# Shapefile为.qix四叉树，GeoPackage为R树，FlatGeobuf为打包的Hilbert R树；
+# GeoParquet没有独立的索引结构，写出每行的bbox列，查询时按行组统计信息跳过不相交的行组。
+# append表示能否向已有文件追加要素（FlatGeobuf和GeoParquet只能一次写出）。
+OUTPUT_FORMAT_SHP = 'shp'
+OUTPUT_FORMATS = {
+    OUTPUT_FORMAT_SHP: {'name': 'Shapefile', 'driver': 'ESRI Shapefile', 'extension': '.shp',
+                        'layer_options': ['ENCODING=UTF-8', 'SPATIAL_INDEX=YES'], 'append': True},
+    'gpkg': {'name': 'GeoPackage', 'driver': 'GPKG', 'extension': '.gpkg',
+             'layer_options': ['SPATIAL_INDEX=YES'], 'append': True},
+    'fgb': {'name': 'FlatGeobuf', 'driver': 'FlatGeobuf', 'extension': '.fgb',
+            'layer_options': ['SPATIAL_INDEX=YES'], 'append': False},
+    'parquet': {'name': 'GeoParquet', 'driver': 'Parquet', 'extension': '.parquet',
+                'layer_options': ['GEOMETRY_ENCODING=WKB', 'WRITE_COVERING_BBOX=YES',
+                                  f'ROW_GROUP_SIZE={DEFAULT_WRITE_BATCH_SIZE}'], 'append': False},
+}
+
+class ProcessingCancelled(Exception):
     """
-    处理单个HDI文件，提取指定列，并将其保存为新的CSV文件。
-    
+    处理过程被用户取消（cancel_event被置位）时抛出。
+    """
+
+def check_cancelled(cancel_event):
+    """
+    cancel_event已被置位时抛出ProcessingCancelled。
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise ProcessingCancelled("处理已被用户取消。")
+
+def list_ccd_photos(hdi_file_path, inventory=None):
+    """
+    列出HDI文件同级CCD文件夹中的JPG文件名（已排序）。
+
     Args:
         hdi_file_path (str): HDI文件的完整路径。
+        inventory (FileInventory): 如果提供，从文件清单中取列表，不再访问磁盘。
+
+    Returns:
+        list: 照片名称列表；CCD文件夹不存在时返回None。
+    """
+    ccd_dir = os.path.join(os.path.dirname(hdi_file_path), 'CCD')
+    if inventory is not None:
+        files = inventory.list_files(ccd_dir)
+    else:
+        files = os.listdir(ccd_dir) if os.path.isdir(ccd_dir) else None
+    if files is None:
+        return None
+    return sorted(filename for filename in files if filename.lower().endswith('.jpg'))
+
+def pair_photos_with_rows(hdi_file_path, base_path_for_photos, row_timestamps,
+                          photo_match=PHOTO_MATCH_AUTO, tolerance_ms=DEFAULT_MATCH_TOLERANCE_MS,
+                          photo_names=None, warning_log=None):
     """
-    # 构建输出CSV文件的路径，将HDI文件的扩展名替换为.csv
-    output_csv_file_path = os.path.splitext(hdi_file_path)[0] + ".csv"
+    为HDI文件的每一行配对同级CCD文件夹中的JPG照片。
+    按时间戳匹配时，对照片名中的时间戳建立有序索引，每行二分查找时间上最近且在容差内的照片；
+    按顺序配对时，排序后的第n张照片对应第n行。
+
+    Args:
+        hdi_file_path (str): HDI文件的完整路径。
+        base_path_for_photos (str): 计算照片相对路径的基准路径。
+        row_timestamps (numpy.ndarray): 每个有效行的毫秒时间戳（由行ID解析）。
+        photo_match (str): 配对模式，auto / timestamp / index。
+        tolerance_ms (int): 按时间戳匹配时允许的最大偏差（毫秒）。
+        photo_names (list): CCD文件夹中已排序的JPG名称（例如取自文件清单）；为None时从磁盘列出。
+        warning_log (WarningLog): 如果提供，警告按类别记入其中（限流打印），否则直接打印。
 
+    Returns:
+        tuple: (照片名称列表, 照片相对路径列表, 匹配报告字典)，
+               名称和路径列表长度均为行数，没有对应照片的行为空字符串。
+    """
+    row_count = len(row_timestamps)
     # 获取HDI文件所在的目录
     hdi_dir = os.path.dirname(hdi_file_path)
     # 构建CCD文件夹的路径
     ccd_dir = os.path.join(hdi_dir, 'CCD')
 
-    photo_names = []
-    if os.path.isdir(ccd_dir):
+    if photo_names is None:
         # 获取CCD文件夹下所有JPG文件的名称并排序
-        for filename in sorted(os.listdir(ccd_dir)):
-            if filename.lower().endswith('.jpg'):
-                photo_names.append(filename)
+        photo_names = list_ccd_photos(hdi_file_path)
+        if photo_names is None:
+            warn(warning_log, 'missing_ccd', f"未找到与HDI文件 {hdi_file_path} 同级的CCD文件夹。",
+                 file=hdi_file_path)
+            photo_names = []
+
+    sorted_photo_timestamps, photo_order = build_photo_index(photo_names)
+    if photo_match == PHOTO_MATCH_AUTO:
+        # 照片名中带时间戳时才能按时间戳匹配
+        photo_match = PHOTO_MATCH_TIMESTAMP if photo_order.size else PHOTO_MATCH_INDEX
+
+    if photo_match == PHOTO_MATCH_TIMESTAMP:
+        matches, offsets = match_timestamps(row_timestamps, sorted_photo_timestamps, tolerance_ms)
+        matched_photos = np.full(row_count, -1, dtype=np.int64)
+        matched_rows = matches >= 0
+        matched_photos[matched_rows] = photo_order[matches[matched_rows]]
+        matched_names = [photo_names[i] if i >= 0 else '' for i in matched_photos.tolist()]
     else:
-        print(f"警告: 未找到与HDI文件 {hdi_file_path} 同级的CCD文件夹。")
+        if row_count > len(photo_names):
+            warn(warning_log, 'photo_shortage', f"HDI文件 {hdi_file_path} 的行数多于CCD文件夹中的照片数量。",
+                 file=hdi_file_path, rows=row_count, photos=len(photo_names))
+        matched_names = photo_names[:row_count] + [''] * max(row_count - len(photo_names), 0)
+        offsets = np.where(np.arange(row_count) < len(photo_names), 0, -1)
+
+    report = make_match_report(hdi_file_path, photo_match, row_count, len(photo_names), offsets)
+    if photo_match == PHOTO_MATCH_TIMESTAMP and (report['UNMATCHED_ROWS'] or report['UNUSED_PHOTOS']):
+        warn(warning_log, 'photo_unmatched',
+             f"HDI文件 {hdi_file_path} 照片时间戳匹配: {report['MATCHED']}/{row_count} 行已配对，"
+             f"{report['UNMATCHED_ROWS']} 行无照片，{report['UNUSED_PHOTOS']} 张照片未使用。",
+             file=hdi_file_path, unmatched_rows=report['UNMATCHED_ROWS'], unused_photos=report['UNUSED_PHOTOS'])
+
+    # 同一CCD文件夹下的照片只需计算一次文件夹的相对路径
+    try:
+        relative_ccd_dir = os.path.relpath(ccd_dir, base_path_for_photos)
+    except ValueError:
+        warn(warning_log, 'photo_path', f"无法计算照片 {ccd_dir} 相对于 {base_path_for_photos} 的路径。",
+             directory=ccd_dir)
+        relative_ccd_dir = ccd_dir # Fallback to full path
+    matched_paths = [os.path.join(relative_ccd_dir, name) if name else '' for name in matched_names]
 
-    photo_index = 0
-    photo_count_warning_issued = False # 添加标志，用于控制警告只输出一次
+    return matched_names, matched_paths, report
+
+def process_hdi_to_columns(hdi_file_path, base_path_for_photos, photo_match=PHOTO_MATCH_AUTO,
+                           tolerance_ms=DEFAULT_MATCH_TOLERANCE_MS, match_reports=None, photo_names=None,
+                           track=None, track_columns=(), metrics=None, warning_log=None, parse_workers=1):
+    """
+    处理单个HDI文件，按列返回结果：照片名称、照片相对路径、道路名称为列表，
+    B, L, H, HEADING为float64的NumPy数组。
+
+    Args:
+        hdi_file_path (str): HDI文件的完整路径。
+        base_path_for_photos (str): 计算照片相对路径的基准路径。
+        photo_match (str): 照片配对模式，auto / timestamp / index。
+        tolerance_ms (int): 按时间戳匹配时允许的最大偏差（毫秒）。
+        match_reports (list): 如果提供，本文件的照片匹配报告会追加到该列表中。
+        photo_names (list): CCD文件夹中已排序的JPG名称，见pair_photos_with_rows。
+        track (dict): 如果提供，track_columns中各列的数组（与返回的行一一对应）存入该字典。
+        track_columns (tuple): 除输出列外还需要的HDI列，取值见HDI_COLUMN_LAYOUT，另可取'TIMESTAMP'。
+        metrics (StageMetrics): 如果提供，解析（parse）和照片匹配（match）的耗时记入其中。
+        warning_log (WarningLog): 如果提供，警告按类别记入其中（限流打印），否则直接打印。
+        parse_workers (int): 大于1时，很大的HDI文件按字节范围拆给多个进程解析，见read_hdi_columns。
+
+    Returns:
+        list: 7列，顺序与HDI_CSV_HEADER一致。
+    """
+    read_columns = DEFAULT_HDI_COLUMNS + tuple(
+        name for name in track_columns if name not in DEFAULT_HDI_COLUMNS and name != 'TIMESTAMP')
+    skipped_lines = []
+    with measure(metrics, 'parse', bytes_read=file_size(hdi_file_path)) as record:
+        hdi_columns, skipped_rows = read_hdi_columns(hdi_file_path, read_columns, with_timestamp=True,
+                                                     skipped_lines=skipped_lines, workers=parse_workers)
+        row_count = record['rows'] = len(hdi_columns['B'])
+    if skipped_rows:
+        # 列数不足的行已由掩码过滤，这里每个文件只汇总提示一次，附上前几个行号
+        warn(warning_log, 'short_rows',
+             f"文件 {hdi_file_path} 中由于列数不足跳过 {skipped_rows:,} 行"
+             f"（前 {len(skipped_lines)} 行的行号: {', '.join(map(str, skipped_lines))}）。",
+             count=skipped_rows, file=hdi_file_path, lines=skipped_lines)
+
+    with measure(metrics, 'match', rows=row_count):
+        photo_names, photo_paths, report = pair_photos_with_rows(
+            hdi_file_path, base_path_for_photos, hdi_columns['TIMESTAMP'], photo_match, tolerance_ms, photo_names,
+            warning_log)
+    if match_reports is not None:
+        match_reports.append(report)
+    if track is not None:
+        track.update((name, hdi_columns[name]) for name in track_columns)
 
     # 获取HDI文件父目录的名称
-    parent_dir_name = os.path.basename(hdi_dir)
+    parent_dir_name = os.path.basename(os.path.dirname(hdi_file_path))
     # 尝试从父目录名称中提取括号内的中文内容
     match = re.search(r'[\(（](.*?)[\)）]', parent_dir_name)
     third_column_data = match.group(1) if match else ''
 
-    processed_rows = []
-
-    # 以读取模式打开HDI文件
-    with open(hdi_file_path, 'r') as infile:
-        # 创建CSV读取器，指定制表符为分隔符
-        reader = csv.reader(infile, delimiter='\t')
-
-        # 遍历HDI文件中的每一行
-        for row in reader:
-            # 确保行有足够的列，以避免索引错误
-            if len(row) >= 15:
-                # 提取第12、13、14、15列（0-indexed: 11, 12, 13, 14）
-                # 提取第12, 13, 14, 15列数据 (H, B, L, HEADING)
-                # 调整为 B, L, H, HEADING 的顺序
-                extracted_data = [row[13], row[12], row[11], row[14]]
-
-                current_photo_name = ''
-                current_photo_relative_path = ''
-
-                if photo_index < len(photo_names):
-                    current_photo_name = photo_names[photo_index]
-                    full_photo_path = os.path.join(ccd_dir, current_photo_name)
-                    
-                    # 计算相对于 E:\Code 的路径
-                    base_path = base_path_for_photos
-                    try:
-                        current_photo_relative_path = os.path.relpath(full_photo_path, base_path)
-                    except ValueError:
-                        print(f"警告: 无法计算照片 {full_photo_path} 相对于 {base_path} 的路径。")
-                        current_photo_relative_path = full_photo_path # Fallback to full path
-
-                    photo_index += 1
-                else:
-                    if not photo_count_warning_issued:
-                        print(f"警告: HDI文件 {hdi_file_path} 的行数多于CCD文件夹中的照片数量。")
-                        photo_count_warning_issued = True
+    return [photo_names, photo_paths, [third_column_data] * row_count,
+            hdi_columns['B'], hdi_columns['L'], hdi_columns['H'], hdi_columns['HEADING']]
 
-                # 创建一个新行，前两列为照片名称和相对路径，第三列为提取的中文内容，后面跟着提取的数据
-                new_row = [current_photo_name, current_photo_relative_path, third_column_data] + extracted_data
-                processed_rows.append(new_row)
-            else:
-                # 如果行中的列数不足，则打印警告信息并跳过该行
-                print(f"警告: 文件 {hdi_file_path} 中由于列数不足跳过行: {row}")
-    return processed_rows
+def _as_list(values):
+    """
+    NumPy数组转换为Python列表，逐元素访问时比数组下标快得多；列表原样返回。
+    """
+    return values.tolist() if hasattr(values, 'tolist') else values
 
-def batch_process_hdi_files(directory_path, base_path_for_photos):
+def columns_to_rows(columns):
     """
-    批量处理给定目录中的所有HDI文件。
+    将按列组织的数据转换回行列表（与process_hdi_to_csv的返回格式一致）。
+    """
+    return [list(row) for row in zip(*[_as_list(column) for column in columns])]
+
+def process_hdi_to_csv(hdi_file_path, base_path_for_photos):
+    """
+    处理单个HDI文件，提取指定列，返回行列表。
+    每行为照片名称、照片相对路径、道路名称，后面跟着 B, L, H, HEADING。
     
+    Args:
+        hdi_file_path (str): HDI文件的完整路径。
+    """
+    return columns_to_rows(process_hdi_to_columns(hdi_file_path, base_path_for_photos))
+
+def iter_hdi_files(directory_path):
+    """
+    递归遍历目录，逐个返回HDI文件的完整路径。
+
     Args:
         directory_path (str): 包含HDI文件的目录路径。
     """
-    all_processed_data = []
     for root, _, files in os.walk(directory_path):
         for filename in files:
             # 检查文件是否以.hdi结尾
             if filename.endswith(".hdi"):
-                # 构建HDI文件的完整路径
-                hdi_file_path = os.path.join(root, filename)
-                # 处理单个HDI文件并收集返回的行
-                all_processed_data.extend(process_hdi_to_csv(hdi_file_path, base_path_for_photos))
-    return all_processed_data
+                yield os.path.join(root, filename)
 
-def convert_csv_to_shp(csv_file_path, shp_file_path):
+def _process_hdi_file_in_worker(hdi_file_path, base_path_for_photos, process_options, photo_names=None,
+                                track_columns=(), use_warning_log=False):
     """
-    将CSV文件转换为ESRI Shapefile。
-    CSV文件应包含标题行：FILE_NAME, FILE_PATH, ROAD_NAME, H, B, L, HEADING
-    其中B为纬度，L为经度，使用WGS84地理坐标系。
+    在子进程中处理单个HDI文件。子进程中的print输出被捕获后随结果一起返回，
+    由主进程按文件顺序打印，保证日志（以及GUI中的日志窗口）与串行运行一致；各阶段耗时同样随结果返回。
+    """
+    log_buffer = io.StringIO()
+    match_reports = []
+    track = {}
+    metrics = StageMetrics()
+    # 子进程中的警告只记录不打印，由主进程合并后统一限流
+    warning_log = WarningLog(echo=False) if use_warning_log else None
+    with contextlib.redirect_stdout(log_buffer):
+        columns = process_hdi_to_columns(hdi_file_path, base_path_for_photos, match_reports=match_reports,
+                                         photo_names=photo_names, track=track, track_columns=track_columns,
+                                         metrics=metrics, warning_log=warning_log, **process_options)
+    return (columns, log_buffer.getvalue(), match_reports, track, metrics.stages,
+            warning_log.categories if warning_log is not None else {})
+
+def resolve_worker_count(workers):
+    """
+    将用户给定的并行进程数规范化：0或负数表示使用全部CPU核心。
+    """
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+def iter_processed_hdi_files(directory_path, base_path_for_photos, workers=1, photo_match=PHOTO_MATCH_AUTO,
+                             tolerance_ms=DEFAULT_MATCH_TOLERANCE_MS, match_reports=None, cache=None,
+                             progress_callback=None, cancel_event=None, inventory=None, track_columns=(),
+                             metrics=None, warning_log=None, photo_metadata=None):
+    """
+    逐个处理目录中的HDI文件，每处理完一个文件就返回其结果，而不是把所有行累积在内存中。
+    workers大于1时，各HDI文件（连同其CCD文件夹）作为独立单元在进程池中并行解析，
+    结果仍按与串行运行相同的文件顺序返回；只有一个HDI文件时，改为把该文件按字节范围拆给多个进程解析。
+
+    Args:
+        directory_path (str): 包含HDI文件的目录路径。
+        base_path_for_photos (str): 计算照片相对路径的基准路径。
+        workers (int): 并行进程数，1为串行，0表示使用全部CPU核心。
+        photo_match (str): 照片配对模式，auto / timestamp / index。
+        tolerance_ms (int): 按时间戳匹配时允许的最大偏差（毫秒）。
+        match_reports (list): 如果提供，各文件的照片匹配报告按文件顺序追加到该列表中。
+        cache (HdiResultCache): 如果提供，未变化的HDI文件直接使用缓存结果，只解析新增或变更的文件。
+        progress_callback (callable): 每处理完一个文件调用一次，参数为(已完成文件数, 文件总数, 已处理行数)。
+        cancel_event (threading.Event): 被置位后，在下一个文件边界抛出ProcessingCancelled。
+        inventory (FileInventory): 如果提供，HDI文件和CCD照片列表取自文件清单（清单会先刷新并保存），
+                                   不再逐个目录遍历和列出。
+        track_columns (tuple): 除输出列外还需要的HDI列（如抽稀用的X、Y），见process_hdi_to_columns。
+        metrics (StageMetrics): 如果提供，记录扫描（scan）、解析（parse）和照片匹配（match）的耗时；
+                                并行时各子进程的统计合并到其中。
+        warning_log (WarningLog): 如果提供，警告按类别计数、限流打印；并行时各子进程的警告合并到其中。
+        photo_metadata (PhotoMetadataExtractor): 如果提供，照片配对后读取照片尺寸、拍摄时间并生成缩略图，
+                                                 结果作为PHOTO_METADATA_HEADER中的各列追加在返回的列之后。
+
+    Yields:
+        tuple: (HDI文件路径, 该文件处理后的列，见process_hdi_to_columns, track_columns中各列的数组字典)
+    """
+    with measure(metrics, 'scan') as record:
+        if inventory is not None:
+            inventory.scan(directory_path)
+            inventory.save()
+            print(f"文件清单: {inventory.scanned} 个目录重新列出，{inventory.reused} 个目录未变化。")
+            hdi_files = inventory.find_files(directory_path, '.hdi')
+        else:
+            hdi_files = list(iter_hdi_files(directory_path))
+        record['rows'] = len(hdi_files)
+    workers = resolve_worker_count(workers)
+    process_options = {'photo_match': photo_match, 'tolerance_ms': tolerance_ms}
+
+    def listed_photos(hdi_file_path):
+        # 没有文件清单时返回None，由各处自行从磁盘列出
+        return list_ccd_photos(hdi_file_path, inventory) if inventory is not None else None
+
+    def lookup_cache(hdi_file_path, photo_names):
+        if cache is None:
+            return None
+        return cache.lookup(hdi_file_path, base_path_for_photos, process_options, photo_names, track_columns,
+                            warning_log is not None)
+
+    files_done = 0
+    rows_done = 0
+
+    def finish_file(hdi_file_path, columns, file_match_reports, from_cache, photo_names, track, file_warnings):
+        nonlocal files_done, rows_done
+        if warning_log is not None:
+            # 每个文件的警告单独记录后再合并，命中缓存时合并保存的警告，汇总和错误报告与重新处理时一致
+            warning_log.merge(file_warnings)
+        if cache is not None and not from_cache:
+            cache.store(hdi_file_path, base_path_for_photos, process_options, columns, file_match_reports,
+                        photo_names, track, file_warnings if warning_log is not None else None)
+        if match_reports is not None:
+            match_reports.extend(file_match_reports)
+        if photo_metadata is not None:
+            # 元数据列不进入结果缓存，由缩略图文件夹中的索引判断哪些照片需要重新读取
+            with measure(metrics, 'photo_meta', rows=len(columns[0])):
+                columns = columns + photo_metadata.columns(hdi_file_path, columns[0], columns[1], warning_log)
+        files_done += 1
+        rows_done += len(columns[0])
+        if progress_callback is not None:
+            progress_callback(files_done, len(hdi_files), rows_done)
+        return columns
+
+    if cache is not None:
+        # 已删除的HDI文件不再保留缓存
+        cache.prune(hdi_files)
+
+    try:
+        if progress_callback is not None:
+            progress_callback(0, len(hdi_files), 0)
+        if workers <= 1 or len(hdi_files) <= 1:
+            for hdi_file_path in hdi_files:
+                check_cancelled(cancel_event)
+                photo_names = listed_photos(hdi_file_path)
+                cached = lookup_cache(hdi_file_path, photo_names)
+                if cached is None:
+                    file_match_reports = []
+                    track = {}
+                    file_log = WarningLog(warning_log.sample_limit, echo=False) if warning_log is not None else None
+                    columns = process_hdi_to_columns(hdi_file_path, base_path_for_photos,
+                                                     match_reports=file_match_reports, photo_names=photo_names,
+                                                     track=track, track_columns=track_columns, metrics=metrics,
+                                                     warning_log=file_log, parse_workers=workers,
+                                                     **process_options)
+                    file_warnings = file_log.categories if file_log is not None else {}
+                else:
+                    columns, file_match_reports, track, file_warnings = cached
+                columns = finish_file(hdi_file_path, columns, file_match_reports, cached is not None, photo_names,
+                                      track, file_warnings or {})
+                yield hdi_file_path, columns, track
+        else:
+            workers = min(workers, len(hdi_files))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                def submit(hdi_file_path):
+                    # 命中缓存的文件不再提交给进程池
+                    photo_names = listed_photos(hdi_file_path)
+                    cached = lookup_cache(hdi_file_path, photo_names)
+                    if cached is not None:
+                        return hdi_file_path, None, cached, photo_names
+                    return hdi_file_path, executor.submit(
+                        _process_hdi_file_in_worker, hdi_file_path, base_path_for_photos, process_options,
+                        photo_names, track_columns, warning_log is not None), None, photo_names
+
+                # 限制在途任务数量：既让所有进程保持忙碌，又避免已完成但尚未消费的结果堆积在内存中
+                pending = deque()
+                file_iter = iter(hdi_files)
+                for hdi_file_path in file_iter:
+                    pending.append(submit(hdi_file_path))
+                    if len(pending) >= workers * 2:
+                        break
+
+                while pending:
+                    if cancel_event is not None and cancel_event.is_set():
+                        # 取消尚未开始的任务，正在运行的任务结束后进程池即关闭
+                        for _, pending_future, _, _ in pending:
+                            if pending_future is not None:
+                                pending_future.cancel()
+                        check_cancelled(cancel_event)
+                    hdi_file_path, future, cached, photo_names = pending.popleft()
+                    # 取出一个结果后立即补充一个新任务
+                    next_hdi_file_path = next(file_iter, None)
+                    if next_hdi_file_path is not None:
+                        pending.append(submit(next_hdi_file_path))
+                    if cached is None:
+                        (columns, log_text, file_match_reports, track, worker_stages,
+                         worker_warnings) = future.result()
+                        if log_text:
+                            sys.stdout.write(log_text)
+                        if metrics is not None:
+                            metrics.merge(worker_stages)
+                    else:
+                        columns, file_match_reports, track, worker_warnings = cached
+                    columns = finish_file(hdi_file_path, columns, file_match_reports, cached is not None,
+                                          photo_names, track, worker_warnings or {})
+                    yield hdi_file_path, columns, track
+    finally:
+        if cache is not None:
+            cache.save()
+
+    if cache is not None:
+        print(f"缓存: {cache.hits} 个HDI文件未变化直接使用缓存，{cache.misses} 个HDI文件重新处理。")
+
+def batch_process_hdi_files(directory_path, base_path_for_photos, workers=1, photo_match=PHOTO_MATCH_AUTO,
+                            tolerance_ms=DEFAULT_MATCH_TOLERANCE_MS, match_reports=None, cache=None,
+                            progress_callback=None, cancel_event=None, inventory=None, track_segments=None,
+                            track_gap_seconds=DEFAULT_TRACK_GAP_SECONDS, metrics=None, warning_log=None,
+                            photo_metadata=None):
+    """
+    批量处理给定目录中的所有HDI文件。
     
     Args:
-        csv_file_path (str): 输入CSV文件的路径。
-        shp_file_path (str): 输出Shapefile的路径。
+        directory_path (str): 包含HDI文件的目录路径。
+        workers (int): 并行进程数，1为串行，0表示使用全部CPU核心。
+        photo_match (str): 照片配对模式，auto / timestamp / index。
+        tolerance_ms (int): 按时间戳匹配时允许的最大偏差（毫秒）。
+        match_reports (list): 如果提供，各文件的照片匹配报告追加到该列表中。
+        cache (HdiResultCache): 如果提供，未变化的HDI文件直接使用缓存结果。
+        progress_callback (callable): 进度回调，见iter_processed_hdi_files。
+        cancel_event (threading.Event): 取消标志，见iter_processed_hdi_files。
+        inventory (FileInventory): 文件清单，见iter_processed_hdi_files。
+        track_segments (list): 如果提供，各文件按时间间隔切分出的轨迹段追加到该列表中，见build_track_segments。
+        track_gap_seconds (float): 切分轨迹段的时间间隔（秒）。
+        metrics (StageMetrics): 分阶段耗时统计，见iter_processed_hdi_files。
+        warning_log (WarningLog): 按类别限流的警告日志，见iter_processed_hdi_files。
+        photo_metadata (PhotoMetadataExtractor): 照片元数据和缩略图阶段，见iter_processed_hdi_files。
+    """
+    all_processed_data = []
+    for hdi_file_path, columns, track in iter_processed_hdi_files(
+            directory_path, base_path_for_photos, workers, photo_match, tolerance_ms, match_reports, cache,
+            progress_callback, cancel_event, inventory, TRACK_LINE_COLUMNS if track_segments is not None else (),
+            metrics, warning_log, photo_metadata):
+        # 收集每个HDI文件返回的行
+        all_processed_data.extend(columns_to_rows(columns))
+        if track_segments is not None:
+            track_segments.extend(build_track_segments(os.path.relpath(hdi_file_path, directory_path), columns,
+                                                       track, track_gap_seconds * 1000))
+    return all_processed_data
+
+def _create_output_data_source(shp_file_path, output_format, epsg=WGS84_EPSG):
     """
+    按输出格式创建（或覆盖）数据源，返回(data_source, 坐标系, 格式信息)。
+    epsg为None时图层不带坐标系（例如未标注的HDI原生投影坐标）。
+    """
+    # GDAL只在真正写出图层时才导入，--help和仅CSV的运行不加载它
+    from osgeo import gdal, ogr, osr
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    format_info = OUTPUT_FORMATS[output_format]
+
     # 注册所有OGR驱动
     gdal.AllRegister()
 
-    # 获取ESRI Shapefile驱动
-    driver = ogr.GetDriverByName("ESRI Shapefile")
+    # 获取输出格式对应的驱动
+    driver = ogr.GetDriverByName(format_info['driver'])
+    if driver is None:
+        raise ValueError(f"当前GDAL不支持输出格式 {output_format}（缺少 {format_info['driver']} 驱动）")
 
     # 创建数据源
     if os.path.exists(shp_file_path):
         driver.DeleteDataSource(shp_file_path)
     data_source = driver.CreateDataSource(shp_file_path)
+    if data_source is None:
+        raise ValueError(f"无法创建输出文件: {shp_file_path}")
+
+    # 定义输出坐标系（默认WGS84）
+    srs = None
+    if epsg is not None:
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+    return data_source, srs, format_info
+
+def open_output_layer(shp_file_path):
+    """
+    以更新模式打开已有的输出文件，返回(data_source, layer)，新要素追加在已有要素之后。
+    """
+    from osgeo import ogr
+
+    data_source = ogr.Open(shp_file_path, 1)
+    if data_source is None:
+        raise ValueError(f"无法以更新模式打开输出文件: {shp_file_path}")
+    return data_source, data_source.GetLayer(0)
+
+def rebuild_spatial_index(data_source, layer, output_format):
+    """
+    追加要素后更新空间索引。Shapefile的.qix不会随追加更新，需要重建；GeoPackage的R树由触发器自动维护。
+    """
+    if output_format == OUTPUT_FORMAT_SHP:
+        data_source.ExecuteSQL(f'CREATE SPATIAL INDEX ON "{layer.GetName()}"')
+
+def create_hdi_point_layer(shp_file_path, output_format=OUTPUT_FORMAT_SHP, epsg=WGS84_EPSG, extra_fields=(),
+                           append=False):
+    """
+    创建（或覆盖）用于存放HDI点的图层，并定义好字段。
+
+    Args:
+        shp_file_path (str): 输出文件的路径。
+        output_format (str): 输出格式，取值见OUTPUT_FORMATS，默认为Shapefile。
+        epsg (int): 图层坐标系的EPSG代码，默认为WGS84；None表示不带坐标系。
+        extra_fields (list): HDI_CSV_HEADER之后的附加字段（字段名, OGR字段类型），例如PHOTO_METADATA_FIELDS。
+        append (bool): 为True且文件已存在时打开已有图层追加要素，不重新创建。
+
+    Returns:
+        tuple: (data_source, layer)，调用方写完要素后需将data_source置为None以刷新到磁盘（空间索引在此时建立）。
+    """
+    from osgeo import ogr
+
+    if append and os.path.exists(shp_file_path):
+        return open_output_layer(shp_file_path)
 
-    # 定义WGS84坐标系
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(4326) # WGS84
+    data_source, srs, format_info = _create_output_data_source(shp_file_path, output_format, epsg)
 
     # 创建图层
-    layer = data_source.CreateLayer("hdi_points", srs, ogr.wkbPoint, options=['ENCODING=UTF-8'])
+    layer = data_source.CreateLayer("hdi_points", srs, ogr.wkbPoint, options=format_info['layer_options'])
 
     # 定义字段
     layer.CreateField(ogr.FieldDefn("FILE_NAME", ogr.OFTString))
@@ -136,63 +552,738 @@ def convert_csv_to_shp(csv_file_path, shp_file_path):
     layer.CreateField(ogr.FieldDefn("L", ogr.OFTReal))
     layer.CreateField(ogr.FieldDefn("H", ogr.OFTReal))
     layer.CreateField(ogr.FieldDefn("HEADING", ogr.OFTReal))
+    for field_name, field_type in extra_fields:
+        layer.CreateField(ogr.FieldDefn(field_name, getattr(ogr, field_type)))
 
-    # 从CSV读取数据并写入Shapefile
-    with open(csv_file_path, 'r', encoding='gbk') as csvfile:
-        reader = csv.reader(csvfile)
-        header = next(reader) # 跳过标题行
-
-        for row in reader:
-            # 创建要素
-            feature = ogr.Feature(layer.GetLayerDefn())
-            feature.SetField("FILE_NAME", row[0])
-            feature.SetField("FILE_PATH", row[1])
-            feature.SetField("ROAD_NAME", row[2])
-            feature.SetField("B", float(row[3]))
-            feature.SetField("L", float(row[4]))
-            feature.SetField("H", float(row[5]))
-            feature.SetField("HEADING", float(row[6]))
-
-            # 创建点几何
-            point = ogr.Geometry(ogr.wkbPoint)
-            point.SetPoint(0, float(row[4]), float(row[3])) # 经度, 纬度 (L, B)
-            feature.SetGeometry(point)
-
-            # 将要素写入图层
-            layer.CreateFeature(feature)
-
-            # 销毁要素
-            feature = None
-
-    # 销毁数据源
-    data_source = None
-    print(f"Shapefile已成功创建: {shp_file_path}")
-
-def run_hdi_processing(input_dir, base_path_for_photos, output_file_name):
-    # 批量处理当前目录中的所有HDI文件，并收集所有处理后的数据
-    final_data = batch_process_hdi_files(input_dir, base_path_for_photos)
-
-    # 在脚本同级目录下创建最终的合并CSV文件
-    output_csv_file = os.path.join(input_dir, f"{output_file_name}.csv")
-    with open(output_csv_file, 'w', newline='') as outfile:
-        writer = csv.writer(outfile)
-        # 写入标题行
-        writer.writerow(['FILE_NAME', 'FILE_PATH', 'ROAD_NAME', 'B', 'L', 'H', 'HEADING'])
-        # 写入所有收集到的数据
-        writer.writerows(final_data)
-    print(f"所有HDI文件的数据已合并到 {output_csv_file}")
-
-    # 第二步：将CSV文件转换为Shapefile
-    convert_csv_to_shp(output_csv_file, os.path.join(input_dir, f"{output_file_name}.shp"))
+    return data_source, layer
+
+def create_hdi_track_layer(shp_file_path, output_format=OUTPUT_FORMAT_SHP, append=False):
+    """
+    创建（或覆盖）用于存放轨迹线的图层，字段见HDI_TRACK_FIELDS。append同create_hdi_point_layer。
+
+    Returns:
+        tuple: (data_source, layer)，用法同create_hdi_point_layer。
+    """
+    from osgeo import ogr
+
+    if append and os.path.exists(shp_file_path):
+        return open_output_layer(shp_file_path)
+
+    data_source, srs, format_info = _create_output_data_source(shp_file_path, output_format)
+    layer = data_source.CreateLayer("hdi_tracks", srs, ogr.wkbLineString, options=format_info['layer_options'])
+    for field_name, field_type in HDI_TRACK_FIELDS:
+        layer.CreateField(ogr.FieldDefn(field_name, getattr(ogr, field_type)))
+    return data_source, layer
+
+def write_track_segments(layer, segments, batch_size=DEFAULT_WRITE_BATCH_SIZE, cancel_event=None):
+    """
+    批量写入轨迹段（见build_track_segments），几何直接由WKB创建。
+    cancel_event被置位后回滚当前事务并抛出ProcessingCancelled，见write_hdi_features。
+
+    Returns:
+        int: 写入的要素数量。
+    """
+    from osgeo import ogr
+
+    if not segments:
+        return 0
+    batch_size = max(int(batch_size), 1)
+    layer_defn = layer.GetLayerDefn()
+    field_indexes = [layer_defn.GetFieldIndex(field_name) for field_name, _ in HDI_TRACK_FIELDS]
+    feature = ogr.Feature(layer_defn)
+
+    for start in range(0, len(segments), batch_size):
+        layer.StartTransaction()
+        try:
+            for offset, segment in enumerate(segments[start:start + batch_size]):
+                if offset % CANCEL_CHECK_ROWS == 0:
+                    check_cancelled(cancel_event)
+                feature.SetFID(ogr.NullFID) # 清除上次写入时分配的FID
+                for field_index, value in zip(field_indexes, segment):
+                    feature.SetField(field_index, value)
+                feature.SetGeometry(ogr.CreateGeometryFromWkb(segment[-1]))
+                layer.CreateFeature(feature)
+        except Exception:
+            layer.RollbackTransaction()
+            raise
+        layer.CommitTransaction()
+
+    feature = None
+    return len(segments)
+
+def tracks_output_path(output_file_path):
+    """
+    轨迹线图层的输出路径：在主输出文件名后加上 _tracks，例如 merged_hdi_data_tracks.shp。
+    """
+    stem, extension = os.path.splitext(output_file_path)
+    return f"{stem}_tracks{extension}"
+
+def rows_to_columns(rows):
+    """
+    将按行组织的数据转换为按列组织的数组，数值列（B, L, H, HEADING）转换为float。
+
+    Args:
+        rows (list): 行列表，每行为 FILE_NAME, FILE_PATH, ROAD_NAME, B, L, H, HEADING。
+
+    Returns:
+        list: 7个列表，顺序与HDI_CSV_HEADER一致。
+    """
+    if not rows:
+        return [[] for _ in HDI_CSV_HEADER]
+    columns = [list(column) for column in zip(*rows)]
+    for i in range(3, len(HDI_CSV_HEADER)):
+        columns[i] = [float(value) for value in columns[i]]
+    return columns
+
+def output_header(photo_metadata=None):
+    """
+    合并CSV的标题行：启用照片元数据时在HDI_CSV_HEADER之后追加PHOTO_METADATA_HEADER。
+    """
+    return HDI_CSV_HEADER + (PHOTO_METADATA_HEADER if photo_metadata is not None else [])
+
+def extra_output_fields(header):
+    """
+    由标题行得到HDI_CSV_HEADER之后的附加字段（字段名, OGR字段类型），未知的列作为字符串字段。
+    """
+    field_types = dict(PHOTO_METADATA_FIELDS)
+    return [(field_name, field_types.get(field_name, 'OFTString')) for field_name in header[len(HDI_CSV_HEADER):]]
+
+def write_hdi_features(layer, columns, batch_size=DEFAULT_WRITE_BATCH_SIZE, coordinates=None, fids=None,
+                       written_fids=None, cancel_event=None):
+    """
+    按列批量写入HDI点要素。每batch_size个要素包在一个事务中提交，
+    要素定义、要素对象和点几何对象在整个写入过程中复用，避免逐要素创建/销毁对象。
+
+    Args:
+        layer (ogr.Layer): 由create_hdi_point_layer创建的图层。
+        columns (list): 7个等长序列，顺序与HDI_CSV_HEADER一致（FILE_NAME, FILE_PATH, ROAD_NAME, B, L, H, HEADING），
+                        数值列应已是数字（列表或NumPy数组）。之后的附加列依次写入图层中HDI_CSV_HEADER以外的字段
+                        （见create_hdi_point_layer的extra_fields），值为None或空字符串时写为空值。
+        batch_size (int): 每个事务包含的要素数量。
+        coordinates (tuple): 点几何的(x, y)数组（例如投影后的坐标，见output_crs.output_coordinates），
+                             为None时使用经纬度(L, B)。属性中的B、L始终为WGS84经纬度。
+        fids (list): 每行要替换的已有要素FID，-1表示作为新要素追加；为None时全部追加。
+        written_fids (list): 如果提供，依次追加每行写入后的FID（新要素的FID由图层分配）。
+        cancel_event (threading.Event): 写入过程中每CANCEL_CHECK_ROWS行检查一次，被置位后回滚当前事务
+                                        （之前的批次已提交）并抛出ProcessingCancelled。
+
+    Returns:
+        int: 写入的要素数量。
+    """
+    from osgeo import ogr
+
+    file_names, file_paths, road_names, b_values, l_values, h_values, heading_values = [
+        _as_list(column) for column in columns[:len(HDI_CSV_HEADER)]]
+    extra_columns = [_as_list(column) for column in columns[len(HDI_CSV_HEADER):]]
+    feature_count = len(file_names)
+    if feature_count == 0:
+        return 0
+    batch_size = max(int(batch_size), 1)
+    x_values, y_values = (l_values, b_values) if coordinates is None else [_as_list(values) for values in coordinates]
+    fids = _as_list(fids)
+
+    layer_defn = layer.GetLayerDefn()
+    name_index, path_index, road_index, b_index, l_index, h_index, heading_index = [
+        layer_defn.GetFieldIndex(field_name) for field_name in HDI_CSV_HEADER]
+    extra_indexes = [i for i in range(layer_defn.GetFieldCount())
+                     if layer_defn.GetFieldDefn(i).GetName() not in HDI_CSV_HEADER][:len(extra_columns)]
+    if len(extra_indexes) != len(extra_columns):
+        raise ValueError(f"图层缺少附加字段：需要 {len(extra_columns)} 个，只有 {len(extra_indexes)} 个。")
+
+    # 复用同一个要素对象和点几何对象
+    feature = ogr.Feature(layer_defn)
+    point = ogr.Geometry(ogr.wkbPoint)
+
+    for start in range(0, feature_count, batch_size):
+        stop = min(start + batch_size, feature_count)
+        layer.StartTransaction()
+        try:
+            for i in range(start, stop):
+                if (i - start) % CANCEL_CHECK_ROWS == 0:
+                    check_cancelled(cancel_event)
+                feature.SetFID(ogr.NullFID) # 清除上次写入时分配的FID
+                feature.SetField(name_index, file_names[i])
+                feature.SetField(path_index, file_paths[i])
+                feature.SetField(road_index, road_names[i])
+                feature.SetField(b_index, b_values[i])
+                feature.SetField(l_index, l_values[i])
+                feature.SetField(h_index, h_values[i])
+                feature.SetField(heading_index, heading_values[i])
+                for extra_index, extra_values in zip(extra_indexes, extra_columns):
+                    value = extra_values[i]
+                    if value is None or value == '':
+                        feature.SetFieldNull(extra_index) # 要素对象复用，需要清除上一行的值
+                    else:
+                        feature.SetField(extra_index, value)
+
+                point.SetPoint_2D(0, x_values[i], y_values[i]) # 默认为经度, 纬度 (L, B)
+                feature.SetGeometry(point)
+
+                if fids is not None and fids[i] >= 0:
+                    feature.SetFID(fids[i])
+                    layer.SetFeature(feature) # 原位替换已有要素
+                else:
+                    layer.CreateFeature(feature)
+                if written_fids is not None:
+                    written_fids.append(feature.GetFID())
+        except Exception:
+            layer.RollbackTransaction()
+            raise
+        layer.CommitTransaction()
+
+    feature = None
+    return feature_count
+
+def upsert_hdi_features(layer, columns, key_index, batch_size=DEFAULT_WRITE_BATCH_SIZE, coordinates=None,
+                        cancel_event=None):
+    """
+    按键（key_index.key_field，FILE_NAME或FILE_PATH）把一批要素写入已有图层：新键追加，已有键且内容有变化的
+    原位替换，内容相同的跳过。是否已存在由磁盘上的键索引判断（见feature_key_index），不扫描图层。
+    columns、coordinates、cancel_event同write_hdi_features。
+
+    Returns:
+        dict: 各类要素的数量，见FeatureKeyIndex.plan。
+    """
+    value_columns = [_as_list(column) for column in columns]
+    if not value_columns[0]:
+        return {}
+    key_hashes = hash_keys(value_columns[HDI_CSV_HEADER.index(key_index.key_field)])
+    geometry_columns = ((value_columns[4], value_columns[3]) if coordinates is None
+                        else [_as_list(values) for values in coordinates])
+    # 摘要的值与point_feature_values从图层读回的顺序一致：各字段（图层中多出的字段为空值），然后是点坐标
+    missing_fields = [itertools.repeat(None)] * max(layer.GetLayerDefn().GetFieldCount() - len(value_columns), 0)
+    digests = np.fromiter((feature_digest(row)
+                           for row in zip(*value_columns, *missing_fields, *geometry_columns)),
+                          dtype=np.uint64, count=len(value_columns[0]))
+    key_hashes, fids, write, counts = key_index.plan(key_hashes, digests)
+    if write.any():
+        written_fids = []
+        write_hdi_features(layer, take_rows(columns, write), batch_size,
+                           None if coordinates is None else take_rows(coordinates, write),
+                           fids[write], written_fids, cancel_event)
+        key_index.record(key_hashes[write], written_fids, digests[write])
+    return counts
+
+def point_feature_values(feature):
+    """
+    从点图层读回的要素中取出计算摘要的值（各字段值和点坐标），顺序与upsert_hdi_features写入时一致，
+    用于重建键索引（见FeatureKeyIndex.build）。
+    """
+    geometry = feature.GetGeometryRef()
+    point = [geometry.GetX(), geometry.GetY()] if geometry is not None else [None, None]
+    return [feature.GetField(i) for i in range(feature.GetFieldCount())] + point
+
+def create_crs_point_layers(shp_file_path, output_format, crs_list, extra_fields=(), append=False):
+    """
+    为每个输出坐标系创建一个点图层，返回[(坐标系, data_source, layer), ...]，第一个写入shp_file_path，
+    其余见output_crs.crs_output_path。extra_fields、append见create_hdi_point_layer。
+    """
+    return [(crs, *create_hdi_point_layer(crs_output_path(shp_file_path, crs, i == 0), output_format, crs['epsg'],
+                                          extra_fields, append))
+            for i, crs in enumerate(crs_list)]
+
+def write_crs_features(crs_layers, columns, batch_size, track=None, key_indexes=None, upsert_counts=None,
+                       cancel_event=None):
+    """
+    把同一批列写入各坐标系的图层：经纬度按整列批量投影一次，native版本直接使用HDI原生X/Y。
+    key_indexes为与crs_layers对应的键索引时按键更新（见upsert_hdi_features），主输出的计数累加到upsert_counts。
+    cancel_event见write_hdi_features。
+    """
+    for i, (crs, _, layer) in enumerate(crs_layers):
+        coordinates = None
+        if crs['native'] or crs['epsg'] != WGS84_EPSG:
+            coordinates = output_coordinates(crs, columns, track)
+        if key_indexes is None:
+            write_hdi_features(layer, columns, batch_size, coordinates, cancel_event=cancel_event)
+            continue
+        counts = upsert_hdi_features(layer, columns, key_indexes[i], batch_size, coordinates, cancel_event)
+        if i == 0 and upsert_counts is not None:
+            merge_upsert_counts(upsert_counts, counts)
+
+def print_crs_outputs(shp_file_path, output_format, crs_list):
+    if len(crs_list) == 1 and not crs_list[0]['native'] and crs_list[0]['epsg'] == WGS84_EPSG:
+        print(f"{OUTPUT_FORMATS[output_format]['name']}已成功创建: {shp_file_path}")
+        return
+    for i, crs in enumerate(crs_list):
+        print(f"{OUTPUT_FORMATS[output_format]['name']}已成功创建（坐标系 {crs['spec']}）: "
+              f"{crs_output_path(shp_file_path, crs, i == 0)}")
+
+def convert_csv_to_shp(csv_file_path, shp_file_path, batch_size=DEFAULT_WRITE_BATCH_SIZE,
+                       output_format=OUTPUT_FORMAT_SHP, metrics=None, output_crs=None, upsert_key=None,
+                       cancel_event=None):
+    """
+    将CSV文件转换为ESRI Shapefile（或output_format指定的其他格式）。
+    CSV文件应包含标题行：FILE_NAME, FILE_PATH, ROAD_NAME, H, B, L, HEADING
+    其中B为纬度，L为经度，使用WGS84地理坐标系。标题行之后的附加列（例如照片元数据）同样写为字段。
+    
+    Args:
+        csv_file_path (str): 输入CSV文件的路径。
+        shp_file_path (str): 输出Shapefile的路径。
+        batch_size (int): 每个写入事务包含的要素数量。
+        output_format (str): 输出格式，取值见OUTPUT_FORMATS。
+        metrics (StageMetrics): 如果提供，整个转换（含读取CSV和关闭数据源时建立空间索引）记为ogr_write阶段。
+        output_crs (list): 输出坐标系（见output_crs.parse_output_crs），第一个写入shp_file_path，
+                           其余各写一个带坐标系标签的文件；为None时只输出WGS84。CSV中没有原生X/Y，不能使用native。
+        upsert_key (str): 更新模式的键字段（FILE_NAME或FILE_PATH）。为None时重新创建输出；否则保留已有输出，
+                          新键的要素追加，已有键的要素内容有变化时原位替换，没有变化时跳过。
+                          已有键由输出文件旁的键索引（<输出文件>.keyidx）判断，不扫描已有图层。
+        cancel_event (threading.Event): 被置位后回滚正在写入的批次并抛出ProcessingCancelled，
+                                        已提交的批次保留在输出中；更新模式下不保存键索引，下次运行时重建。
+    """
+    crs_list = parse_output_crs_list(output_crs)
+    if any(crs['native'] for crs in crs_list):
+        raise ValueError("native坐标系需要HDI原生X/Y列，只能在流式模式下使用。")
+    if upsert_key is not None:
+        if upsert_key not in UPSERT_KEY_FIELDS:
+            raise ValueError(f"更新键只能是 {'、'.join(UPSERT_KEY_FIELDS)}: {upsert_key}")
+        if not OUTPUT_FORMATS[output_format]['append']:
+            raise ValueError(f"{OUTPUT_FORMATS[output_format]['name']}不支持更新已有要素，请使用 shp 或 gpkg。")
+    crs_paths = [crs_output_path(shp_file_path, crs, i == 0) for i, crs in enumerate(crs_list)]
+    key_indexes = None
+    upsert_counts = {}
+    with measure(metrics, 'ogr_write', bytes_read=file_size(csv_file_path)) as record:
+        # 从CSV读取数据，按批转换为列后写入Shapefile
+        with open(csv_file_path, 'r', encoding='gbk') as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader) # 跳过标题行
+            crs_layers = create_crs_point_layers(shp_file_path, output_format, crs_list, extra_output_fields(header),
+                                                 append=upsert_key is not None)
+            if upsert_key is not None:
+                key_indexes = [FeatureKeyIndex.load_or_build(path, layer, upsert_key, point_feature_values)
+                               for path, (_, _, layer) in zip(crs_paths, crs_layers)]
+
+            try:
+                while True:
+                    check_cancelled(cancel_event)
+                    rows = list(itertools.islice(reader, batch_size))
+                    if not rows:
+                        break
+                    write_crs_features(crs_layers, rows_to_columns(rows), batch_size,
+                                       key_indexes=key_indexes, upsert_counts=upsert_counts,
+                                       cancel_event=cancel_event)
+                    record['rows'] += len(rows)
+                if key_indexes is not None:
+                    for _, data_source, layer in crs_layers:
+                        rebuild_spatial_index(data_source, layer, output_format)
+            finally:
+                # 销毁数据源
+                crs_layers = data_source = layer = None
+
+        if key_indexes is not None:
+            # 数据源关闭、写入磁盘之后保存键索引，记录输出文件的最终状态
+            for path, key_index in zip(crs_paths, key_indexes):
+                key_index.save(path)
+    print_crs_outputs(shp_file_path, output_format, crs_list)
+    if upsert_key is not None:
+        print(f"按 {upsert_key} 更新: {format_upsert_counts(upsert_counts)}")
+
+def open_output_csv(csv_file_path, header, append=False):
+    """
+    打开合并CSV并返回(文件对象, csv.writer)。append为True且文件已存在时在末尾追加，不再写标题行，
+    已有标题行与header不一致时报错（例如一次启用了照片元数据而另一次没有）。
+    """
+    if append and os.path.exists(csv_file_path) and os.path.getsize(csv_file_path) > 0:
+        with open(csv_file_path, 'r', newline='') as csvfile:
+            existing_header = next(csv.reader(csvfile), [])
+        if existing_header != header:
+            raise ValueError(f"已有CSV的列与本次输出不一致，无法追加: {csv_file_path}")
+        csvfile = open(csv_file_path, 'a', newline='')
+        return csvfile, csv.writer(csvfile)
+    csvfile = open(csv_file_path, 'w', newline='')
+    writer = csv.writer(csvfile)
+    # 写入标题行
+    writer.writerow(header)
+    return csvfile, writer
+
+def thinned_output_path(output_file_path, spacing):
+    """
+    抽稀级别的输出路径：在主输出文件名后加上间距，例如 merged_hdi_data_20m.shp。
+    """
+    stem, extension = os.path.splitext(output_file_path)
+    return f"{stem}_{spacing:g}m{extension}"
+
+def stream_hdi_to_shp(input_dir, base_path_for_photos, shp_file_path, csv_file_path=None, workers=1,
+                      batch_size=DEFAULT_WRITE_BATCH_SIZE, photo_match=PHOTO_MATCH_AUTO,
+                      tolerance_ms=DEFAULT_MATCH_TOLERANCE_MS, match_reports=None, cache=None,
+                      progress_callback=None, cancel_event=None, output_format=OUTPUT_FORMAT_SHP,
+                      inventory=None, thin_spacings=None, thin_heading=None, thin_dp_tolerance=None,
+                      write_tracks=False, track_gap_seconds=DEFAULT_TRACK_GAP_SECONDS, metrics=None,
+                      warning_log=None, output_crs=None, photo_metadata=None, append=False):
+    """
+    流式处理：每个HDI文件处理完后立即写入Shapefile（以及可选的CSV），
+    不再先生成合并CSV再回读，内存占用只与单个HDI文件的大小有关。
+    给出thin_spacings时，同一遍处理中还为每个抽稀级别写出一个点图层，见thinned_output_path；
+    write_tracks为True时还写出按时间间隔切分的轨迹线图层，见tracks_output_path。
+
+    Args:
+        input_dir (str): 要处理的HDI文件所在的目录。
+        base_path_for_photos (str): 计算照片相对路径的基准路径。
+        shp_file_path (str): 输出Shapefile的路径。
+        csv_file_path (str): 同时写出的合并CSV路径，为None时不写CSV。
+        workers (int): 并行解析HDI文件的进程数，1为串行。
+        batch_size (int): 每个写入事务包含的要素数量。
+        photo_match (str): 照片配对模式，auto / timestamp / index。
+        tolerance_ms (int): 按时间戳匹配时允许的最大偏差（毫秒）。
+        match_reports (list): 如果提供，各文件的照片匹配报告追加到该列表中。
+        cache (HdiResultCache): 如果提供，未变化的HDI文件直接使用缓存结果。
+        progress_callback (callable): 进度回调，见iter_processed_hdi_files。
+        cancel_event (threading.Event): 取消标志，见iter_processed_hdi_files。
+        output_format (str): 输出格式，取值见OUTPUT_FORMATS。
+        inventory (FileInventory): 文件清单，见iter_processed_hdi_files。
+        thin_spacings (list): 各抽稀级别的最小间距（米），按HDI的投影坐标X/Y沿轨迹计算，见thin_levels。
+        thin_heading (float): 抽稀时优先保留与上一个变化点的朝向夹角达到该角度（度）的点。
+        thin_dp_tolerance (float): 抽稀时优先保留Douglas-Peucker简化（容差，米）选出的形状点；
+                                   写出轨迹线图层时也用它简化每段线。
+        write_tracks (bool): 是否写出轨迹线图层。
+        track_gap_seconds (float): 切分轨迹段的时间间隔（秒）。
+        metrics (StageMetrics): 如果提供，除扫描、解析和匹配外还记录每个文件的CSV写出（csv_write）
+                                和要素写出（ogr_write，含抽稀和轨迹线）耗时。
+        warning_log (WarningLog): 按类别限流的警告日志，见iter_processed_hdi_files。
+        output_crs (list): 点图层的输出坐标系，见convert_csv_to_shp；native为HDI原生X/Y，不做转换。
+                           抽稀和轨迹线图层始终为WGS84。
+        photo_metadata (PhotoMetadataExtractor): 照片元数据和缩略图阶段，见iter_processed_hdi_files；
+                                                 各点图层（含抽稀图层）和CSV都增加相应的列。
+        append (bool): 为True时向已有的各输出文件（点图层、抽稀和轨迹线图层、CSV）追加，不存在的文件照常创建。
+    """
+    thin_spacings = list(thin_spacings or [])
+    header = output_header(photo_metadata)
+    extra_fields = extra_output_fields(header)
+    crs_list = parse_output_crs_list(output_crs)
+    crs_layers = create_crs_point_layers(shp_file_path, output_format, crs_list, extra_fields, append)
+    thin_outputs = [create_hdi_point_layer(thinned_output_path(shp_file_path, spacing), output_format,
+                                           extra_fields=extra_fields, append=append)
+                    for spacing in thin_spacings]
+    thin_counts = [0] * len(thin_spacings)
+    total_count = 0
+    track_data_source, track_layer = (create_hdi_track_layer(tracks_output_path(shp_file_path), output_format, append)
+                                      if write_tracks else (None, None))
+    track_count = 0
+    # 抽稀和轨迹线需要的附加HDI列
+    track_columns = tuple(dict.fromkeys((THINNING_TRACK_COLUMNS if thin_spacings else ())
+                                        + (TRACK_LINE_COLUMNS if write_tracks else ())
+                                        + (('X', 'Y') if any(crs['native'] for crs in crs_list) else ())))
+
+    csvfile = None
+    writer = None
+    if csv_file_path:
+        csvfile, writer = open_output_csv(csv_file_path, header, append)
+
+    try:
+        for hdi_file_path, columns, track in iter_processed_hdi_files(
+                input_dir, base_path_for_photos, workers, photo_match, tolerance_ms, match_reports, cache,
+                progress_callback, cancel_event, inventory, track_columns, metrics, warning_log, photo_metadata):
+            if writer is not None:
+                with measure(metrics, 'csv_write', rows=len(columns[0])):
+                    writer.writerows(columns_to_rows(columns))
+            with measure(metrics, 'ogr_write', rows=len(columns[0])):
+                write_crs_features(crs_layers, columns, batch_size, track, cancel_event=cancel_event)
+                total_count += len(columns[0])
+                if thin_spacings:
+                    # 一次计算所有级别的掩码，各级别从同一份列数据中取行
+                    masks = thin_levels(track['X'], track['Y'], columns[6], thin_spacings, thin_heading,
+                                        thin_dp_tolerance)
+                    for i, ((_, thin_layer), mask) in enumerate(zip(thin_outputs, masks)):
+                        thin_counts[i] += write_hdi_features(thin_layer, take_rows(columns, mask), batch_size)
+                if write_tracks:
+                    track_count += write_track_segments(
+                        track_layer, build_track_segments(os.path.relpath(hdi_file_path, input_dir), columns, track,
+                                                          track_gap_seconds * 1000, thin_dp_tolerance), batch_size)
+    finally:
+        if csvfile is not None:
+            csvfile.close()
+        # 销毁数据源（空间索引在此时建立，计入ogr_write）
+        with measure(metrics, 'ogr_write'):
+            if append:
+                appended = [(data_source, layer) for _, data_source, layer in crs_layers] + thin_outputs
+                if write_tracks:
+                    appended.append((track_data_source, track_layer))
+                for data_source, layer in appended:
+                    rebuild_spatial_index(data_source, layer, output_format)
+                appended = data_source = layer = None
+            crs_layers = None
+            thin_outputs = None
+            track_layer = track_data_source = None
+
+    if csv_file_path:
+        print(f"所有HDI文件的数据已合并到 {csv_file_path}")
+    print_crs_outputs(shp_file_path, output_format, crs_list)
+    for spacing, thin_count in zip(thin_spacings, thin_counts):
+        print(f"抽稀级别 {spacing:g} 米: 保留 {thin_count}/{total_count} 个点，"
+              f"已写入 {thinned_output_path(shp_file_path, spacing)}")
+    if write_tracks:
+        print(f"轨迹线图层已成功创建（{track_count} 段）: {tracks_output_path(shp_file_path)}")
+
+def stream_hdi_to_csv(input_dir, base_path_for_photos, csv_file_path, workers=1, photo_match=PHOTO_MATCH_AUTO,
+                      tolerance_ms=DEFAULT_MATCH_TOLERANCE_MS, match_reports=None, cache=None,
+                      progress_callback=None, cancel_event=None, inventory=None, metrics=None, warning_log=None,
+                      photo_metadata=None, append=False):
+    """
+    仅输出CSV：每个HDI文件处理完后立即追加到合并CSV，不创建任何图层，也不导入GDAL。
+    参数含义同stream_hdi_to_shp。
+    """
+    csvfile, writer = open_output_csv(csv_file_path, output_header(photo_metadata), append)
+    with csvfile:
+        for _, columns, _ in iter_processed_hdi_files(
+                input_dir, base_path_for_photos, workers, photo_match, tolerance_ms, match_reports, cache,
+                progress_callback, cancel_event, inventory, (), metrics, warning_log, photo_metadata):
+            with measure(metrics, 'csv_write', rows=len(columns[0])):
+                writer.writerows(columns_to_rows(columns))
+    print(f"所有HDI文件的数据已合并到 {csv_file_path}")
+
+def write_match_report(match_reports, report_file_path):
+    """
+    将各HDI文件（文件夹）的照片匹配报告写入CSV。
+
+    Args:
+        match_reports (list): 匹配报告字典列表，字段见MATCH_REPORT_HEADER。
+        report_file_path (str): 报告CSV的路径。
+    """
+    with open(report_file_path, 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=MATCH_REPORT_HEADER)
+        writer.writeheader()
+        writer.writerows(match_reports)
+    mismatched = sum(1 for report in match_reports if report['UNMATCHED_ROWS'] or report['UNUSED_PHOTOS'])
+    print(f"照片匹配报告已写入 {report_file_path}（{mismatched}/{len(match_reports)} 个文件夹存在未配对的行或照片）")
+
+def run_hdi_processing(input_dir, base_path_for_photos, output_file_name, stream=False, write_csv=True,
+                       workers=1, batch_size=DEFAULT_WRITE_BATCH_SIZE, photo_match=PHOTO_MATCH_AUTO,
+                       tolerance_ms=DEFAULT_MATCH_TOLERANCE_MS, match_report=False, use_cache=False,
+                       cache_dir=None, progress_callback=None, cancel_event=None,
+                       output_format=OUTPUT_FORMAT_SHP, use_inventory=False, inventory_file=None,
+                       scan_workers=DEFAULT_SCAN_WORKERS, thin_spacings=None, thin_heading=None,
+                       thin_dp_tolerance=None, write_tracks=False,
+                       track_gap_seconds=DEFAULT_TRACK_GAP_SECONDS, metrics=None, warning_log=None,
+                       error_report=False, write_shp=True, output_crs=None, extract_photo_metadata=False,
+                       thumb_size=DEFAULT_THUMB_SIZE, thumb_workers=0, output_dir=None, append=False,
+                       upsert_key=None):
+    """
+    处理input_dir中的HDI文件并写出合并CSV和图层，各输出文件写入output_dir（默认为input_dir）。
+    append为True时（仅流式或仅CSV模式）把本次的要素追加到output_dir中已有的输出文件，不重建它们，
+    供监视文件夹模式逐个处理新到的文件夹，见watch_hdi_folders.py。
+    upsert_key为FILE_NAME或FILE_PATH时（非流式模式）按该键更新output_dir中已有的点图层，见convert_csv_to_shp；
+    合并CSV仍只包含本次处理的行。
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    if append and write_shp and not stream:
+        raise ValueError("追加到已有输出只能在流式模式或仅CSV模式下使用。")
+    if append and write_shp and not OUTPUT_FORMATS[output_format]['append']:
+        raise ValueError(f"{OUTPUT_FORMATS[output_format]['name']}不支持追加要素，请使用 shp 或 gpkg。")
+    if upsert_key is not None and (stream or append or not write_shp or write_tracks):
+        raise ValueError("按键更新只能在非流式模式下使用，且不能与追加、仅CSV或轨迹线图层一起使用。")
+    if not write_shp and (thin_spacings or write_tracks):
+        raise ValueError("仅输出CSV时不能输出抽稀图层或轨迹线图层。")
+    if any(crs['native'] for crs in parse_output_crs_list(output_crs)) and not stream:
+        # 原生X/Y不写入中间CSV，只在流式模式下可用
+        raise ValueError("native坐标系只能在流式模式下使用。")
+    if (thin_spacings or thin_dp_tolerance) and not stream:
+        # 抽稀和轨迹线简化需要逐个HDI文件的轨迹，只在流式模式下进行
+        raise ValueError("抽稀只能在流式模式下使用。")
+    if thin_heading and not thin_spacings:
+        raise ValueError("朝向变化阈值只用于抽稀，需要同时给出抽稀间距。")
+    if thin_dp_tolerance and not (thin_spacings or write_tracks):
+        raise ValueError("Douglas-Peucker容差只用于抽稀和轨迹线图层，需要同时给出抽稀间距或输出轨迹线图层。")
+    output_dir = output_dir or input_dir
+    output_csv_file = os.path.join(output_dir, f"{output_file_name}.csv")
+    output_shp_file = os.path.join(output_dir, f"{output_file_name}{OUTPUT_FORMATS[output_format]['extension']}")
+    match_reports = [] if match_report else None
+    if error_report and warning_log is None:
+        warning_log = WarningLog()
+    cache = None
+    if use_cache:
+        # 缓存每个HDI文件的处理结果，重复运行时只解析新增或变更的文件夹
+        cache = HdiResultCache(cache_dir or os.path.join(input_dir, DEFAULT_CACHE_DIR_NAME))
+    inventory = None
+    if use_inventory:
+        # 并行扫描目录并记录文件清单，重复运行时只重新列出修改时间变化的目录
+        inventory = FileInventory(inventory_file or os.path.join(input_dir, DEFAULT_CACHE_DIR_NAME,
+                                                                 DEFAULT_INVENTORY_FILE_NAME), scan_workers)
+    # 照片元数据和缩略图使用单独的进程池，与HDI解析的进程池同时运行，处理结束时关闭
+    with (PhotoMetadataExtractor(resolve_worker_count(thumb_workers), thumb_size) if extract_photo_metadata
+          else contextlib.nullcontext()) as photo_metadata:
+        if not write_shp:
+            # 仅CSV模式：逐个HDI文件写出CSV，整个运行不加载GDAL
+            stream_hdi_to_csv(input_dir, base_path_for_photos, output_csv_file, workers, photo_match, tolerance_ms,
+                              match_reports, cache, progress_callback, cancel_event, inventory, metrics, warning_log,
+                              photo_metadata, append)
+        elif stream:
+            # 流式模式：HDI行直接写入Shapefile，CSV可选地同步写出
+            stream_hdi_to_shp(input_dir, base_path_for_photos, output_shp_file,
+                              output_csv_file if write_csv else None, workers, batch_size,
+                              photo_match, tolerance_ms, match_reports, cache,
+                              progress_callback, cancel_event, output_format, inventory,
+                              thin_spacings, thin_heading, thin_dp_tolerance, write_tracks, track_gap_seconds,
+                              metrics, warning_log, output_crs, photo_metadata, append)
+        else:
+            # 批量处理当前目录中的所有HDI文件，并收集所有处理后的数据
+            track_segments = [] if write_tracks else None
+            final_data = batch_process_hdi_files(input_dir, base_path_for_photos, workers,
+                                                 photo_match, tolerance_ms, match_reports, cache,
+                                                 progress_callback, cancel_event, inventory,
+                                                 track_segments, track_gap_seconds, metrics, warning_log,
+                                                 photo_metadata)
+            check_cancelled(cancel_event)
+
+            # 在脚本同级目录下创建最终的合并CSV文件
+            with measure(metrics, 'csv_write', rows=len(final_data)), \
+                    open(output_csv_file, 'w', newline='') as outfile:
+                writer = csv.writer(outfile)
+                # 写入标题行
+                writer.writerow(output_header(photo_metadata))
+                # 分批写入所有收集到的数据，批次之间响应取消
+                for start in range(0, len(final_data), batch_size):
+                    check_cancelled(cancel_event)
+                    writer.writerows(final_data[start:start + batch_size])
+            print(f"所有HDI文件的数据已合并到 {output_csv_file}")
+
+            # 第二步：将CSV文件转换为Shapefile
+            convert_csv_to_shp(output_csv_file, output_shp_file, batch_size, output_format, metrics, output_crs,
+                               upsert_key, cancel_event)
+
+            if track_segments is not None:
+                # 轨迹段在处理HDI时已经算好，这里只需写出
+                track_data_source, track_layer = create_hdi_track_layer(tracks_output_path(output_shp_file),
+                                                                        output_format)
+                try:
+                    with measure(metrics, 'ogr_write'):
+                        write_track_segments(track_layer, track_segments, batch_size, cancel_event)
+                finally:
+                    track_layer = track_data_source = None
+                print(f"轨迹线图层已成功创建（{len(track_segments)} 段）: {tracks_output_path(output_shp_file)}")
+
+    if photo_metadata is not None:
+        print(f"照片元数据: 检查 {photo_metadata.photos_checked} 张照片，新生成 {photo_metadata.thumbnails_made} 个缩略图。")
+
+    if match_reports is not None:
+        write_match_report(match_reports, os.path.join(output_dir, f"{output_file_name}_photo_match.csv"))
+    if warning_log is not None:
+        warning_log.print_summary()
+        if error_report:
+            warning_log.write_report(os.path.join(output_dir, f"{output_file_name}_errors.json"))
+    if metrics is not None:
+        metrics.print_summary()
 
 if __name__ == "__main__":
+    # 打包为exe后，进程池的子进程需要此调用才能正常启动
+    multiprocessing.freeze_support()
+
     parser = argparse.ArgumentParser(description="Process HDI files and convert to CSV and Shapefile.")
     parser.add_argument('--input_dir', type=str, default=os.getcwd(),
                         help='要处理的HDI文件所在的目录。默认为当前工作目录。')
     parser.add_argument('--base_path', type=str, default=r'E:\Code',
                         help='计算照片相对路径的基准路径。默认为 E:\\Code。')
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='输出文件所在的目录。默认为 --input_dir。')
     parser.add_argument('--output_name', type=str, default='merged_hdi_data',
                         help='输出CSV和Shapefile文件的名称（不包含扩展名）。默认为 merged_hdi_data。')
+    parser.add_argument('--format', choices=tuple(OUTPUT_FORMATS), default=OUTPUT_FORMAT_SHP,
+                        help='输出格式：shp (ESRI Shapefile)、gpkg (GeoPackage)、fgb (FlatGeobuf)、parquet (GeoParquet，'
+                             '需要GDAL带Parquet驱动)。各格式均建立空间索引。默认为 shp。')
+    parser.add_argument('--output_crs', nargs='+', default=None,
+                        help='点图层的输出坐标系，可给出多个（如 EPSG:4326 EPSG:4547），同一遍处理中写出各个版本：'
+                             '第一个写入 <output_name>，其余写入 <output_name>_epsg<代码>。经纬度按整列批量投影；'
+                             'native 直接使用HDI原生投影坐标X/Y（可写为 native:<EPSG> 标注坐标系，仅流式模式）。'
+                             '默认为 EPSG:4326。')
+    parser.add_argument('--stream', action='store_true',
+                        help='流式模式：HDI数据直接写入Shapefile，不再回读中间CSV，内存占用不随数据量增长。')
+    parser.add_argument('--upsert_key', choices=UPSERT_KEY_FIELDS, default=None,
+                        help='按键更新已有的点图层（仅 shp/gpkg，非流式模式）：新键的要素追加，已有键且内容有变化的要素原位替换，'
+                             '没有变化的跳过，不再删除重建。已有键记录在输出文件旁的键索引 <输出文件>.keyidx 中，'
+                             '不扫描已有图层；索引缺失或输出被其他程序改过时自动扫描重建一次。')
+    parser.add_argument('--no_csv', action='store_true',
+                        help='仅在流式模式下有效：不输出合并CSV文件。')
+    parser.add_argument('--csv_only', action='store_true',
+                        help='只输出合并CSV，不生成Shapefile等图层，整个运行不加载GDAL，启动更快。')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='并行解析HDI文件的进程数。默认为1（串行），0表示使用全部CPU核心。')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_WRITE_BATCH_SIZE,
+                        help=f'写入Shapefile时每个事务包含的要素数量。默认为 {DEFAULT_WRITE_BATCH_SIZE}。')
+    parser.add_argument('--photo_match', choices=PHOTO_MATCH_MODES, default=PHOTO_MATCH_AUTO,
+                        help='照片与HDI行的配对方式：timestamp按时间戳最近邻匹配，index按排序后的顺序配对，'
+                             'auto在照片名含时间戳时使用timestamp，否则使用index。默认为 auto。')
+    parser.add_argument('--photo_tolerance_ms', type=int, default=DEFAULT_MATCH_TOLERANCE_MS,
+                        help=f'按时间戳匹配时允许的最大时间偏差（毫秒）。默认为 {DEFAULT_MATCH_TOLERANCE_MS}。')
+    parser.add_argument('--photo_match_report', action='store_true',
+                        help='输出每个文件夹的照片匹配报告 <output_name>_photo_match.csv。')
+    parser.add_argument('--cache', action='store_true',
+                        help='启用按HDI文件的结果缓存：重复运行时只解析新增或变更的文件夹，其余直接使用缓存。')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help=f'缓存目录。默认为 <input_dir>/{DEFAULT_CACHE_DIR_NAME}。')
+    parser.add_argument('--inventory', action='store_true',
+                        help='使用文件清单：多线程并行扫描目录并记录各文件的大小和修改时间，'
+                             '重复运行时只重新列出修改时间变化的目录（适合网络存储上的大量照片）。')
+    parser.add_argument('--inventory_file', type=str, default=None,
+                        help=f'文件清单路径。默认为 <input_dir>/{DEFAULT_CACHE_DIR_NAME}/{DEFAULT_INVENTORY_FILE_NAME}。')
+    parser.add_argument('--scan_workers', type=int, default=DEFAULT_SCAN_WORKERS,
+                        help=f'扫描目录的线程数。默认为 {DEFAULT_SCAN_WORKERS}。')
+    parser.add_argument('--thin_spacing', type=float, nargs='+', default=None,
+                        help='仅在流式模式下有效：轨迹抽稀的最小间距（米），可给出多个值，'
+                             '同一遍处理中为每个值输出一个点图层 <output_name>_<间距>m。除首尾点外，相邻保留点沿轨迹的间距不小于该值。')
+    parser.add_argument('--thin_heading', type=float, default=None,
+                        help='需要与 --thin_spacing 一起使用：抽稀时优先保留与上一个变化点的朝向夹角达到该角度（度）的点（转弯处），'
+                             '仍满足最小间距。')
+    parser.add_argument('--thin_dp_tolerance', type=float, default=None,
+                        help='仅在流式模式下有效：抽稀时优先保留Douglas-Peucker简化选出的形状点（仍满足最小间距），'
+                             '与 --tracks 一起使用时同时用它简化轨迹线图层，值为容差（米）。')
+    parser.add_argument('--tracks', action='store_true',
+                        help='同时输出轨迹线图层 <output_name>_tracks：每个HDI文件按时间间隔切分为若干条线，'
+                             '属性包括道路名称、起止时间、长度和点数。')
+    parser.add_argument('--track_gap', type=float, default=DEFAULT_TRACK_GAP_SECONDS,
+                        help=f'切分轨迹线的时间间隔（秒），相邻两点时间差超过该值时断开。默认为 {DEFAULT_TRACK_GAP_SECONDS:g}。')
+    parser.add_argument('--photo_metadata', action='store_true',
+                        help='照片配对后读取每张已配对照片的尺寸和EXIF拍摄时间，并在CCD同级的CCD_THUMB文件夹中生成缩略图，'
+                             '输出中增加 IMG_WIDTH、IMG_HEIGHT、CAPTURE_TM、THUMB_PATH 列。已是最新的缩略图不再重新生成。')
+    parser.add_argument('--thumb_size', type=int, default=DEFAULT_THUMB_SIZE,
+                        help=f'缩略图最长边（像素），需要安装Pillow；0表示只读取元数据、不生成缩略图。默认为 {DEFAULT_THUMB_SIZE}。')
+    parser.add_argument('--thumb_workers', type=int, default=0,
+                        help='读取照片元数据和生成缩略图的进程数。默认为0（使用全部CPU核心）。')
+    parser.add_argument('--error_report', action='store_true',
+                        help='输出错误报告 <output_name>_errors.json：各类警告的计数和前几条示例。')
+    parser.add_argument('--metrics_report', action='store_true',
+                        help='输出运行报告 <output_name>_run_report.json：各阶段的耗时、行数、吞吐量、读取字节数和峰值内存。')
+    parser.add_argument('--profile', choices=PIPELINE_STAGES, default=None,
+                        help='用cProfile采样一个阶段，打印耗时最多的函数并保存到 <output_name>_<阶段>.prof。'
+                             'parse/match只在串行（--workers 1）时在主进程中运行。')
     args = parser.parse_args()
 
-    run_hdi_processing(args.input_dir, args.base_path, args.output_name)
\ No newline at end of file
+    if args.no_csv and not args.stream:
+        parser.error('--no_csv 只能与 --stream 一起使用。')
+    if (args.thin_spacing or args.thin_dp_tolerance) and not args.stream:
+        parser.error('--thin_spacing 和 --thin_dp_tolerance 只能与 --stream 一起使用。')
+    if args.thin_heading and not args.thin_spacing:
+        parser.error('--thin_heading 需要与 --thin_spacing 一起使用。')
+    if args.thin_dp_tolerance and not (args.thin_spacing or args.tracks):
+        parser.error('--thin_dp_tolerance 需要与 --thin_spacing 或 --tracks 一起使用。')
+    try:
+        output_crs_list = parse_output_crs_list(args.output_crs)
+    except ValueError as e:
+        parser.error(str(e))
+    if any(crs['native'] for crs in output_crs_list) and not args.stream:
+        parser.error('--output_crs native 只能与 --stream 一起使用。')
+    if args.csv_only and (args.no_csv or args.thin_spacing or args.tracks):
+        parser.error('--csv_only 不能与 --no_csv、--thin_spacing 或 --tracks 一起使用。')
+    if args.upsert_key and (args.stream or args.csv_only or args.tracks):
+        parser.error('--upsert_key 不能与 --stream、--csv_only 或 --tracks 一起使用。')
+    if args.upsert_key and not OUTPUT_FORMATS[args.format]['append']:
+        parser.error('--upsert_key 只能用于 shp 或 gpkg 格式。')
+    if args.photo_metadata and args.thumb_size > 0 and not pillow_available():
+        parser.error('生成缩略图需要安装Pillow（pip install Pillow），或使用 --thumb_size 0 只读取元数据。')
+
+    metrics = StageMetrics(args.profile)
+    run_hdi_processing(args.input_dir, args.base_path, args.output_name,
+                       stream=args.stream, write_csv=not args.no_csv, workers=args.workers,
+                       batch_size=args.batch_size, photo_match=args.photo_match,
+                       tolerance_ms=args.photo_tolerance_ms, match_report=args.photo_match_report,
+                       use_cache=args.cache, cache_dir=args.cache_dir, output_format=args.format,
+                       use_inventory=args.inventory, inventory_file=args.inventory_file,
+                       scan_workers=args.scan_workers, thin_spacings=args.thin_spacing,
+                       thin_heading=args.thin_heading, thin_dp_tolerance=args.thin_dp_tolerance,
+                       write_tracks=args.tracks, track_gap_seconds=args.track_gap, metrics=metrics,
+                       warning_log=WarningLog(), error_report=args.error_report, write_shp=not args.csv_only,
+                       output_crs=args.output_crs, extract_photo_metadata=args.photo_metadata,
+                       thumb_size=max(args.thumb_size, 0), thumb_workers=args.thumb_workers,
+                       output_dir=args.output_dir, upsert_key=args.upsert_key)
+    if args.metrics_report:
+        metrics.write_report(os.path.join(args.output_dir or args.input_dir, f"{args.output_name}_run_report.json"))
+    if args.profile:
+        metrics.write_profile(os.path.join(args.output_dir or args.input_dir, f"{args.output_name}_{args.profile}.prof"))
\ No newline at end of file
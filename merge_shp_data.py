@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+# Shapefile合并引擎：先并行读取所有输入的头信息并统一检查模式和坐标系，
+# 再按输入顺序批量写出。支持fiona（并行读取+批量写入）和OGR原生追加两种方式，
+# 以及按键（FILE_NAME或FILE_PATH）更新已有输出的方式。
+import argparse
+import itertools
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from feature_key_index import (UPSERT_KEY_FIELDS, FeatureKeyIndex, feature_digest, format_upsert_counts, hash_keys,
+                               merge_upsert_counts)
+from file_inventory import FileInventory
+from pipeline_metrics import StageMetrics, file_size, measure
+from shp_dbf_update import find_dbf_path
+
+# 合并方式
+MERGE_ENGINE_FIONA = 'fiona'
+MERGE_ENGINE_OGR = 'ogr'
+MERGE_ENGINES = (MERGE_ENGINE_FIONA, MERGE_ENGINE_OGR)
+
+# 每次批量写入的要素数量
+DEFAULT_MERGE_BATCH_SIZE = 10000
+# 并行读取的线程数
+DEFAULT_MERGE_WORKERS = 4
+# 每个输入文件预读的批次数上限，限制内存占用
+_PREFETCH_BATCHES = 4
+_END_OF_FILE = object()
+
+# 提升为字符串字段时，各类型转成文本所需的最小宽度
+_TEXT_WIDTHS = {'int': 20, 'float': 24, 'date': 10, 'time': 12, 'datetime': 23}
+# 字段类型被提升后，对输入值的转换（日期等在fiona中读出时已是ISO格式字符串）
+_CONVERTERS = {'float': float, 'str': str}
+# 按键更新时向已有输出添加字段所用的OGR字段类型
+_OGR_FIELD_TYPES = {'int': 'OFTInteger64', 'float': 'OFTReal', 'str': 'OFTString', 'date': 'OFTDate',
+                    'time': 'OFTTime', 'datetime': 'OFTDateTime'}
+
+
+def find_shapefiles(directory_path, workers=DEFAULT_MERGE_WORKERS):
+    """
+    递归查找目录下所有的.shp文件（多线程并行扫描各级目录），按路径排序返回，保证合并顺序确定。
+
+    Args:
+        directory_path (str): 要搜索的目录。
+        workers (int): 扫描目录的线程数。
+    """
+    return FileInventory(workers=workers).scan(directory_path).find_files(directory_path, '.shp', ignore_case=True)
+
+
+def read_shapefile_header(shp_file_path, encoding='utf-8'):
+    """
+    只读取Shapefile的头信息（驱动、模式、坐标系、要素数量），不遍历要素。
+    """
+    import fiona
+
+    with fiona.open(shp_file_path, 'r', encoding=encoding) as source:
+        return {
+            'path': shp_file_path,
+            'driver': source.driver,
+            'schema': source.schema,
+            'crs': source.crs,
+            'count': len(source),
+        }
+
+
+def read_shapefile_headers(input_shapefiles, encoding='utf-8', workers=DEFAULT_MERGE_WORKERS):
+    """
+    并行读取所有输入Shapefile的头信息，返回顺序与输入一致。
+    """
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(executor.map(lambda path: read_shapefile_header(path, encoding), input_shapefiles))
+
+
+def _parse_field_type(field_type):
+    """
+    把fiona的字段类型字符串（如'str:80'、'float:24.15'、'int'）拆成(基本类型, 宽度, 精度)，
+    未给出的宽度和精度为None。
+    """
+    from fiona.schema import normalize_field_type
+
+    base, _, size = field_type.partition(':')
+    base = normalize_field_type(base)
+    if base in ('int32', 'int64'):
+        base = 'int'
+    width, _, precision = size.partition('.')
+    return base, int(width) if width else None, int(precision) if precision else None
+
+
+def _format_field_type(base, width, precision):
+    if width is None:
+        return base
+    if precision is None or base != 'float':
+        return f'{base}:{width}'
+    return f'{base}:{width}.{precision}'
+
+
+def _max_or_none(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def promote_field_type(type_a, type_b):
+    """
+    求能同时容纳两种字段类型的类型：同类型取较大的宽度和精度，int与float提升为float，
+    其余不同类型的组合（如date与str、数值与str）提升为str。
+    """
+    base_a, width_a, precision_a = _parse_field_type(type_a)
+    base_b, width_b, precision_b = _parse_field_type(type_b)
+    if base_a == base_b:
+        return _format_field_type(base_a, _max_or_none(width_a, width_b), _max_or_none(precision_a, precision_b))
+    if {base_a, base_b} == {'int', 'float'}:
+        return _format_field_type('float', _max_or_none(width_a, width_b), _max_or_none(precision_a, precision_b))
+    # 提升为字符串时，宽度至少要能放下原来的数值或日期文本
+    widths = [width if base == 'str' else max(width or 0, _TEXT_WIDTHS.get(base, 0))
+              for base, width in ((base_a, width_a), (base_b, width_b))]
+    return _format_field_type('str', _max_or_none(*widths) or None, None)
+
+
+def build_union_schema(headers):
+    """
+    由所有输入的头信息构造合并后的模式：字段为所有输入字段的并集（按首次出现的顺序，
+    字段名不区分大小写，保留首次出现时的写法），同名字段的类型按promote_field_type提升。
+
+    Returns:
+        dict: fiona模式。
+    """
+    geometry = headers[0]['schema']['geometry']
+    geometry_mismatches = [header['path'] for header in headers[1:] if header['schema']['geometry'] != geometry]
+    if geometry_mismatches:
+        raise ValueError(f"Shapefile几何类型不匹配: {', '.join(geometry_mismatches)}")
+
+    properties = {}
+    names = {}
+    for header in headers:
+        for name, field_type in header['schema']['properties'].items():
+            union_name = names.setdefault(name.lower(), name)
+            if union_name in properties:
+                properties[union_name] = promote_field_type(properties[union_name], field_type)
+            else:
+                properties[union_name] = field_type
+    return {'geometry': geometry, 'properties': properties}
+
+
+def check_merge_inputs(input_shapefiles, encoding='utf-8', workers=DEFAULT_MERGE_WORKERS):
+    """
+    在写出任何要素之前检查所有输入：文件是否存在、几何类型和坐标系是否与第一个文件一致，
+    并构造合并后的模式。各输入的字段可以不同，缺少的字段在合并结果中为空值。
+
+    Returns:
+        tuple: (各输入文件的头信息列表, 合并后的模式)
+    """
+    if not input_shapefiles:
+        raise ValueError("没有提供输入Shapefile文件。")
+
+    # 检查所有输入文件是否存在
+    for shp_file in input_shapefiles:
+        if not os.path.exists(shp_file):
+            raise FileNotFoundError(f"输入Shapefile未找到: {shp_file}")
+
+    headers = read_shapefile_headers(input_shapefiles, encoding, workers)
+    crs = headers[0]['crs']
+    crs_mismatches = [header['path'] for header in headers[1:] if header['crs'] != crs]
+    if crs_mismatches:
+        raise ValueError(f"Shapefile CRS不匹配: {', '.join(crs_mismatches)}")
+    return headers, build_union_schema(headers)
+
+
+def _make_property_mapping(source_schema, union_schema):
+    """
+    计算一个输入文件的属性到合并模式的映射：[(合并后字段名, 输入字段名或None, 转换函数或None)]。
+    输入模式与合并模式完全一致时返回None，要素可原样写出。
+    """
+    if source_schema['properties'] == union_schema['properties']:
+        return None
+    source_names = {name.lower(): name for name in source_schema['properties']}
+    mapping = []
+    for union_name, union_type in union_schema['properties'].items():
+        source_name = source_names.get(union_name.lower())
+        converter = None
+        if source_name is not None:
+            union_base = _parse_field_type(union_type)[0]
+            source_base = _parse_field_type(source_schema['properties'][source_name])[0]
+            if union_base != source_base:
+                converter = _CONVERTERS.get(union_base)
+        mapping.append((union_name, source_name, converter))
+    return mapping
+
+
+def _remap_features(features, mapping):
+    """
+    按_make_property_mapping的结果重建要素属性，缺少的字段填None。
+    """
+    import fiona
+
+    remapped = []
+    for feature in features:
+        properties = feature['properties']
+        values = {}
+        for union_name, source_name, converter in mapping:
+            value = properties[source_name] if source_name is not None else None
+            if converter is not None and value is not None:
+                value = converter(value)
+            values[union_name] = value
+        remapped.append(fiona.Feature(geometry=feature.geometry, id=feature.id,
+                                      properties=fiona.Properties(**values)))
+    return remapped
+
+
+def _put_unless_stopped(batch_queue, item, stop_event):
+    """
+    向有界队列放入数据；写出端出错而停止消费时（stop_event被置位）放弃放入，避免读取线程永久阻塞。
+    """
+    while not stop_event.is_set():
+        try:
+            batch_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_batches(shp_file_path, encoding, batch_size, mapping, batch_queue, stop_event):
+    """
+    读取线程：把一个输入文件的要素按批（必要时先映射到合并模式）放入队列，结束时放入_END_OF_FILE。
+    """
+    import fiona
+
+    try:
+        with fiona.open(shp_file_path, 'r', encoding=encoding) as source:
+            features = iter(source)
+            while not stop_event.is_set():
+                batch = list(itertools.islice(features, batch_size))
+                if not batch:
+                    break
+                if mapping is not None:
+                    batch = _remap_features(batch, mapping)
+                if not _put_unless_stopped(batch_queue, batch, stop_event):
+                    return
+    except Exception as e:
+        _put_unless_stopped(batch_queue, e, stop_event)
+        return
+    _put_unless_stopped(batch_queue, _END_OF_FILE, stop_event)
+
+
+def _merge_with_fiona(headers, schema, output_shp, encoding, workers, batch_size):
+    """
+    多线程并行读取输入文件，主线程按输入顺序批量写出。
+    每个输入文件有自己的有界队列，读取线程最多领先写出_PREFETCH_BATCHES个批次。
+    """
+    import fiona
+
+    first = headers[0]
+    feature_count = 0
+    stop_event = threading.Event()
+    with fiona.open(output_shp, 'w', driver=first['driver'], crs=first['crs'],
+                    schema=schema, encoding=encoding) as sink, \
+            ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        try:
+            queues = []
+            for header in headers:
+                batch_queue = queue.Queue(maxsize=_PREFETCH_BATCHES)
+                mapping = _make_property_mapping(header['schema'], schema)
+                executor.submit(_read_batches, header['path'], encoding, batch_size, mapping, batch_queue, stop_event)
+                queues.append(batch_queue)
+
+            # 线程池按提交顺序调度，正在写出的文件的读取线程一定已经开始，不会死锁
+            for batch_queue in queues:
+                while True:
+                    batch = batch_queue.get()
+                    if batch is _END_OF_FILE:
+                        break
+                    if isinstance(batch, Exception):
+                        raise batch
+                    sink.writerecords(batch)
+                    feature_count += len(batch)
+        finally:
+            # 出错时通知所有读取线程退出
+            stop_event.set()
+    return feature_count
+
+
+def _merge_with_ogr(headers, schema, output_shp, encoding, batch_size):
+    """
+    使用GDAL的VectorTranslate逐个追加输入文件，要素复制全部在C层完成，不构造Python字典。
+    先按合并后的模式创建空的输出图层，追加时OGR按字段名对应，缺少的字段为空值，类型由OGR转换。
+    """
+    import fiona
+    from osgeo import gdal
+
+    first = headers[0]
+    layer_name = os.path.splitext(os.path.basename(output_shp))[0]
+    with fiona.open(output_shp, 'w', driver=first['driver'], crs=first['crs'],
+                    schema=schema, encoding=encoding):
+        pass
+
+    for header in headers:
+        source = gdal.OpenEx(header['path'], gdal.OF_VECTOR, open_options=[f'ENCODING={encoding}'])
+        if source is None:
+            raise FileNotFoundError(f"无法打开输入Shapefile: {header['path']}")
+        options = gdal.VectorTranslateOptions(
+            format=first['driver'],
+            accessMode='append',
+            layerName=layer_name,
+            groupTransactions=batch_size,
+        )
+        result = gdal.VectorTranslate(output_shp, source, options=options)
+        source = None
+        if result is None:
+            raise ValueError(f"追加Shapefile失败: {header['path']}")
+        result = None
+    return sum(header['count'] for header in headers)
+
+
+def _add_missing_fields(layer, schema):
+    """
+    把合并模式中已有输出没有的字段添加到输出图层（已有要素的这些字段为空值），返回添加的字段名。
+    """
+    from osgeo import ogr
+
+    layer_defn = layer.GetLayerDefn()
+    existing = {layer_defn.GetFieldDefn(i).GetName().lower() for i in range(layer_defn.GetFieldCount())}
+    added = []
+    for name, field_type in schema['properties'].items():
+        if name.lower() in existing:
+            continue
+        base, width, precision = _parse_field_type(field_type)
+        field = ogr.FieldDefn(name, getattr(ogr, _OGR_FIELD_TYPES.get(base, 'OFTString')))
+        if width is not None:
+            field.SetWidth(width)
+        if precision is not None:
+            field.SetPrecision(precision)
+        if layer.CreateField(field) != 0:
+            raise ValueError(f"无法向输出添加字段: {name}")
+        added.append(name)
+    return added
+
+
+def _upsert_with_ogr(headers, schema, output_shp, encoding, batch_size, key_field):
+    """
+    按键更新已有的输出（不存在时先按合并模式创建）：新键的要素追加，已有键且内容有变化的要素用SetFeature原位替换，
+    内容相同的跳过。已有键由输出文件旁的键索引判断（见feature_key_index），不扫描已有图层。
+    输入要素用SetFrom按字段名复制到输出的字段，类型由OGR转换。
+
+    Returns:
+        dict: 各类要素的数量，见FeatureKeyIndex.plan。
+    """
+    import fiona
+    from osgeo import gdal, ogr
+
+    first = headers[0]
+    if os.path.exists(output_shp):
+        existing = read_shapefile_header(output_shp, encoding)
+        if existing['crs'] != first['crs'] or existing['schema']['geometry'] != schema['geometry']:
+            raise ValueError(f"输入Shapefile的坐标系或几何类型与已有输出不一致: {output_shp}")
+    else:
+        with fiona.open(output_shp, 'w', driver=first['driver'], crs=first['crs'],
+                        schema=schema, encoding=encoding):
+            pass
+
+    sink = gdal.OpenEx(output_shp, gdal.OF_VECTOR | gdal.OF_UPDATE, open_options=[f'ENCODING={encoding}'])
+    if sink is None:
+        raise ValueError(f"无法以更新模式打开输出文件: {output_shp}")
+    counts = {}
+    try:
+        layer = sink.GetLayer(0)
+        # 在改动输出之前打开键索引，以便与保存索引时的输出状态比较
+        key_index = FeatureKeyIndex.load_or_build(output_shp, layer, key_field, _feature_values)
+        added_fields = _add_missing_fields(layer, schema)
+        if added_fields:
+            print(f"已向输出添加字段: {', '.join(added_fields)}")
+        layer_defn = layer.GetLayerDefn()
+        key_field_index = layer_defn.GetFieldIndex(key_field)
+        if key_field_index < 0:
+            raise ValueError(f"输出中没有键字段 {key_field}")
+
+        for header in headers:
+            source = gdal.OpenEx(header['path'], gdal.OF_VECTOR, open_options=[f'ENCODING={encoding}'])
+            if source is None:
+                raise FileNotFoundError(f"无法打开输入Shapefile: {header['path']}")
+            source_layer = source.GetLayer(0)
+            # 只创建一次迭代器：每次迭代图层都会从头重新读取
+            source_features = iter(source_layer)
+            while True:
+                batch = []
+                for source_feature in itertools.islice(source_features, batch_size):
+                    feature = ogr.Feature(layer_defn)
+                    feature.SetFrom(source_feature)
+                    batch.append(feature)
+                if not batch:
+                    break
+                key_hashes = hash_keys([feature.GetField(key_field_index) for feature in batch])
+                digests = np.fromiter((feature_digest(_feature_values(feature)) for feature in batch),
+                                      dtype=np.uint64, count=len(batch))
+                key_hashes, fids, write, batch_counts = key_index.plan(key_hashes, digests)
+                merge_upsert_counts(counts, batch_counts)
+
+                written_fids = []
+                layer.StartTransaction()
+                try:
+                    for i in np.flatnonzero(write).tolist():
+                        feature = batch[i]
+                        if fids[i] >= 0:
+                            feature.SetFID(int(fids[i]))
+                            layer.SetFeature(feature) # 原位替换已有要素
+                        else:
+                            layer.CreateFeature(feature)
+                        written_fids.append(feature.GetFID())
+                except Exception:
+                    layer.RollbackTransaction()
+                    raise
+                layer.CommitTransaction()
+                key_index.record(key_hashes[write], written_fids, digests[write])
+            source_features = source_layer = source = None
+
+        # Shapefile的.qix不会随追加和替换更新，已有时重建
+        if os.path.exists(os.path.splitext(output_shp)[0] + '.qix'):
+            sink.ExecuteSQL(f'CREATE SPATIAL INDEX ON "{layer.GetName()}"')
+    finally:
+        layer = layer_defn = sink = None
+
+    # 输出关闭、写入磁盘之后保存键索引
+    key_index.save(output_shp)
+    return counts
+
+
+def _feature_values(feature):
+    """
+    计算摘要的值：各字段值和几何的WKB。写入前由输入复制来的要素和从输出读回的要素都用它计算。
+    """
+    geometry = feature.GetGeometryRef()
+    return ([feature.GetField(i) for i in range(feature.GetFieldCount())]
+            + [None if geometry is None else bytes(geometry.ExportToWkb())])
+
+
+def _report_schema_differences(headers, schema):
+    """
+    输入字段不一致时打印一条汇总：多少个文件缺少字段、哪些字段的类型被提升。
+    """
+    partial = [header for header in headers if header['schema']['properties'] != schema['properties']]
+    if not partial:
+        return
+    lowered = [{name.lower(): field_type for name, field_type in header['schema']['properties'].items()}
+               for header in headers]
+    promoted = []
+    for name, field_type in schema['properties'].items():
+        source_types = {properties.get(name.lower()) for properties in lowered} - {None}
+        if source_types != {field_type}:
+            promoted.append(f"{name}->{field_type}")
+    print(f"警告: {len(partial)} 个输入Shapefile的字段与合并结果不同，缺少的字段将填为空值。"
+          + (f" 类型提升: {', '.join(promoted)}" if promoted else ''))
+
+
+def merge_shapefiles(input_shapefiles, output_shp, engine=MERGE_ENGINE_FIONA, workers=DEFAULT_MERGE_WORKERS,
+                     batch_size=DEFAULT_MERGE_BATCH_SIZE, encoding='utf-8', metrics=None, upsert_key=None):
+    """
+    合并多个Shapefile。写出任何要素之前先读取所有输入的头信息，检查坐标系并构造字段并集，
+    各输入缺少的字段填空值，同名字段类型不同时按promote_field_type提升。
+
+    参数:
+        input_shapefiles (list): 输入Shapefile路径列表，按此顺序合并。
+        output_shp (str): 输出Shapefile路径。
+        engine (str): 'fiona'为并行读取+批量写入；'ogr'为GDAL原生追加。
+        workers (int): 读取头信息和要素的并行线程数。
+        batch_size (int): 每批写入（或每个事务）的要素数量。
+        encoding (str): Shapefile的字符编码，默认为'utf-8'。
+        metrics (StageMetrics): 如果提供，整个合并记为merge阶段（读取字节数为各输入.shp和.dbf的大小之和）。
+        upsert_key (str): 按键更新已有输出的键字段（FILE_NAME或FILE_PATH）。为None时重新创建输出；
+                          否则新键的要素追加，已有键且内容有变化的要素原位替换，没有变化的跳过（总是使用OGR，忽略engine）。
+
+    返回:
+        int: 写出（追加或替换）的要素数量。
+    """
+    if engine not in MERGE_ENGINES:
+        raise ValueError(f"不支持的合并方式: {engine}")
+    if upsert_key is not None and upsert_key not in UPSERT_KEY_FIELDS:
+        raise ValueError(f"更新键只能是 {'、'.join(UPSERT_KEY_FIELDS)}: {upsert_key}")
+    bytes_read = sum(file_size(path) + file_size(find_dbf_path(path)) for path in input_shapefiles)
+    with measure(metrics, 'merge', bytes_read=bytes_read) as record:
+        headers, schema = check_merge_inputs(input_shapefiles, encoding, workers)
+        _report_schema_differences(headers, schema)
+
+        if upsert_key is not None:
+            counts = _upsert_with_ogr(headers, schema, output_shp, encoding, batch_size, upsert_key)
+            print(f"按 {upsert_key} 更新: {format_upsert_counts(counts)}")
+            record['rows'] = counts.get('added', 0) + counts.get('replaced', 0)
+        elif engine == MERGE_ENGINE_OGR:
+            record['rows'] = _merge_with_ogr(headers, schema, output_shp, encoding, batch_size)
+        else:
+            record['rows'] = _merge_with_fiona(headers, schema, output_shp, encoding, workers, batch_size)
+    return record['rows']
+
+
+# 当脚本作为主程序运行时
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge multiple Shapefiles into one.")
+    parser.add_argument('inputs', nargs='*',
+                        help='要合并的Shapefile路径，按给定顺序合并。')
+    parser.add_argument('--input_dir', type=str, default=None,
+                        help='包含要合并的Shapefile的目录（递归搜索，按路径排序）。与inputs同时给出时先合并目录中的文件。')
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='输出Shapefile路径。')
+    parser.add_argument('--engine', choices=MERGE_ENGINES, default=MERGE_ENGINE_FIONA,
+                        help='合并方式：fiona为并行读取+批量写入，ogr为GDAL原生追加（需要GDAL Python绑定）。默认为 fiona。')
+    parser.add_argument('--upsert_key', choices=UPSERT_KEY_FIELDS, default=None,
+                        help='按键更新已有的输出而不是重新创建：新键的要素追加，已有键且内容有变化的要素原位替换，没有变化的跳过。'
+                             '已有键记录在输出旁的键索引 <输出>.keyidx 中，不扫描已有输出（需要GDAL Python绑定）。')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MERGE_WORKERS,
+                        help=f'并行读取的线程数。默认为 {DEFAULT_MERGE_WORKERS}。')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_MERGE_BATCH_SIZE,
+                        help=f'每批写入的要素数量。默认为 {DEFAULT_MERGE_BATCH_SIZE}。')
+    parser.add_argument('--encoding', type=str, default='utf-8',
+                        help='Shapefile的字符编码。默认为 utf-8。')
+    parser.add_argument('--metrics_report', type=str, default=None,
+                        help='输出JSON运行报告的路径（耗时、要素数、读取字节数和峰值内存）。')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='用cProfile采样合并过程，打印耗时最多的函数并把原始数据保存到该路径。')
+    args = parser.parse_args()
+
+    input_shapefiles = []
+    if args.input_dir:
+        input_shapefiles.extend(find_shapefiles(args.input_dir, args.workers))
+    input_shapefiles.extend(args.inputs)
+    # 不要把输出文件本身当作输入
+    output_abspath = os.path.abspath(args.output)
+    input_shapefiles = [path for path in input_shapefiles if os.path.abspath(path) != output_abspath]
+    if not input_shapefiles:
+        parser.error('必须提供至少一个输入Shapefile或一个输入目录。')
+
+    metrics = StageMetrics('merge' if args.profile else None)
+    feature_count = merge_shapefiles(input_shapefiles, args.output, args.engine, args.workers,
+                                     args.batch_size, args.encoding, metrics, args.upsert_key)
+    print(f"已合并 {len(input_shapefiles)} 个Shapefile，共{'写出' if args.upsert_key else ''} {feature_count} 个要素，"
+          f"输出到 {args.output}")
+    metrics.print_summary()
+    if args.metrics_report:
+        metrics.write_report(args.metrics_report)
+    if args.profile:
+        metrics.write_profile(args.profile)
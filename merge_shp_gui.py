@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import fiona
 import os
 
+from merge_shp_data import find_shapefiles, merge_shapefiles
+
 class MergeShapefileApp:
     def __init__(self, master):
         self.master = master
@@ -77,10 +78,11 @@ class MergeShapefileApp:
         input_shapefiles = []
 
         if input_dir:
-            for root, _, files in os.walk(input_dir):
-                for file in files:
-                    if file.lower().endswith('.shp'):
-                        input_shapefiles.append(os.path.join(root, file))
+            input_shapefiles = find_shapefiles(input_dir)
+            # 输出文件位于输入目录中时，不要把它当作输入
+            if output_shp:
+                input_shapefiles = [path for path in input_shapefiles
+                                    if os.path.abspath(path) != os.path.abspath(output_shp)]
             if not input_shapefiles:
                 messagebox.showerror("错误", "在指定目录中未找到任何Shapefile文件。")
                 return
@@ -107,41 +109,8 @@ class MergeShapefileApp:
             messagebox.showerror("发生意外错误", f"发生意外错误: {e}")
 
     def merge_shapefiles(self, input_shapefiles, output_shp):
-        if not input_shapefiles:
-            raise ValueError("没有提供输入Shapefile文件。")
-
-        # 检查所有输入文件是否存在
-        for shp_file in input_shapefiles:
-            if not os.path.exists(shp_file):
-                raise FileNotFoundError(f"输入Shapefile未找到: {shp_file}")
-
-        # 打开第一个Shapefile以获取模式和CRS
-        with fiona.open(input_shapefiles[0], 'r', encoding='utf-8') as first_source:
-            schema = first_source.schema
-            crs = first_source.crs
-
-            # 创建输出Shapefile
-            with fiona.open(
-                output_shp,
-                'w',
-                driver=first_source.driver,
-                crs=crs,
-                schema=schema,
-                encoding='utf-8'
-            ) as sink:
-                # 写入第一个Shapefile的特征
-                for feature in first_source:
-                    sink.write(feature)
-
-                # 写入其余Shapefile的特征
-                for i in range(1, len(input_shapefiles)):
-                    with fiona.open(input_shapefiles[i], 'r', encoding='utf-8') as source:
-                        if source.schema != schema:
-                            raise ValueError(f"Shapefile模式不匹配: {input_shapefiles[i]}")
-                        if source.crs != crs:
-                            raise ValueError(f"Shapefile CRS不匹配: {input_shapefiles[i]}")
-                        for feature in source:
-                            sink.write(feature)
+        # 合并逻辑位于merge_shp_data.py：先统一检查所有输入的模式和CRS，再并行读取、批量写出
+        return merge_shapefiles(input_shapefiles, output_shp)
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -1,5 +1,3 @@
-# 导入fiona库，用于读写Shapefile
-import fiona
 # 导入datetime模块中的date类，用于处理日期
 from datetime import date
 # 导入os模块，用于文件路径操作
@@ -7,7 +5,10 @@ import os
 # 导入sys模块，用于访问系统相关参数和函数
 import sys
 
-def modify_shapefile(input_shp_path, output_shp_path, data_value, encoding='utf-8'):
+from pipeline_metrics import file_size
+from shp_dbf_update import find_dbf_path, read_dbf_header, set_shapefile_column
+
+def modify_shapefile(input_shp_path, output_shp_path, data_value, encoding='utf-8', metrics=None):
     """
     通过添加或更新'data'列，并将其值设置为指定值来修改Shapefile。
 
@@ -16,12 +17,33 @@ def modify_shapefile(input_shp_path, output_shp_path, data_value, encoding='utf-
         output_shp_path (str): 输出（修改后）Shapefile的路径。
         data_value (str): 要设置到'data'列的自定义值。
         encoding (str): Shapefile的字符编码，默认为'utf-8'。
+        metrics (StageMetrics): 如果提供，整个修改记为modify阶段（行数为.dbf中的记录数）。
     """
     # 检查输入Shapefile是否存在
     if not os.path.exists(input_shp_path):
         print(f"错误: 未找到输入Shapefile: {input_shp_path}")
         return
 
+    if metrics is not None:
+        input_dbf = find_dbf_path(input_shp_path)
+        rows = read_dbf_header(input_dbf)['record_count'] if os.path.exists(input_dbf) else 0
+        with metrics.stage('modify', rows, file_size(input_dbf)):
+            return modify_shapefile(input_shp_path, output_shp_path, data_value, encoding)
+
+    # 快速路径：只改写.dbf中的'data'列，.shp/.shx几何文件原样保留
+    try:
+        fast_value = date.fromisoformat(data_value)
+        new_column_type = 'date'
+    except ValueError:
+        fast_value = data_value
+        new_column_type = 'str'
+    if set_shapefile_column(input_shp_path, output_shp_path, 'data', fast_value, new_column_type, encoding):
+        print(f"Shapefile已成功修改并保存到 {output_shp_path}")
+        return
+
+    # 列类型不兼容或值超出已有列宽时，退回逐要素重写（只有这时才需要加载fiona/GDAL）
+    import fiona
+
     # 以只读模式打开源Shapefile
     with fiona.open(input_shp_path, 'r', encoding=encoding) as source:
         # 获取原始的schema（结构信息）
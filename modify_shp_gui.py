@@ -1,12 +1,13 @@
 # GUI application for modifying Shapefile data
 
-import fiona
 from datetime import date
 import os
 import sys
 import tkinter as tk
 from tkinter import filedialog, messagebox
 
+from shp_dbf_update import set_shapefile_column
+
 def modify_shapefile(input_shp_path, output_shp_path, data_value, encoding='utf-8'):
     """
     通过添加或更新'data'列，并将其值设置为指定值来修改Shapefile。
@@ -22,6 +23,19 @@ def modify_shapefile(input_shp_path, output_shp_path, data_value, encoding='utf-
         raise FileNotFoundError(f"未找到输入Shapefile: {input_shp_path}")
 
     warning_message = None
+    # 快速路径：只改写.dbf中的'data'列，.shp/.shx几何文件原样保留
+    try:
+        fast_value = date.fromisoformat(data_value)
+        new_column_type = 'date'
+    except ValueError:
+        fast_value = data_value
+        new_column_type = 'str'
+    if set_shapefile_column(input_shp_path, output_shp_path, 'data', fast_value, new_column_type, encoding):
+        return True, None
+
+    # 列类型不兼容或值超出已有列宽时，退回逐要素重写（只有这时才需要加载fiona/GDAL）
+    import fiona
+
     # 以只读模式打开源Shapefile
     with fiona.open(input_shp_path, 'r', encoding=encoding) as source:
         # 获取原始的schema（结构信息）
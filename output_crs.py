@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# 输出坐标系：把WGS84经纬度（L/B列）按整列批量投影到其他坐标系（如CGCS2000、高斯-克吕格投影），
+# 或直接使用HDI中的原生投影坐标X/Y（第9、10列）而不做任何转换。一次处理可以写出多个坐标系的版本。
+import os
+
+import numpy as np
+
+try:
+    import pyproj
+except ImportError: # 没有pyproj时用GDAL的osr批量转换
+    pyproj = None
+
+# HDI中B/L的坐标系
+WGS84_EPSG = 4326
+# 坐标系简称 -> EPSG代码
+OUTPUT_CRS_ALIASES = {'wgs84': WGS84_EPSG, 'cgcs2000': 4490}
+# 直接使用HDI原生投影坐标X/Y的坐标系名称，可写为 native 或 native:<EPSG>（为图层标注坐标系）
+NATIVE_CRS = 'native'
+DEFAULT_OUTPUT_CRS = 'EPSG:4326'
+# osr批量转换时每次转换的点数
+_OSR_TRANSFORM_BATCH = 100000
+
+# EPSG代码 -> 转换对象，每个进程只创建一次
+_transformers = {}
+
+
+def parse_output_crs(spec):
+    """
+    解析坐标系参数：EPSG:<代码>、<代码>、wgs84、cgcs2000、native、native:<代码>。
+
+    Returns:
+        dict: {'spec': 原始参数, 'epsg': EPSG代码（native未标注时为None）, 'native': 是否使用HDI原生X/Y,
+               'label': 用于输出文件名的标签}
+    """
+    text = str(spec).strip()
+    lowered = text.lower()
+    native = lowered == NATIVE_CRS or lowered.startswith(NATIVE_CRS + ':')
+    code = lowered.split(':', 1)[1] if native and ':' in lowered else (None if native else lowered)
+    epsg = None
+    if code is not None:
+        code = code[len('epsg:'):] if code.startswith('epsg:') else code
+        if code in OUTPUT_CRS_ALIASES:
+            epsg = OUTPUT_CRS_ALIASES[code]
+        elif code.isdigit():
+            epsg = int(code)
+        else:
+            raise ValueError(f"无法识别的坐标系: {spec}（应为 EPSG:<代码>、wgs84、cgcs2000 或 native[:<代码>]）")
+    label = NATIVE_CRS if native else f"epsg{epsg}"
+    return {'spec': text, 'epsg': epsg, 'native': native, 'label': label}
+
+
+def parse_output_crs_list(specs):
+    """
+    解析多个坐标系参数，第一个为主输出。标签重复时报错（输出文件名会冲突）。
+    """
+    crs_list = [parse_output_crs(spec) for spec in (specs or [DEFAULT_OUTPUT_CRS])]
+    labels = [crs['label'] for crs in crs_list]
+    if len(set(labels)) != len(labels):
+        raise ValueError(f"输出坐标系重复: {', '.join(crs['spec'] for crs in crs_list)}")
+    return crs_list
+
+
+def crs_output_path(output_file_path, crs, primary):
+    """
+    各坐标系版本的输出路径：主输出使用原路径，其余在文件名后加上坐标系标签，例如 merged_hdi_data_epsg4547.shp。
+    """
+    if primary:
+        return output_file_path
+    stem, extension = os.path.splitext(output_file_path)
+    return f"{stem}_{crs['label']}{extension}"
+
+
+def _osr_transformer(epsg):
+    from osgeo import osr
+
+    source = osr.SpatialReference()
+    source.ImportFromEPSG(WGS84_EPSG)
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(epsg)
+    # GDAL 3起EPSG:4326默认按纬度、经度排列，这里统一为经度、纬度（东向、北向）
+    for srs in (source, target):
+        if hasattr(srs, 'SetAxisMappingStrategy'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(source, target)
+
+    def transform_arrays(lon, lat):
+        x = np.empty(lon.size)
+        y = np.empty(lon.size)
+        for start in range(0, lon.size, _OSR_TRANSFORM_BATCH):
+            stop = min(start + _OSR_TRANSFORM_BATCH, lon.size)
+            points = np.array(transform.TransformPoints(np.column_stack([lon[start:stop], lat[start:stop]]).tolist()),
+                              dtype=np.float64).reshape(-1, 3)
+            x[start:stop] = points[:, 0]
+            y[start:stop] = points[:, 1]
+        return x, y
+    return transform_arrays
+
+
+def _get_transformer(epsg):
+    if epsg not in _transformers:
+        if pyproj is not None:
+            transformer = pyproj.Transformer.from_crs(WGS84_EPSG, epsg, always_xy=True)
+            _transformers[epsg] = transformer.transform
+        else:
+            _transformers[epsg] = _osr_transformer(epsg)
+    return _transformers[epsg]
+
+
+def project_lon_lat(lon, lat, epsg):
+    """
+    把WGS84经纬度数组整体投影到epsg坐标系，返回(x, y)。目标为WGS84时原样返回。
+    无法投影的点（例如NaN）结果为NaN或inf，由调用方决定如何处理。
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    if epsg == WGS84_EPSG or lon.size == 0:
+        return lon, lat
+    x, y = _get_transformer(epsg)(lon, lat)
+    return np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+
+def output_coordinates(crs, columns, track=None):
+    """
+    取某个坐标系版本的点坐标(x, y)。columns为处理后的列（顺序见HDI_CSV_HEADER，B、L的下标为3、4），
+    native版本取track中的HDI原生X/Y。
+    """
+    if crs['native']:
+        if track is None or 'X' not in track:
+            raise ValueError("native坐标系需要HDI原生X/Y列（只能在流式模式下使用）。")
+        return np.asarray(track['X'], dtype=np.float64), np.asarray(track['Y'], dtype=np.float64)
+    return project_lon_lat(columns[4], columns[3], crs['epsg'])
@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+# 全景点查询：在处理后的B/L/HEADING上建立规则网格索引，回答"离某坐标最近、朝向大致为某方向的全景照片"
+# 以及bbox范围查询。索引以.npy文件保存在一个目录中，启动时以内存映射方式打开，冷启动不需要读入全部数据。
+import argparse
+import csv
+import json
+import math
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+# 索引格式版本
+INDEX_VERSION = 1
+# 默认网格边长（米）。HDI点约每1.2秒一个，城市道路上每个格子通常有数个到十几个点。
+DEFAULT_CELL_SIZE_M = 50.0
+# 默认朝向容差（度）
+DEFAULT_HEADING_TOLERANCE = 45.0
+# bbox查询默认最多返回的结果数
+DEFAULT_BBOX_LIMIT = 1000
+# 本地HTTP服务默认端口
+DEFAULT_PORT = 8765
+
+_EARTH_RADIUS_M = 6371008.8
+_META_FILE_NAME = 'meta.json'
+_ARRAY_NAMES = ('x', 'y', 'lon', 'lat', 'heading', 'cell_keys', 'cell_starts',
+                'name_offsets', 'name_bytes', 'path_offsets', 'path_bytes')
+
+
+def _encode_strings(values):
+    """
+    把字符串列表编码为(偏移数组, UTF-8字节数组)，第i个字符串为bytes[offsets[i]:offsets[i+1]]。
+    """
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def heading_difference(headings, target):
+    """
+    朝向之间的夹角（0~180度），对0~360和-180~180两种表示都适用。
+    """
+    return np.abs((np.asarray(headings) - target + 180.0) % 360.0 - 180.0)
+
+
+class PanoramaIndex:
+    """
+    全景点的网格索引。
+
+    经纬度以数据范围的西南角为原点、按平均纬度做等距圆柱投影换算为米（城市范围内误差可以忽略），
+    点按所在网格排序存放，每个非空格子在cell_keys/cell_starts中记录其点的下标范围。
+    """
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        for name in _ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.cell_size = meta['cell_size']
+        self.grid_width = meta['grid_width']
+        self.grid_height = meta['grid_height']
+
+    def __len__(self):
+        return self.meta['count']
+
+    @classmethod
+    def build(cls, file_names, file_paths, b_values, l_values, heading_values, cell_size=DEFAULT_CELL_SIZE_M):
+        """
+        由列数据建立索引。
+
+        Args:
+            file_names (list): FILE_NAME列。
+            file_paths (list): FILE_PATH列。
+            b_values, l_values, heading_values: 纬度、经度、朝向列。
+            cell_size (float): 网格边长（米）。
+        """
+        lat = np.asarray(b_values, dtype=np.float64)
+        lon = np.asarray(l_values, dtype=np.float64)
+        heading = np.asarray(heading_values, dtype=np.float64)
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        if not valid.all():
+            print(f"警告: {int(valid.size - np.count_nonzero(valid))} 个点的坐标无效，未加入索引。")
+
+        count = int(np.count_nonzero(valid))
+        if count == 0:
+            raise ValueError("没有可建立索引的点。")
+        lat0 = float(np.mean(lat[valid]))
+        meta = {
+            'version': INDEX_VERSION,
+            'count': count,
+            'cell_size': float(cell_size),
+            'lon0': float(lon[valid].min()),
+            'lat0': float(lat[valid].min()),
+            'meters_per_degree_lon': _EARTH_RADIUS_M * math.radians(1) * math.cos(math.radians(lat0)),
+            'meters_per_degree_lat': _EARTH_RADIUS_M * math.radians(1),
+        }
+        x = (lon[valid] - meta['lon0']) * meta['meters_per_degree_lon']
+        y = (lat[valid] - meta['lat0']) * meta['meters_per_degree_lat']
+        cell_x = (x // cell_size).astype(np.int64)
+        cell_y = (y // cell_size).astype(np.int64)
+        meta['grid_width'] = int(cell_x.max()) + 1
+        meta['grid_height'] = int(cell_y.max()) + 1
+
+        keys = cell_x * meta['grid_height'] + cell_y
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        cell_keys, cell_first = np.unique(keys, return_index=True)
+        cell_starts = np.append(cell_first, count).astype(np.int64)
+
+        positions = np.flatnonzero(valid)[order]
+        name_offsets, name_bytes = _encode_strings([file_names[i] for i in positions])
+        path_offsets, path_bytes = _encode_strings([file_paths[i] for i in positions])
+        arrays = {
+            'x': x[order], 'y': y[order],
+            'lon': lon[positions], 'lat': lat[positions], 'heading': heading[positions],
+            'cell_keys': cell_keys, 'cell_starts': cell_starts,
+            'name_offsets': name_offsets, 'name_bytes': name_bytes,
+            'path_offsets': path_offsets, 'path_bytes': path_bytes,
+        }
+        return cls(meta, arrays)
+
+    def save(self, index_dir):
+        """
+        把索引保存到目录中（每个数组一个.npy文件，元数据为meta.json）。
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        for name in _ARRAY_NAMES:
+            np.save(os.path.join(index_dir, f'{name}.npy'), np.asarray(getattr(self, name)))
+        with open(os.path.join(index_dir, _META_FILE_NAME), 'w', encoding='utf-8') as outfile:
+            json.dump(self.meta, outfile)
+
+    @classmethod
+    def load(cls, index_dir):
+        """
+        以内存映射方式打开保存的索引，只有查询实际访问到的页才会从磁盘读入。
+        """
+        meta_path = os.path.join(index_dir, _META_FILE_NAME)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"未找到全景点索引: {index_dir}")
+        with open(meta_path, 'r', encoding='utf-8') as infile:
+            meta = json.load(infile)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"全景点索引版本不兼容，请重新建立: {index_dir}")
+        arrays = {name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r') for name in _ARRAY_NAMES}
+        return cls(meta, arrays)
+
+    def _project(self, lon, lat):
+        return ((lon - self.meta['lon0']) * self.meta['meters_per_degree_lon'],
+                (lat - self.meta['lat0']) * self.meta['meters_per_degree_lat'])
+
+    def _points_in_cells(self, cell_x, cell_y):
+        """
+        返回给定格子（可以超出网格范围）中所有点的下标。
+        """
+        inside = (cell_x >= 0) & (cell_x < self.grid_width) & (cell_y >= 0) & (cell_y < self.grid_height)
+        keys = cell_x[inside] * self.grid_height + cell_y[inside]
+        positions = np.searchsorted(self.cell_keys, keys)
+        in_range = positions < self.cell_keys.size
+        positions, keys = positions[in_range], keys[in_range]
+        positions = positions[self.cell_keys[positions] == keys]
+        return self._expand_ranges(self.cell_starts[positions], self.cell_starts[positions + 1])
+
+    @staticmethod
+    def _expand_ranges(starts, stops):
+        if starts.size == 0:
+            return np.empty(0, dtype=np.int64)
+        lengths = stops - starts
+        # 把若干[start, stop)区间展开为连续的下标数组
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return np.arange(int(lengths.sum()), dtype=np.int64) + offsets
+
+    def _ring_cells(self, center_x, center_y, ring):
+        """
+        以(center_x, center_y)为中心、切比雪夫距离恰为ring的一圈格子。
+        """
+        if ring == 0:
+            return np.array([center_x]), np.array([center_y])
+        span = np.arange(-ring, ring + 1)
+        inner = np.arange(-ring + 1, ring)
+        cell_x = np.concatenate([center_x + span, center_x + span,
+                                 np.full(inner.size, center_x - ring), np.full(inner.size, center_x + ring)])
+        cell_y = np.concatenate([np.full(span.size, center_y - ring), np.full(span.size, center_y + ring),
+                                 center_y + inner, center_y + inner])
+        return cell_x, cell_y
+
+    def nearest(self, lon, lat, k=1, heading=None, heading_tolerance=DEFAULT_HEADING_TOLERANCE,
+                max_distance=None):
+        """
+        查询离(lon, lat)最近的k个全景点，可按朝向过滤。
+
+        从查询点所在格子开始逐圈向外搜索，当已找到k个点且第k近的距离不超过已搜索范围的内切半径时停止。
+
+        Args:
+            lon, lat (float): 查询点经纬度。
+            k (int): 返回的点数。
+            heading (float): 期望朝向（度），为None时不过滤。
+            heading_tolerance (float): 朝向容差（度）。
+            max_distance (float): 最大搜索距离（米），为None时不限制。
+
+        Returns:
+            list: 按距离从近到远排列的结果，见_result。
+        """
+        query_x, query_y = self._project(lon, lat)
+        center_x = int(query_x // self.cell_size)
+        center_y = int(query_y // self.cell_size)
+        # 查询点在网格外时，需要多搜索几圈才能覆盖到整个网格
+        last_ring = max(center_x, self.grid_width - 1 - center_x, center_y, self.grid_height - 1 - center_y, 0)
+
+        found = np.empty(0, dtype=np.int64)
+        found_distance = np.empty(0, dtype=np.float64)
+        for ring in range(last_ring + 1):
+            if max_distance is not None and (ring - 1) * self.cell_size > max_distance:
+                break
+            candidates = self._points_in_cells(*self._ring_cells(center_x, center_y, ring))
+            if candidates.size:
+                if heading is not None:
+                    candidates = candidates[heading_difference(self.heading[candidates], heading) <= heading_tolerance]
+                distance = np.hypot(self.x[candidates] - query_x, self.y[candidates] - query_y)
+                found = np.concatenate([found, candidates])
+                found_distance = np.concatenate([found_distance, distance])
+                if found.size > k:
+                    keep = np.argpartition(found_distance, k - 1)[:k]
+                    found, found_distance = found[keep], found_distance[keep]
+            # 下一圈及更外的格子离查询点至少ring个格子边长
+            if found.size >= k and found_distance.max() <= ring * self.cell_size:
+                break
+
+        if max_distance is not None:
+            within = found_distance <= max_distance
+            found, found_distance = found[within], found_distance[within]
+        order = np.argsort(found_distance, kind='stable')
+        return [self._result(found[i], found_distance[i]) for i in order]
+
+    def bbox(self, min_lon, min_lat, max_lon, max_lat, heading=None, heading_tolerance=DEFAULT_HEADING_TOLERANCE,
+             limit=DEFAULT_BBOX_LIMIT):
+        """
+        查询经纬度范围内的全景点，可按朝向过滤，最多返回limit个。
+        """
+        min_x, min_y = self._project(min_lon, min_lat)
+        max_x, max_y = self._project(max_lon, max_lat)
+        first_x = max(int(min_x // self.cell_size), 0)
+        last_x = min(int(max_x // self.cell_size), self.grid_width - 1)
+        first_y = max(int(min_y // self.cell_size), 0)
+        last_y = min(int(max_y // self.cell_size), self.grid_height - 1)
+        if first_x > last_x or first_y > last_y:
+            return []
+
+        cell_count = (last_x - first_x + 1) * (last_y - first_y + 1)
+        if cell_count <= self.cell_keys.size:
+            cell_x, cell_y = np.meshgrid(np.arange(first_x, last_x + 1), np.arange(first_y, last_y + 1))
+            candidates = self._points_in_cells(cell_x.ravel(), cell_y.ravel())
+        else:
+            # 范围很大时，直接筛选非空格子比枚举范围内的所有格子更快
+            keys = np.asarray(self.cell_keys)
+            cell_x, cell_y = keys // self.grid_height, keys % self.grid_height
+            selected = np.flatnonzero((cell_x >= first_x) & (cell_x <= last_x)
+                                      & (cell_y >= first_y) & (cell_y <= last_y))
+            candidates = self._expand_ranges(self.cell_starts[selected], self.cell_starts[selected + 1])
+
+        lon, lat = self.lon[candidates], self.lat[candidates]
+        keep = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+        if heading is not None:
+            keep &= heading_difference(self.heading[candidates], heading) <= heading_tolerance
+        candidates = candidates[keep][:limit]
+        return [self._result(i) for i in candidates]
+
+    def _result(self, point, distance=None):
+        point = int(point)
+        result = {
+            'FILE_NAME': bytes(self.name_bytes[self.name_offsets[point]:self.name_offsets[point + 1]]).decode('utf-8'),
+            'FILE_PATH': bytes(self.path_bytes[self.path_offsets[point]:self.path_offsets[point + 1]]).decode('utf-8'),
+            'B': float(self.lat[point]),
+            'L': float(self.lon[point]),
+            'HEADING': float(self.heading[point]),
+        }
+        if distance is not None:
+            result['DISTANCE_M'] = round(float(distance), 3)
+        return result
+
+
+def read_points_csv(csv_file_path, encoding='gbk'):
+    """
+    从合并CSV（HDI_CSV_HEADER格式）中读取建立索引所需的列。
+
+    Returns:
+        tuple: (file_names, file_paths, b_values, l_values, heading_values)
+    """
+    with open(csv_file_path, 'r', encoding=encoding, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"CSV文件为空: {csv_file_path}")
+        try:
+            name_index, path_index, b_index, l_index, heading_index = [
+                header.index(column) for column in ('FILE_NAME', 'FILE_PATH', 'B', 'L', 'HEADING')]
+        except ValueError:
+            raise ValueError(f"CSV缺少FILE_NAME/FILE_PATH/B/L/HEADING列: {csv_file_path}")
+        file_names, file_paths, b_values, l_values, heading_values = [], [], [], [], []
+        for row in reader:
+            file_names.append(row[name_index])
+            file_paths.append(row[path_index])
+            b_values.append(row[b_index])
+            l_values.append(row[l_index])
+            heading_values.append(row[heading_index])
+    return (file_names, file_paths, np.array(b_values, dtype=np.float64), np.array(l_values, dtype=np.float64),
+            np.array(heading_values, dtype=np.float64))
+
+
+def read_points_from_hdi(input_dir, base_path_for_photos, workers=1):
+    """
+    直接处理目录中的HDI文件并取出建立索引所需的列（不经过CSV/Shapefile）。
+    """
+    from hdi_to_csv_processor import iter_processed_hdi_files
+
+    file_names, file_paths, b_parts, l_parts, heading_parts = [], [], [], [], []
+    for _, columns, _ in iter_processed_hdi_files(input_dir, base_path_for_photos, workers):
+        file_names.extend(columns[0])
+        file_paths.extend(columns[1])
+        b_parts.append(np.asarray(columns[3], dtype=np.float64))
+        l_parts.append(np.asarray(columns[4], dtype=np.float64))
+        heading_parts.append(np.asarray(columns[6], dtype=np.float64))
+    if not b_parts:
+        raise ValueError(f"目录中没有可处理的HDI文件: {input_dir}")
+    return file_names, file_paths, np.concatenate(b_parts), np.concatenate(l_parts), np.concatenate(heading_parts)
+
+
+def _query_float(params, name, default=None):
+    values = params.get(name)
+    if not values or values[0] == '':
+        if default is None:
+            raise ValueError(f"缺少参数: {name}")
+        return default
+    return float(values[0])
+
+
+def make_request_handler(index):
+    """
+    生成本地HTTP查询服务的请求处理类：
+        GET /nearest?lon=&lat=[&k=1][&heading=][&heading_tolerance=45][&max_distance=]
+        GET /bbox?min_lon=&min_lat=&max_lon=&max_lat=[&heading=][&heading_tolerance=45][&limit=1000]
+    返回UTF-8编码的JSON：{"results": [...], "elapsed_ms": ...}。
+    """
+    class PanoramaRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            start = time.perf_counter()
+            try:
+                heading = params.get('heading', [''])[0]
+                heading = float(heading) if heading != '' else None
+                heading_tolerance = _query_float(params, 'heading_tolerance', DEFAULT_HEADING_TOLERANCE)
+                if url.path == '/nearest':
+                    max_distance = params.get('max_distance', [''])[0]
+                    results = index.nearest(_query_float(params, 'lon'), _query_float(params, 'lat'),
+                                            int(_query_float(params, 'k', 1)), heading, heading_tolerance,
+                                            float(max_distance) if max_distance != '' else None)
+                elif url.path == '/bbox':
+                    results = index.bbox(_query_float(params, 'min_lon'), _query_float(params, 'min_lat'),
+                                         _query_float(params, 'max_lon'), _query_float(params, 'max_lat'),
+                                         heading, heading_tolerance,
+                                         int(_query_float(params, 'limit', DEFAULT_BBOX_LIMIT)))
+                else:
+                    self._send_json(404, {'error': f"未知的路径: {url.path}"})
+                    return
+            except ValueError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._send_json(200, {'results': results, 'elapsed_ms': round(elapsed_ms, 3)})
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 不在控制台逐条打印请求日志
+            pass
+
+    return PanoramaRequestHandler
+
+
+def serve(index, host='127.0.0.1', port=DEFAULT_PORT):
+    """
+    启动本地HTTP查询服务，直到按Ctrl+C结束。
+    """
+    server = ThreadingHTTPServer((host, port), make_request_handler(index))
+    print(f"全景点查询服务已启动: http://{host}:{port}/nearest?lon=...&lat=...  （共 {len(index)} 个点）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# 当脚本作为主程序运行时
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query a nearest-panorama index.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='建立索引。')
+    build_parser.add_argument('--csv', type=str, default=None,
+                              help='由hdi_to_csv_processor.py生成的合并CSV。')
+    build_parser.add_argument('--csv_encoding', type=str, default='gbk',
+                              help='合并CSV的编码。默认为 gbk。')
+    build_parser.add_argument('--input_dir', type=str, default=None,
+                              help='直接处理该目录中的HDI文件建立索引（与--csv二选一）。')
+    build_parser.add_argument('--base_path', type=str, default=r'E:\Code',
+                              help='与--input_dir一起使用：计算照片相对路径的基准路径。默认为 E:\\Code。')
+    build_parser.add_argument('--workers', type=int, default=1,
+                              help='与--input_dir一起使用：并行解析HDI文件的进程数。默认为1。')
+    build_parser.add_argument('--cell_size', type=float, default=DEFAULT_CELL_SIZE_M,
+                              help=f'网格边长（米）。默认为 {DEFAULT_CELL_SIZE_M}。')
+    build_parser.add_argument('-o', '--index_dir', type=str, required=True,
+                              help='索引输出目录。')
+
+    query_parser = subparsers.add_parser('query', help='查询最近的全景点。')
+    query_parser.add_argument('--index_dir', type=str, required=True, help='索引目录。')
+    query_parser.add_argument('--lon', type=float, required=True, help='经度。')
+    query_parser.add_argument('--lat', type=float, required=True, help='纬度。')
+    query_parser.add_argument('-k', type=int, default=1, help='返回的点数。默认为1。')
+    query_parser.add_argument('--heading', type=float, default=None, help='期望朝向（度）。')
+    query_parser.add_argument('--heading_tolerance', type=float, default=DEFAULT_HEADING_TOLERANCE,
+                              help=f'朝向容差（度）。默认为 {DEFAULT_HEADING_TOLERANCE}。')
+    query_parser.add_argument('--max_distance', type=float, default=None, help='最大搜索距离（米）。')
+
+    serve_parser = subparsers.add_parser('serve', help='启动本地HTTP查询服务。')
+    serve_parser.add_argument('--index_dir', type=str, required=True, help='索引目录。')
+    serve_parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址。默认为 127.0.0.1。')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'监听端口。默认为 {DEFAULT_PORT}。')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if bool(args.csv) == bool(args.input_dir):
+            build_parser.error('必须且只能提供 --csv 或 --input_dir 之一。')
+        if args.csv:
+            points = read_points_csv(args.csv, args.csv_encoding)
+        else:
+            points = read_points_from_hdi(args.input_dir, args.base_path, args.workers)
+        index = PanoramaIndex.build(*points, cell_size=args.cell_size)
+        index.save(args.index_dir)
+        print(f"全景点索引已建立: {args.index_dir}（{len(index)} 个点，"
+              f"{index.cell_keys.size} 个非空网格，网格边长 {index.cell_size} 米）")
+    elif args.command == 'query':
+        index = PanoramaIndex.load(args.index_dir)
+        for result in index.nearest(args.lon, args.lat, args.k, args.heading, args.heading_tolerance,
+                                    args.max_distance):
+            print(json.dumps(result, ensure_ascii=False))
+    else:
+        serve(PanoramaIndex.load(args.index_dir), args.host, args.port)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# 照片与HDI位姿的时间戳匹配：对CCD照片名中的毫秒时间戳建立有序索引，
+# 每个HDI行用二分查找找到时间上最近的照片，超出容差的行不配对。
+import re
+
+import numpy as np
+
+from hdi_reader import digit_strings_to_epoch_ms
+
+# 照片名中的时间戳：YYYYMMDDhhmmssfff，与HDI行ID末尾的17位数字格式相同
+_PHOTO_TIMESTAMP_PATTERN = re.compile(r'\d{17}')
+
+# 默认匹配容差（毫秒）。相邻帧约1.2秒，容差取其一半以内，避免配到相邻帧。
+DEFAULT_MATCH_TOLERANCE_MS = 500
+
+# 配对模式
+PHOTO_MATCH_AUTO = 'auto'            # 照片名含时间戳时按时间戳匹配，否则按顺序配对
+PHOTO_MATCH_TIMESTAMP = 'timestamp'
+PHOTO_MATCH_INDEX = 'index'          # 原有方式：第n张照片对应第n行
+PHOTO_MATCH_MODES = (PHOTO_MATCH_AUTO, PHOTO_MATCH_TIMESTAMP, PHOTO_MATCH_INDEX)
+
+# 匹配报告的列
+MATCH_REPORT_HEADER = ['HDI_FILE', 'MODE', 'ROWS', 'PHOTOS', 'MATCHED', 'UNMATCHED_ROWS',
+                       'UNUSED_PHOTOS', 'MAX_OFFSET_MS', 'MEAN_OFFSET_MS']
+
+
+def parse_photo_timestamps(photo_names):
+    """
+    从照片名称中解析毫秒时间戳（取名称中最后一段17位数字）。
+
+    Args:
+        photo_names (list): 照片文件名列表。
+
+    Returns:
+        numpy.ndarray: int64时间戳数组，名称中没有合法时间戳的为-1。
+    """
+    timestamps = np.full(len(photo_names), -1, dtype=np.int64)
+    positions = []
+    digit_strings = []
+    for i, name in enumerate(photo_names):
+        found = _PHOTO_TIMESTAMP_PATTERN.findall(name)
+        if found:
+            positions.append(i)
+            digit_strings.append(found[-1])
+    if digit_strings:
+        digits = np.frombuffer(''.join(digit_strings).encode('ascii'), dtype=np.uint8)
+        digits = digits.reshape(-1, 17).astype(np.int16) - ord('0')
+        timestamps[positions] = digit_strings_to_epoch_ms(digits)
+    return timestamps
+
+
+def build_photo_index(photo_names):
+    """
+    为照片建立按时间戳排序的索引，忽略没有时间戳的照片。
+
+    Returns:
+        tuple: (排序后的时间戳数组, 对应的照片在photo_names中的下标数组)
+    """
+    timestamps = parse_photo_timestamps(photo_names)
+    with_timestamp = np.flatnonzero(timestamps >= 0)
+    order = with_timestamp[np.argsort(timestamps[with_timestamp], kind='stable')]
+    return timestamps[order], order
+
+
+def match_timestamps(row_timestamps, sorted_photo_timestamps, tolerance_ms=DEFAULT_MATCH_TOLERANCE_MS):
+    """
+    为每个HDI行在有序照片时间戳中二分查找最近的照片，总复杂度O((n+m) log m)。
+    偏差超过容差的行不配对；同一张照片被多行选中时，只保留偏差最小的那一行。
+
+    Args:
+        row_timestamps (numpy.ndarray): HDI行的毫秒时间戳，-1表示无效。
+        sorted_photo_timestamps (numpy.ndarray): 升序排列的照片毫秒时间戳。
+        tolerance_ms (int): 允许的最大时间偏差（毫秒）。
+
+    Returns:
+        tuple: (每行配对到的照片在有序索引中的下标，未配对为-1; 每行与配对照片的时间偏差，未配对为-1)
+    """
+    row_timestamps = np.asarray(row_timestamps, dtype=np.int64)
+    row_count = row_timestamps.size
+    matches = np.full(row_count, -1, dtype=np.int64)
+    offsets = np.full(row_count, -1, dtype=np.int64)
+    photo_count = sorted_photo_timestamps.size
+    if row_count == 0 or photo_count == 0:
+        return matches, offsets
+
+    right = np.searchsorted(sorted_photo_timestamps, row_timestamps)
+    left = np.clip(right - 1, 0, photo_count - 1)
+    right = np.clip(right, 0, photo_count - 1)
+    left_offset = np.abs(row_timestamps - sorted_photo_timestamps[left])
+    right_offset = np.abs(sorted_photo_timestamps[right] - row_timestamps)
+    nearest = np.where(right_offset < left_offset, right, left)
+    nearest_offset = np.minimum(left_offset, right_offset)
+
+    candidates = np.flatnonzero((nearest_offset <= tolerance_ms) & (row_timestamps >= 0))
+    # 按(照片, 偏差)排序后，每张照片只取第一行
+    candidates = candidates[np.lexsort((nearest_offset[candidates], nearest[candidates]))]
+    candidate_photos = nearest[candidates]
+    first = np.ones(candidates.size, dtype=bool)
+    first[1:] = candidate_photos[1:] != candidate_photos[:-1]
+    winners = candidates[first]
+
+    matches[winners] = nearest[winners]
+    offsets[winners] = nearest_offset[winners]
+    return matches, offsets
+
+
+def make_match_report(hdi_file_path, mode, row_count, photo_count, offsets):
+    """
+    生成单个HDI文件（文件夹）的匹配统计，字段见MATCH_REPORT_HEADER。
+    """
+    matched = offsets >= 0
+    matched_count = int(np.count_nonzero(matched))
+    matched_offsets = offsets[matched]
+    # 按顺序配对时没有时间偏差可言
+    has_offsets = matched_count and mode == PHOTO_MATCH_TIMESTAMP
+    return {
+        'HDI_FILE': hdi_file_path,
+        'MODE': mode,
+        'ROWS': row_count,
+        'PHOTOS': photo_count,
+        'MATCHED': matched_count,
+        'UNMATCHED_ROWS': row_count - matched_count,
+        'UNUSED_PHOTOS': photo_count - matched_count,
+        'MAX_OFFSET_MS': int(matched_offsets.max()) if has_offsets else '',
+        'MEAN_OFFSET_MS': round(float(matched_offsets.mean()), 1) if has_offsets else '',
+    }
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# 全景照片元数据与缩略图：在照片配对之后读取已配对照片的JPEG头（图像尺寸）和EXIF（拍摄时间），
+# 并在CCD同级的CCD_THUMB文件夹中生成缩小的缩略图，供浏览工具预览而不必打开原始全景照片。
+# 读取和缩放在进程池中按批进行；每个缩略图文件夹中保存一个元数据索引，照片大小和修改时间未变、
+# 缩略图已是最新时不再读取或重新生成。
+import json
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from run_log import warn
+
+# 照片元数据字段（字段名, OGR字段类型），追加在HDI_CSV_HEADER之后
+PHOTO_METADATA_FIELDS = [('IMG_WIDTH', 'OFTInteger'), ('IMG_HEIGHT', 'OFTInteger'),
+                         ('CAPTURE_TM', 'OFTString'), ('THUMB_PATH', 'OFTString')]
+PHOTO_METADATA_HEADER = [field_name for field_name, _ in PHOTO_METADATA_FIELDS]
+# 缩略图文件夹名（与CCD文件夹同级）和其中的元数据索引文件名
+THUMB_DIR_NAME = 'CCD_THUMB'
+METADATA_INDEX_FILE_NAME = '.photo_metadata.json'
+# 缩略图最长边（像素），0表示只读取元数据、不生成缩略图（不需要Pillow）
+DEFAULT_THUMB_SIZE = 512
+DEFAULT_THUMB_QUALITY = 80
+# 每个任务包含的照片数量
+PHOTO_BATCH_SIZE = 64
+# 元数据索引格式版本
+METADATA_INDEX_VERSION = 1
+
+# 带尺寸信息的JPEG帧起始标记（SOF0~SOF15，不含DHT、JPG、DAC）
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# 没有长度字段的独立标记
+_STANDALONE_MARKERS = frozenset(range(0xD0, 0xD8)) | {0x01, 0xD8}
+_EXIF_IFD_POINTER = 0x8769
+_EXIF_DATETIME = 0x0132
+_EXIF_DATETIME_ORIGINAL = 0x9003
+_EXIF_SUBSEC_TIME_ORIGINAL = 0x9291
+
+
+def pillow_available():
+    try:
+        import PIL.Image # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _read_ifd(tiff, offset, byte_order):
+    """
+    读取一个IFD中的ASCII和LONG类型标签，返回{标签: 值}。
+    """
+    entries = {}
+    if offset + 2 > len(tiff):
+        return entries
+    count, = struct.unpack_from(byte_order + 'H', tiff, offset)
+    for i in range(count):
+        entry_offset = offset + 2 + i * 12
+        if entry_offset + 12 > len(tiff):
+            break
+        tag, value_type, value_count = struct.unpack_from(byte_order + 'HHI', tiff, entry_offset)
+        if value_type == 2: # ASCII，超过4字节时值为偏移
+            start = entry_offset + 8 if value_count <= 4 else struct.unpack_from(
+                byte_order + 'I', tiff, entry_offset + 8)[0]
+            entries[tag] = tiff[start:start + value_count].split(b'\0', 1)[0].decode('ascii', 'replace').strip()
+        elif value_type == 4: # LONG
+            entries[tag], = struct.unpack_from(byte_order + 'I', tiff, entry_offset + 8)
+    return entries
+
+
+def parse_exif_capture_time(tiff):
+    """
+    从EXIF的TIFF数据中取拍摄时间（DateTimeOriginal，没有时取DateTime），
+    格式化为 YYYY-MM-DD hh:mm:ss[.fff]，与轨迹线的时间格式一致；没有时返回空字符串。
+    """
+    if tiff[:2] not in (b'II', b'MM'):
+        return ''
+    byte_order = '<' if tiff[:2] == b'II' else '>'
+    try:
+        ifd0 = _read_ifd(tiff, struct.unpack_from(byte_order + 'I', tiff, 4)[0], byte_order)
+        exif = _read_ifd(tiff, ifd0[_EXIF_IFD_POINTER], byte_order) if _EXIF_IFD_POINTER in ifd0 else {}
+    except struct.error:
+        return ''
+    text = exif.get(_EXIF_DATETIME_ORIGINAL) or ifd0.get(_EXIF_DATETIME) or ''
+    if len(text) < 19 or text.startswith('0000'):
+        return ''
+    # EXIF时间为 YYYY:MM:DD hh:mm:ss
+    text = f"{text[0:4]}-{text[5:7]}-{text[8:10]} {text[11:19]}"
+    subsec = exif.get(_EXIF_SUBSEC_TIME_ORIGINAL, '') if _EXIF_DATETIME_ORIGINAL in exif else ''
+    if subsec.isdigit():
+        text += '.' + subsec[:3].ljust(3, '0')
+    return text
+
+
+def read_jpeg_info(photo_path):
+    """
+    只读取JPEG文件头部的标记段，返回(宽, 高, 拍摄时间)，不解码图像数据。
+    不是JPEG或读不到尺寸时宽高为None。
+    """
+    width = height = None
+    capture_time = ''
+    with open(photo_path, 'rb') as infile:
+        if infile.read(2) != b'\xff\xd8':
+            return None, None, ''
+        while True:
+            prefix = infile.read(1)
+            if prefix != b'\xff':
+                break
+            marker = infile.read(1)
+            while marker == b'\xff': # 填充字节
+                marker = infile.read(1)
+            if not marker:
+                break
+            code = marker[0]
+            if code in _STANDALONE_MARKERS:
+                continue
+            if code in (0xD9, 0xDA): # 图像结束或扫描数据开始，之后不再有头部信息
+                break
+            length_bytes = infile.read(2)
+            if len(length_bytes) < 2:
+                break
+            length = struct.unpack('>H', length_bytes)[0] - 2
+            if code == 0xE1 and not capture_time:
+                segment = infile.read(length)
+                if segment.startswith(b'Exif\0\0'):
+                    capture_time = parse_exif_capture_time(segment[6:])
+            elif code in _SOF_MARKERS:
+                frame = infile.read(5)
+                if len(frame) == 5:
+                    _, height, width = struct.unpack('>BHH', frame)
+                break
+            else:
+                infile.seek(length, os.SEEK_CUR)
+    return width, height, capture_time
+
+
+def make_thumbnail(photo_path, thumb_path, thumb_size=DEFAULT_THUMB_SIZE, quality=DEFAULT_THUMB_QUALITY):
+    """
+    生成最长边不超过thumb_size的JPEG缩略图。draft让解码器在DCT阶段直接按1/2~1/8缩小，
+    不必解码完整的全景照片。先写临时文件再替换，中断时不会留下不完整的缩略图。
+    """
+    from PIL import Image
+
+    with Image.open(photo_path) as image:
+        image.draft('RGB', (thumb_size, thumb_size))
+        image = image.convert('RGB')
+        image.thumbnail((thumb_size, thumb_size))
+        temp_path = thumb_path + '.tmp'
+        image.save(temp_path, 'JPEG', quality=quality)
+    os.replace(temp_path, thumb_path)
+
+
+def thumbnail_is_current(photo_path, thumb_path):
+    """
+    缩略图存在且不早于照片时视为最新。
+    """
+    try:
+        return os.path.getmtime(thumb_path) >= os.path.getmtime(photo_path)
+    except OSError:
+        return False
+
+
+def process_photo_batch(ccd_dir, thumb_dir, names, known, thumb_size=DEFAULT_THUMB_SIZE,
+                        quality=DEFAULT_THUMB_QUALITY):
+    """
+    处理同一CCD文件夹中的一批照片（在子进程中运行）。
+
+    Args:
+        ccd_dir (str): CCD文件夹路径。
+        thumb_dir (str): 缩略图文件夹路径。
+        names (list): 照片名称。
+        known (dict): 元数据索引中已有的条目，名称 -> [大小, 修改时间(ns), 宽, 高, 拍摄时间]。
+        thumb_size (int): 缩略图最长边，0表示不生成缩略图。
+        quality (int): 缩略图JPEG质量。
+
+    Returns:
+        tuple: (名称 -> 新的索引条目, [(名称, 错误信息)], 生成的缩略图数量)
+    """
+    entries = {}
+    errors = []
+    thumbnails_made = 0
+    for name in names:
+        photo_path = os.path.join(ccd_dir, name)
+        try:
+            stat = os.stat(photo_path)
+            entry = known.get(name)
+            if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+                entry = [stat.st_size, stat.st_mtime_ns, *read_jpeg_info(photo_path)]
+            if entry[2] is None:
+                raise ValueError("不是有效的JPEG文件")
+            if thumb_size:
+                thumb_path = os.path.join(thumb_dir, name)
+                if not thumbnail_is_current(photo_path, thumb_path):
+                    make_thumbnail(photo_path, thumb_path, thumb_size, quality)
+                    thumbnails_made += 1
+        except Exception as e:
+            errors.append((name, str(e)))
+            continue
+        entries[name] = entry
+    return entries, errors, thumbnails_made
+
+
+class PhotoMetadataExtractor:
+    """
+    照片元数据和缩略图阶段。对每个HDI文件已配对的照片（去重后）按批提交给进程池，
+    返回与行一一对应的附加列，顺序见PHOTO_METADATA_HEADER。
+
+    每个缩略图文件夹中的索引记录各照片的大小、修改时间、尺寸和拍摄时间，
+    未变化的照片不再读取；缩略图不早于照片时不重新生成。缩略图最长边变化时全部重新生成。
+    """
+
+    def __init__(self, workers=1, thumb_size=DEFAULT_THUMB_SIZE, quality=DEFAULT_THUMB_QUALITY,
+                 batch_size=PHOTO_BATCH_SIZE):
+        if thumb_size and not pillow_available():
+            raise ValueError("生成缩略图需要安装Pillow（pip install Pillow）；只读取元数据时可将缩略图尺寸设为0。")
+        self.workers = workers
+        self.thumb_size = thumb_size
+        self.quality = quality
+        self.batch_size = max(int(batch_size), 1)
+        self.executor = None
+        self.photos_checked = 0
+        self.thumbnails_made = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def _load_index(self, index_path):
+        """
+        读取元数据索引，返回(照片条目, 现有缩略图的最长边)。
+        """
+        try:
+            with open(index_path, encoding='utf-8') as infile:
+                index = json.load(infile)
+        except (OSError, ValueError):
+            return {}, 0
+        if index.get('version') != METADATA_INDEX_VERSION:
+            return {}, 0
+        photos = index.get('photos', {})
+        thumb_size = index.get('thumb_size', 0)
+        if self.thumb_size and thumb_size != self.thumb_size:
+            # 缩略图尺寸变化：删除旧缩略图，元数据仍可沿用
+            thumb_dir = os.path.dirname(index_path)
+            for name in photos:
+                thumb_path = os.path.join(thumb_dir, name)
+                if os.path.exists(thumb_path):
+                    os.remove(thumb_path)
+        return photos, thumb_size
+
+    def _save_index(self, index_path, photos, thumb_size):
+        temp_path = index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as outfile:
+            json.dump({'version': METADATA_INDEX_VERSION, 'thumb_size': thumb_size, 'photos': photos},
+                      outfile, ensure_ascii=False)
+        os.replace(temp_path, index_path)
+
+    def _run_batches(self, ccd_dir, thumb_dir, names, known):
+        batches = [names[start:start + self.batch_size] for start in range(0, len(names), self.batch_size)]
+        batch_args = [(ccd_dir, thumb_dir, batch, {name: known[name] for name in batch if name in known},
+                       self.thumb_size, self.quality) for batch in batches]
+        if self.workers <= 1 or len(batches) <= 1:
+            return [process_photo_batch(*args) for args in batch_args]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return [future.result() for future in
+                [self.executor.submit(process_photo_batch, *args) for args in batch_args]]
+
+    def columns(self, hdi_file_path, photo_names, photo_paths, warning_log=None):
+        """
+        为一个HDI文件的各行返回附加列[IMG_WIDTH, IMG_HEIGHT, CAPTURE_TM, THUMB_PATH]。
+        没有配对照片或照片无法读取的行，宽高为None，拍摄时间和缩略图路径为空字符串。
+
+        Args:
+            hdi_file_path (str): HDI文件的完整路径，照片位于其同级的CCD文件夹。
+            photo_names (list): 每行配对的照片名称（FILE_NAME列）。
+            photo_paths (list): 每行照片的相对路径（FILE_PATH列），缩略图路径按同样的方式相对于基准路径。
+            warning_log (WarningLog): 如果提供，无法读取的照片记入其中，否则直接打印。
+        """
+        hdi_dir = os.path.dirname(hdi_file_path)
+        ccd_dir = os.path.join(hdi_dir, 'CCD')
+        thumb_dir = os.path.join(hdi_dir, THUMB_DIR_NAME)
+        names = sorted({name for name in photo_names if name})
+        if not names:
+            return [[None] * len(photo_names), [None] * len(photo_names), [''] * len(photo_names),
+                    [''] * len(photo_names)]
+
+        os.makedirs(thumb_dir, exist_ok=True)
+        index_path = os.path.join(thumb_dir, METADATA_INDEX_FILE_NAME)
+        photos, thumb_size = self._load_index(index_path)
+        errors = []
+        for entries, batch_errors, thumbnails_made in self._run_batches(ccd_dir, thumb_dir, names, photos):
+            photos.update(entries)
+            errors.extend(batch_errors)
+            self.thumbnails_made += thumbnails_made
+        self.photos_checked += len(names)
+        for name, _ in errors:
+            photos.pop(name, None)
+        # 只读取元数据时保留已有缩略图的尺寸，之后生成同样尺寸的缩略图时不必全部重新生成
+        self._save_index(index_path, photos, self.thumb_size or thumb_size)
+        if errors:
+            warn(warning_log, 'photo_metadata',
+                 f"文件夹 {ccd_dir} 中有 {len(errors)} 张照片无法读取（{errors[0][0]}: {errors[0][1]}）。",
+                 count=len(errors), directory=ccd_dir, photos=[name for name, _ in errors[:5]])
+
+        # 缩略图的相对路径：照片相对路径中的CCD文件夹换为缩略图文件夹
+        widths, heights, capture_times, thumb_paths = [], [], [], []
+        for name, path in zip(photo_names, photo_paths):
+            entry = photos.get(name) if name else None
+            if entry is None:
+                widths.append(None)
+                heights.append(None)
+                capture_times.append('')
+                thumb_paths.append('')
+                continue
+            widths.append(entry[2])
+            heights.append(entry[3])
+            capture_times.append(entry[4])
+            thumb_paths.append(os.path.join(os.path.dirname(os.path.dirname(path)), THUMB_DIR_NAME, name)
+                               if self.thumb_size else '')
+        return [widths, heights, capture_times, thumb_paths]
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# 分阶段性能统计：记录扫描、解析、照片匹配、CSV写出、OGR写出、合并、修改等阶段的耗时、行数、
+# 读取字节数和峰值内存，汇总为JSON运行报告和日志摘要；可选地对其中一个阶段用cProfile采样。
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # Windows没有resource模块，峰值内存记为None
+    resource = None
+
+# 已知的阶段，报告和摘要按此顺序排列（其他阶段排在后面）
+PIPELINE_STAGES = ('scan', 'parse', 'match', 'photo_meta', 'csv_write', 'ogr_write', 'merge', 'modify')
+# 运行报告格式版本
+METRICS_REPORT_VERSION = 1
+# 打印cProfile结果时列出的函数数量
+_PROFILE_TOP_FUNCTIONS = 25
+
+
+def peak_rss_mb():
+    """
+    当前进程（含已结束的子进程）的峰值常驻内存（MB），不支持时返回None。
+    """
+    if resource is None:
+        return None
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux上ru_maxrss的单位为KB，macOS上为字节
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(max(self_peak, children_peak) / scale, 1)
+
+
+class StageMetrics:
+    """
+    各阶段的累计统计。同一阶段可以多次计时（例如每个HDI文件一次），结果累加。
+
+    stages以阶段名为键，值为{'seconds', 'calls', 'rows', 'bytes_read', 'peak_rss_mb'}，可直接pickle，
+    子进程中统计的结果由主进程用merge合并。
+    """
+
+    def __init__(self, profile_stage=None):
+        self.stages = {}
+        self.profile_stage = profile_stage
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self._profiled = False
+        self._started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=0, bytes_read=0):
+        """
+        对with块计时。块内可以修改返回的字典中的'rows'和'bytes_read'。
+        """
+        record = {'rows': rows, 'bytes_read': bytes_read}
+        profiling = self.profiler is not None and name == self.profile_stage
+        if profiling:
+            self._profiled = True
+            self.profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            if profiling:
+                self.profiler.disable()
+            self.add(name, seconds, record['rows'], record['bytes_read'])
+
+    def add(self, name, seconds, rows=0, bytes_read=0, calls=1, peak_mb=None):
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0, 'bytes_read': 0,
+                                              'peak_rss_mb': None})
+        entry['seconds'] += seconds
+        entry['calls'] += calls
+        entry['rows'] += rows
+        entry['bytes_read'] += bytes_read
+        peaks = [value for value in (entry['peak_rss_mb'], peak_mb if peak_mb is not None else peak_rss_mb())
+                 if value is not None]
+        entry['peak_rss_mb'] = max(peaks) if peaks else None
+
+    def merge(self, stages):
+        """
+        合并另一个StageMetrics的stages（通常来自子进程）。
+        """
+        for name, entry in stages.items():
+            self.add(name, entry['seconds'], entry['rows'], entry['bytes_read'], entry['calls'],
+                     entry['peak_rss_mb'])
+
+    def _ordered_names(self):
+        known = [name for name in PIPELINE_STAGES if name in self.stages]
+        return known + sorted(name for name in self.stages if name not in PIPELINE_STAGES)
+
+    def report(self):
+        """
+        返回运行报告字典。
+        """
+        stages = []
+        for name in self._ordered_names():
+            entry = self.stages[name]
+            seconds = entry['seconds']
+            stages.append({
+                'stage': name,
+                'seconds': round(seconds, 4),
+                'calls': entry['calls'],
+                'rows': entry['rows'],
+                'rows_per_second': round(entry['rows'] / seconds, 1) if seconds > 0 else None,
+                'bytes_read': entry['bytes_read'],
+                'mb_per_second': round(entry['bytes_read'] / 1e6 / seconds, 2) if seconds > 0 else None,
+                'peak_rss_mb': entry['peak_rss_mb'],
+            })
+        return {
+            'version': METRICS_REPORT_VERSION,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'total_seconds': round(time.perf_counter() - self._started, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'profile_stage': self.profile_stage,
+            'stages': stages,
+        }
+
+    def summary_lines(self):
+        """
+        各阶段一行的文字摘要，用于命令行和GUI日志。
+        """
+        lines = []
+        for stage in self.report()['stages']:
+            line = f"  {stage['stage']}: {stage['seconds']:.2f} 秒"
+            if stage['rows']:
+                line += f", {stage['rows']} 行"
+                if stage['rows_per_second']:
+                    line += f" ({stage['rows_per_second']:,.0f} 行/秒)"
+            if stage['bytes_read']:
+                line += f", 读取 {stage['bytes_read'] / 1e6:.1f} MB"
+            if stage['peak_rss_mb'] is not None:
+                line += f", 峰值内存 {stage['peak_rss_mb']:.0f} MB"
+            lines.append(line)
+        return lines
+
+    def print_summary(self):
+        if not self.stages:
+            return
+        print("各阶段耗时:")
+        for line in self.summary_lines():
+            print(line)
+
+    def write_report(self, report_file_path):
+        with open(report_file_path, 'w', encoding='utf-8') as outfile:
+            json.dump(self.report(), outfile, ensure_ascii=False, indent=2)
+        print(f"运行报告已写入 {report_file_path}")
+
+    def write_profile(self, profile_file_path=None):
+        """
+        打印cProfile采样中累计耗时最多的函数；给出profile_file_path时同时保存原始数据（可用snakeviz等查看）。
+        """
+        if self.profiler is None:
+            return
+        if not self._profiled:
+            print(f"警告: 阶段 {self.profile_stage} 没有在主进程中运行（并行解析时parse/match在子进程中），"
+                  f"没有采样结果。")
+            return
+        if profile_file_path:
+            self.profiler.dump_stats(profile_file_path)
+            print(f"阶段 {self.profile_stage} 的cProfile数据已写入 {profile_file_path}")
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(_PROFILE_TOP_FUNCTIONS)
+        print(stream.getvalue())
+
+
+def measure(metrics, name, rows=0, bytes_read=0):
+    """
+    metrics不为None时返回metrics.stage(...)，否则返回不计时的空上下文（块内同样可以修改rows/bytes_read）。
+    """
+    if metrics is None:
+        return contextlib.nullcontext({'rows': rows, 'bytes_read': bytes_read})
+    return metrics.stage(name, rows, bytes_read)
+
+
+def file_size(file_path):
+    """
+    文件大小（字节），文件不存在时返回0。
+    """
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
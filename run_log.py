@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# 结构化、限流的警告日志：警告按类别计数，每个类别只打印前几条作为示例，其余只累加计数，
+# 处理结束时打印汇总，并可写出JSON错误报告。并行时子进程只记录不打印，由主进程合并后统一限流。
+import json
+
+# 每个类别最多打印（并在报告中保留）的示例条数
+DEFAULT_SAMPLE_LIMIT = 5
+# 警告类别 -> (汇总时的名称, 计数单位)
+WARNING_CATEGORIES = {
+    'short_rows': ('列数不足而跳过的HDI行', '行'),
+    'missing_ccd': ('缺少CCD文件夹的HDI文件', '个'),
+    'photo_shortage': ('行数多于照片数的HDI文件', '个'),
+    'photo_unmatched': ('存在未配对行或照片的HDI文件', '个'),
+    'photo_path': ('无法计算照片相对路径的文件夹', '个'),
+    'photo_metadata': ('无法读取元数据或生成缩略图的照片', '张'),
+}
+# 错误报告格式版本
+ERROR_REPORT_VERSION = 1
+
+
+class WarningLog:
+    """
+    按类别统计的警告。categories以类别为键，值为{'count': 计数, 'events': 警告次数, 'samples': [示例]}，
+    每个示例为{'message': 文本, ...附加字段}。count通常等于events，列数不足的行等按行计数的类别为总行数。
+    """
+
+    def __init__(self, sample_limit=DEFAULT_SAMPLE_LIMIT, echo=True):
+        self.sample_limit = sample_limit
+        self.echo = echo
+        self.categories = {}
+
+    def warn(self, category, message, count=1, **detail):
+        """
+        记录一条警告。该类别的前sample_limit条立即打印，之后只计数。
+        """
+        self._record(category, dict(detail, message=message), count, 1)
+
+    def _record(self, category, sample, count, events):
+        entry = self.categories.setdefault(category, {'count': 0, 'events': 0, 'samples': []})
+        entry['count'] += count
+        entry['events'] += events
+        if sample is None:
+            return
+        if len(entry['samples']) < self.sample_limit:
+            entry['samples'].append(sample)
+            if self.echo:
+                print(f"警告: {sample['message']}")
+                if len(entry['samples']) == self.sample_limit:
+                    print(f"警告: 此类警告（{_category_name(category)}）已显示 {self.sample_limit} 条，"
+                          f"其余只计数，处理结束时汇总。")
+
+    def merge(self, categories):
+        """
+        合并另一个WarningLog的categories（通常来自子进程），示例按本日志的限额打印。
+        """
+        for category, entry in categories.items():
+            samples = entry['samples']
+            # 计数随第一条示例一起记入，其余示例只占用打印限额
+            for i, sample in enumerate(samples):
+                self._record(category, sample, entry['count'] if i == 0 else 0, entry['events'] if i == 0 else 0)
+            if not samples:
+                self._record(category, None, entry['count'], entry['events'])
+
+    def summary_lines(self):
+        lines = []
+        for category, entry in self.categories.items():
+            name, unit = WARNING_CATEGORIES.get(category, (category, '次'))
+            line = f"  {name}: {entry['count']:,} {unit}"
+            if entry['count'] != entry['events']:
+                line += f"（{entry['events']:,} 条警告）"
+            if entry['events'] > len(entry['samples']):
+                line += f"，显示了前 {len(entry['samples'])} 条"
+            lines.append(line)
+        return lines
+
+    def print_summary(self):
+        if not self.categories:
+            return
+        print("警告汇总:")
+        for line in self.summary_lines():
+            print(line)
+
+    def report(self):
+        return {
+            'version': ERROR_REPORT_VERSION,
+            'sample_limit': self.sample_limit,
+            'categories': {category: {'name': _category_name(category), **entry}
+                           for category, entry in self.categories.items()},
+        }
+
+    def write_report(self, report_file_path):
+        with open(report_file_path, 'w', encoding='utf-8') as outfile:
+            json.dump(self.report(), outfile, ensure_ascii=False, indent=2)
+        print(f"错误报告已写入 {report_file_path}")
+
+
+def _category_name(category):
+    return WARNING_CATEGORIES.get(category, (category, ''))[0]
+
+
+def warn(warning_log, category, message, count=1, **detail):
+    """
+    warning_log为None时直接打印（原有行为），否则记入warning_log。
+    """
+    if warning_log is None:
+        print(f"警告: {message}")
+    else:
+        warning_log.warn(category, message, count, **detail)
@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+# 直接在.dbf上设置整列属性值：几何文件（.shp/.shx）原样保留，不再逐要素重写整个Shapefile。
+# 列已存在且宽度足够时通过内存映射原地写入；需要新增列时只重写.dbf。
+import datetime
+import mmap
+import os
+import shutil
+import struct
+
+import numpy as np
+
+# dBase文件头和字段描述符的长度
+_DBF_HEADER_BYTES = 32
+_DBF_FIELD_BYTES = 32
+_DBF_HEADER_TERMINATOR = b'\r'
+_DBF_EOF = b'\x1a'
+# dBase限制
+_DBF_MAX_FIELD_NAME = 10
+_DBF_MAX_FIELDS = 255
+_DBF_MAX_RECORD_BYTES = 65535
+_DBF_MAX_CHAR_WIDTH = 254
+# 新增字符串列的默认宽度，与fiona/OGR中'str'类型的默认宽度一致
+DEFAULT_STR_WIDTH = 80
+
+# 新增列时每次处理的记录数
+_APPEND_CHUNK_RECORDS = 100000
+
+# 与.shp同名、在原样复制时一并带上的附属文件（空间索引等只依赖几何，仍然有效）
+_SIDECAR_EXTENSIONS = ('.shp', '.shx', '.prj', '.cpg', '.sbn', '.sbx', '.qix', '.shp.xml')
+
+
+def read_dbf_header(dbf_path):
+    """
+    读取.dbf的文件头和字段描述符。
+
+    Returns:
+        dict: record_count、header_length、record_length，以及fields列表，
+            每个字段为dict(name, type, offset, length, decimals)，offset为在记录中的字节偏移（含删除标记位）。
+    """
+    with open(dbf_path, 'rb') as infile:
+        header = infile.read(_DBF_HEADER_BYTES)
+        if len(header) < _DBF_HEADER_BYTES:
+            raise ValueError(f"无效的DBF文件: {dbf_path}")
+        record_count, header_length, record_length = struct.unpack('<IHH', header[4:12])
+        descriptors = infile.read(header_length - _DBF_HEADER_BYTES)
+
+    fields = []
+    offset = 1  # 每条记录以1字节删除标记开头
+    for start in range(0, len(descriptors) - _DBF_FIELD_BYTES + 1, _DBF_FIELD_BYTES):
+        descriptor = descriptors[start:start + _DBF_FIELD_BYTES]
+        if descriptor[:1] == _DBF_HEADER_TERMINATOR:
+            break
+        name = descriptor[:11].split(b'\0', 1)[0].decode('ascii', errors='replace')
+        length, decimals = descriptor[16], descriptor[17]
+        fields.append({'name': name, 'type': chr(descriptor[11]), 'offset': offset,
+                       'length': length, 'decimals': decimals})
+        offset += length
+    return {'record_count': record_count, 'header_length': header_length,
+            'record_length': record_length, 'fields': fields}
+
+
+def _touch_header_date(header):
+    """
+    把文件头中的最后修改日期（YYMMDD，年份从1900起算）更新为今天。
+    """
+    today = datetime.date.today()
+    header[1:4] = bytes((today.year - 1900, today.month, today.day))
+
+
+def _encode_value(value, field_type, width, encoding):
+    """
+    把值编码为dBase字段的定长字节：日期为YYYYMMDD，字符串左对齐、右侧补空格。
+    编码后超过字段宽度时返回None。
+    """
+    if field_type == 'D':
+        raw = value.strftime('%Y%m%d').encode('ascii')
+    else:
+        raw = str(value).encode(encoding)
+    if len(raw) > width:
+        return None
+    return raw.ljust(width, b' ')
+
+
+def _copy_sidecar_files(input_shp_path, output_shp_path):
+    """
+    按原样复制.shp/.shx等附属文件（不含.dbf）到输出路径。
+    """
+    input_stem = os.path.splitext(input_shp_path)[0]
+    output_stem = os.path.splitext(output_shp_path)[0]
+    for extension in _SIDECAR_EXTENSIONS:
+        for candidate in (extension, extension.upper()):
+            source = input_stem + candidate
+            if os.path.exists(source):
+                shutil.copyfile(source, output_stem + extension)
+                break
+
+
+def find_dbf_path(shp_path):
+    """
+    Shapefile对应的.dbf路径，兼容ArcGIS等导出的大写扩展名（.DBF）；都不存在时返回小写扩展名的路径。
+    """
+    stem = os.path.splitext(shp_path)[0]
+    for extension in ('.dbf', '.DBF'):
+        if os.path.exists(stem + extension):
+            return stem + extension
+    return stem + '.dbf'
+
+
+def fill_dbf_column(dbf_path, field, value_bytes, record_count, header_length, record_length):
+    """
+    通过内存映射原地把一个已有字段的所有记录设为同一个定长值。
+    """
+    if record_count == 0:
+        return
+    with open(dbf_path, 'r+b') as dbf_file, mmap.mmap(dbf_file.fileno(), 0) as mapped:
+        records = np.ndarray((record_count, record_length), dtype=np.uint8, buffer=mapped,
+                             offset=header_length)
+        records[:, field['offset']:field['offset'] + field['length']] = np.frombuffer(value_bytes, dtype=np.uint8)
+        del records
+        header = bytearray(mapped[:_DBF_HEADER_BYTES])
+        _touch_header_date(header)
+        mapped[:_DBF_HEADER_BYTES] = bytes(header)
+
+
+def append_dbf_column(input_dbf_path, output_dbf_path, field_name, field_type, value_bytes, header_info):
+    """
+    在.dbf末尾追加一个字段，所有记录取同一个定长值。按块复制原记录并拼接新字段，
+    只写.dbf，不涉及几何文件。output_dbf_path可以与input_dbf_path相同（先写临时文件再替换）。
+    """
+    record_count = header_info['record_count']
+    header_length = header_info['header_length']
+    record_length = header_info['record_length']
+    field_count = len(header_info['fields'])
+    width = len(value_bytes)
+
+    descriptor = bytearray(_DBF_FIELD_BYTES)
+    descriptor[:len(field_name)] = field_name.encode('ascii')
+    descriptor[11] = ord(field_type)
+    descriptor[16] = width
+
+    temp_path = output_dbf_path + '.tmp'
+    with open(input_dbf_path, 'rb') as infile, open(temp_path, 'wb') as outfile:
+        header = bytearray(infile.read(header_length))
+        descriptors_end = _DBF_HEADER_BYTES + field_count * _DBF_FIELD_BYTES
+        # 字段描述符结束符之后可能还有扩展字节（如VFP的backlink），原样保留
+        extra = header[descriptors_end + 1:]
+        new_header = header[:descriptors_end] + descriptor + _DBF_HEADER_TERMINATOR + extra
+        struct.pack_into('<IHH', new_header, 4, record_count, len(new_header), record_length + width)
+        _touch_header_date(new_header)
+        outfile.write(new_header)
+
+        value = np.frombuffer(value_bytes, dtype=np.uint8)
+        remaining = record_count
+        while remaining:
+            chunk_records = min(remaining, _APPEND_CHUNK_RECORDS)
+            chunk = np.frombuffer(infile.read(chunk_records * record_length), dtype=np.uint8)
+            if chunk.size != chunk_records * record_length:
+                raise ValueError(f"DBF文件记录不完整: {input_dbf_path}")
+            chunk = chunk.reshape(chunk_records, record_length)
+            outfile.write(np.hstack([chunk, np.broadcast_to(value, (chunk_records, width))]).tobytes())
+            remaining -= chunk_records
+        outfile.write(_DBF_EOF)
+    os.replace(temp_path, output_dbf_path)
+
+
+def set_shapefile_column(input_shp_path, output_shp_path, column_name, value, new_column_type, encoding='utf-8'):
+    """
+    把Shapefile某一列的所有值设为value，只改动.dbf。
+
+    列（不区分大小写）已存在且类型兼容、宽度足够时原地写入（输出路径不同时先复制.dbf再写）；
+    列不存在时在.dbf末尾新增该列。输出路径与输入不同时，几何等附属文件按原样复制。
+
+    Args:
+        input_shp_path (str): 输入Shapefile路径。
+        output_shp_path (str): 输出Shapefile路径，可以与输入相同。
+        column_name (str): 列名。
+        value (str | datetime.date): 要设置的值。
+        new_column_type (str): 需要新增列时的fiona类型，'date'或'str'。
+        encoding (str): 字符串值的编码。
+
+    Returns:
+        bool: 成功时返回True；列类型不兼容、值超出已有列宽或超出dBase限制时返回False，
+            此时没有修改任何文件，调用方应改用逐要素重写。
+    """
+    input_dbf = find_dbf_path(input_shp_path)
+    if not os.path.exists(input_dbf):
+        return False
+    header_info = read_dbf_header(input_dbf)
+    expected_bytes = header_info['header_length'] + header_info['record_count'] * header_info['record_length']
+    if os.path.getsize(input_dbf) < expected_bytes:
+        return False
+
+    field = next((field for field in header_info['fields'] if field['name'].lower() == column_name.lower()), None)
+    is_date = isinstance(value, datetime.date)
+    if field is not None:
+        # 日期值只能写入日期列，字符串只能写入字符列；其他组合交给fiona转换
+        if field['type'] != ('D' if is_date else 'C'):
+            return False
+        value_bytes = _encode_value(value, field['type'], field['length'], encoding)
+        if value_bytes is None:
+            return False
+    else:
+        if new_column_type == 'date' and is_date:
+            field_type, width = 'D', 8
+        elif new_column_type == 'str' and not is_date:
+            field_type = 'C'
+            width = max(DEFAULT_STR_WIDTH, len(str(value).encode(encoding)))
+        else:
+            return False
+        if (len(column_name) > _DBF_MAX_FIELD_NAME or not column_name.isascii()
+                or width > _DBF_MAX_CHAR_WIDTH
+                or len(header_info['fields']) >= _DBF_MAX_FIELDS
+                or header_info['record_length'] + width > _DBF_MAX_RECORD_BYTES):
+            return False
+        value_bytes = _encode_value(value, field_type, width, encoding)
+
+    same_file = os.path.abspath(input_shp_path) == os.path.abspath(output_shp_path)
+    output_dbf = os.path.splitext(output_shp_path)[0] + '.dbf'
+    if not same_file:
+        _copy_sidecar_files(input_shp_path, output_shp_path)
+
+    if field is not None:
+        if not same_file:
+            shutil.copyfile(input_dbf, output_dbf)
+        fill_dbf_column(output_dbf, field, value_bytes, header_info['record_count'],
+                        header_info['header_length'], header_info['record_length'])
+    else:
+        append_dbf_column(input_dbf, output_dbf if not same_file else input_dbf, column_name,
+                          field_type, value_bytes, header_info)
+    return True
+
+
+# 新增列时各类型的默认字段：fiona类型 -> (dBase类型, 最小宽度, 小数位数)，与fiona/OGR的默认值一致
+_NEW_FIELD_SPECS = {'str': ('C', DEFAULT_STR_WIDTH, 0), 'date': ('D', 8, 0), 'int': ('N', 10, 0),
+                    'float': ('N', 24, 15)}
+# 重写.dbf时每次处理的记录数
+_REWRITE_CHUNK_RECORDS = 100000
+
+
+def _decode_dbf_value(raw, field_type, encoding):
+    """
+    把dBase字段的定长字节解码为Python值，空白值返回None。
+    """
+    text = raw.decode(encoding, errors='replace').strip()
+    if field_type in 'CM':
+        return text
+    if not text or text.startswith('*'):
+        return None
+    if field_type in 'NF':
+        try:
+            return float(text) if '.' in text or 'e' in text.lower() else int(text)
+        except ValueError:
+            return None
+    if field_type == 'D':
+        try:
+            return datetime.date(int(text[:4]), int(text[4:6]), int(text[6:8]))
+        except ValueError:
+            return None
+    if field_type == 'L':
+        return True if text in 'TtYy' else False if text in 'FfNn' else None
+    return text
+
+
+def read_dbf_columns(dbf_path, header_info, column_names, encoding='utf-8'):
+    """
+    读取.dbf中若干列的全部值（按Python值解码，见_decode_dbf_value），列名不区分大小写。
+
+    Returns:
+        dict: 列名（与column_names中的写法一致） -> 值列表。不存在的列不出现在结果中。
+    """
+    fields = {field['name'].lower(): field for field in header_info['fields']}
+    wanted = [(name, fields[name.lower()]) for name in column_names if name.lower() in fields]
+    record_count = header_info['record_count']
+    if not wanted or record_count == 0:
+        return {name: [] for name, _ in wanted}
+    result = {}
+    with open(dbf_path, 'rb') as dbf_file, mmap.mmap(dbf_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        records = np.ndarray((record_count, header_info['record_length']), dtype=np.uint8, buffer=mapped,
+                             offset=header_info['header_length'])
+        for name, field in wanted:
+            raw = np.ascontiguousarray(records[:, field['offset']:field['offset'] + field['length']])
+            # 按定长字节串取出（末尾的\0会被去掉，空格在解码时去掉）
+            values = raw.view(f"S{field['length']}").ravel().tolist()
+            result[name] = [_decode_dbf_value(value, field['type'], encoding) for value in values]
+        del records
+    return result
+
+
+def _format_dbf_value(value, field_type, decimals, encoding):
+    """
+    把Python值格式化为dBase字段的字节（未补齐宽度），None为空字节串。类型不兼容时抛出ValueError。
+    """
+    if value is None:
+        return b''
+    if field_type == 'D':
+        if isinstance(value, str):
+            value = datetime.date.fromisoformat(value.strip())
+        if not isinstance(value, datetime.date):
+            raise ValueError(f"{value!r} 不是日期")
+        return value.strftime('%Y%m%d').encode('ascii')
+    if field_type in 'NF':
+        if isinstance(value, str):
+            value = value.strip()
+            if not value:
+                return b''
+        if decimals:
+            return f"{float(value):.{decimals}f}".encode('ascii')
+        number = int(value) if isinstance(value, int) or (isinstance(value, str) and value.lstrip('-').isdigit()) \
+            else int(round(float(value)))
+        return str(number).encode('ascii')
+    if field_type == 'L':
+        return b'T' if value else b'F'
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+    return str(value).encode(encoding)
+
+
+def _infer_column_type(values):
+    """
+    按第一个非None的值推断新增列的类型。
+    """
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, datetime.date):
+            return 'date'
+        if isinstance(value, bool):
+            return 'str'
+        if isinstance(value, int):
+            return 'int'
+        if isinstance(value, float):
+            return 'float'
+        return 'str'
+    return 'str'
+
+
+def _encode_column(column_name, values, field_type, width, decimals, encoding):
+    """
+    把一列值编码为(n, width)的字节矩阵。字符型左对齐，数值型右对齐，均以空格补齐。
+    width为None时取所需的最大宽度。
+
+    Returns:
+        tuple: (字节矩阵, 实际宽度)
+    """
+    formatted = []
+    for i, value in enumerate(values):
+        try:
+            formatted.append(_format_dbf_value(value, field_type, decimals, encoding))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"列 {column_name} 第 {i + 1} 条记录的值 {value!r} 无法写入 {field_type} 类型字段: {e}")
+    needed = max((len(raw) for raw in formatted), default=0)
+    width = max(width or 1, needed)
+    pad = bytes.rjust if field_type in 'NF' else bytes.ljust
+    matrix = np.frombuffer(b''.join(pad(raw, width, b' ') for raw in formatted), dtype=np.uint8)
+    return matrix.reshape(len(values), width), width
+
+
+def update_dbf_columns(input_shp_path, output_shp_path, column_values, new_column_types=None, encoding='utf-8'):
+    """
+    一遍重写.dbf，同时设置多列的逐条记录值。.shp/.shx等几何文件原样保留（输出路径不同时按原样复制）。
+
+    已有列（不区分大小写）保持原类型，值按该类型转换；字符型或数值型的值超出列宽时自动加宽。
+    不存在的列追加到末尾，类型取new_column_types中的值（'str'、'date'、'int'、'float'），未给出时按值推断。
+
+    Args:
+        input_shp_path (str): 输入Shapefile路径。
+        output_shp_path (str): 输出Shapefile路径，可以与输入相同。
+        column_values (dict): 列名 -> 与记录一一对应的值列表，None为空值。
+        new_column_types (dict): 新增列的类型。
+        encoding (str): 字符串的编码。
+
+    Returns:
+        int: 记录数。
+
+    Raises:
+        ValueError: 值无法转换为列类型，或超出dBase限制（列名长度、列宽、列数、记录长度）。
+    """
+    new_column_types = new_column_types or {}
+    input_dbf = find_dbf_path(input_shp_path)
+    if not os.path.exists(input_dbf):
+        raise FileNotFoundError(f"未找到DBF文件: {input_dbf}")
+    header_info = read_dbf_header(input_dbf)
+    record_count = header_info['record_count']
+    header_length = header_info['header_length']
+    record_length = header_info['record_length']
+    if os.path.getsize(input_dbf) < header_length + record_count * record_length:
+        raise ValueError(f"DBF文件记录不完整: {input_dbf}")
+
+    fields = {field['name'].lower(): field for field in header_info['fields']}
+    encoded = {}
+    layout = [] # (原字段或None, 列名, dBase类型, 宽度, 小数位数)
+    for field in header_info['fields']:
+        layout.append([field, field['name'], field['type'], field['length'], field['decimals']])
+    for column_name, values in column_values.items():
+        if len(values) != record_count:
+            raise ValueError(f"列 {column_name} 的值数量 {len(values)} 与记录数 {record_count} 不一致")
+        field = fields.get(column_name.lower())
+        if field is not None:
+            if field['type'] not in 'CNFDL':
+                raise ValueError(f"不支持修改 {field['type']} 类型的列 {column_name}")
+            entry = next(entry for entry in layout if entry[0] is field)
+            matrix, width = _encode_column(column_name, values, field['type'], field['length'], field['decimals'],
+                                           encoding)
+        else:
+            column_type = new_column_types.get(column_name) or _infer_column_type(values)
+            if column_type not in _NEW_FIELD_SPECS:
+                raise ValueError(f"不支持的列类型: {column_type}")
+            if len(column_name) > _DBF_MAX_FIELD_NAME or not column_name.isascii():
+                raise ValueError(f"列名 {column_name} 超过 {_DBF_MAX_FIELD_NAME} 个字符或含有非ASCII字符")
+            field_type, min_width, decimals = _NEW_FIELD_SPECS[column_type]
+            matrix, width = _encode_column(column_name, values, field_type, min_width, decimals, encoding)
+            entry = [None, column_name, field_type, width, decimals]
+            layout.append(entry)
+            fields[column_name.lower()] = entry
+        if entry[2] == 'D' and width != 8 or entry[2] == 'L' and width != 1 or width > _DBF_MAX_CHAR_WIDTH:
+            raise ValueError(f"列 {column_name} 的值超出字段宽度限制")
+        entry[3] = width
+        encoded[id(entry)] = matrix
+
+    if len(layout) > _DBF_MAX_FIELDS:
+        raise ValueError(f"字段数超过dBase上限 {_DBF_MAX_FIELDS}")
+    new_record_length = 1 + sum(entry[3] for entry in layout)
+    if new_record_length > _DBF_MAX_RECORD_BYTES:
+        raise ValueError(f"记录长度 {new_record_length} 超过dBase上限 {_DBF_MAX_RECORD_BYTES}")
+
+    same_file = os.path.abspath(input_shp_path) == os.path.abspath(output_shp_path)
+    output_dbf = input_dbf if same_file else os.path.splitext(output_shp_path)[0] + '.dbf'
+    temp_path = output_dbf + '.tmp'
+    try:
+        _rewrite_dbf(input_dbf, temp_path, header_info, layout, encoded, new_record_length)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, output_dbf)
+    if not same_file:
+        _copy_sidecar_files(input_shp_path, output_shp_path)
+    return record_count
+
+
+def _rewrite_dbf(input_dbf, output_dbf, header_info, layout, encoded, new_record_length):
+    """
+    按新的字段布局写出.dbf：未修改的字段按块从原记录复制，修改的字段取自encoded中的字节矩阵。
+    """
+    record_count = header_info['record_count']
+    header_length = header_info['header_length']
+    record_length = header_info['record_length']
+    with open(input_dbf, 'rb') as infile, open(output_dbf, 'wb') as outfile:
+        header = bytearray(infile.read(header_length))
+        descriptors_end = _DBF_HEADER_BYTES + len(header_info['fields']) * _DBF_FIELD_BYTES
+        # 字段描述符结束符之后可能还有扩展字节（如VFP的backlink），原样保留
+        extra = header[descriptors_end + 1:]
+        descriptors = bytearray()
+        for index, (field, column_name, field_type, width, decimals) in enumerate(layout):
+            if field is not None:
+                start = _DBF_HEADER_BYTES + index * _DBF_FIELD_BYTES
+                descriptor = bytearray(header[start:start + _DBF_FIELD_BYTES])
+            else:
+                descriptor = bytearray(_DBF_FIELD_BYTES)
+                descriptor[:len(column_name)] = column_name.encode('ascii')
+                descriptor[11] = ord(field_type)
+                descriptor[17] = decimals
+            descriptor[16] = width
+            descriptors += descriptor
+        new_header = header[:_DBF_HEADER_BYTES] + descriptors + _DBF_HEADER_TERMINATOR + extra
+        struct.pack_into('<IHH', new_header, 4, record_count, len(new_header), new_record_length)
+        _touch_header_date(new_header)
+        outfile.write(new_header)
+
+        infile.seek(header_length)
+        for start in range(0, record_count, _REWRITE_CHUNK_RECORDS):
+            stop = min(start + _REWRITE_CHUNK_RECORDS, record_count)
+            chunk = np.frombuffer(infile.read((stop - start) * record_length), dtype=np.uint8)
+            if chunk.size != (stop - start) * record_length:
+                raise ValueError(f"DBF文件记录不完整: {input_dbf}")
+            chunk = chunk.reshape(stop - start, record_length)
+            out = np.empty((stop - start, new_record_length), dtype=np.uint8)
+            out[:, 0] = chunk[:, 0] # 删除标记
+            offset = 1
+            for entry in layout:
+                field, width = entry[0], entry[3]
+                if id(entry) in encoded:
+                    out[:, offset:offset + width] = encoded[id(entry)][start:stop]
+                else:
+                    out[:, offset:offset + width] = chunk[:, field['offset']:field['offset'] + field['length']]
+                offset += width
+            outfile.write(out.tobytes())
+        outfile.write(_DBF_EOF)
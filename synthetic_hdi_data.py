@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# 合成HDI/CCD测试数据：按指定的总行数和文件夹数生成逼真的HDI轨迹（随机游走的车辆轨迹，
+# 约1.2秒一帧）及对应的CCD照片文件夹，目录结构与真实数据一致：
+#   <output_dir>/<日期>_<n>（轨迹）/<日期>_<n>-1(合成路<n>）/iScan-Image-1.hdi
+#                                                         /CCD/00000000-01-<时间戳>.jpg
+import argparse
+import os
+
+import numpy as np
+
+# 轨迹起点（与测试数据相同，投影坐标和对应的经纬度）
+_ORIGIN_X, _ORIGIN_Y = 796819.797, 387812.105
+_ORIGIN_L, _ORIGIN_B = 114.3001682368, 30.6106774100
+# 每米对应的经纬度（在起点附近按平面近似）
+_DEGREES_PER_METER_B = 1.0 / 110540.0
+_DEGREES_PER_METER_L = 1.0 / (111320.0 * np.cos(np.radians(_ORIGIN_B)))
+# 起始时间（HDI日期时间列，UTC）和ID中时间戳相对它的时差（北京时间）
+_START_TIME = np.datetime64('2025-08-19T03:16:06.477', 'ms')
+_ID_TIME_OFFSET = np.timedelta64(8, 'h')
+# 帧间隔（毫秒）及抖动范围
+_FRAME_INTERVAL_MS = 1200
+_FRAME_JITTER_MS = 100
+# 每次写入HDI的行数
+_WRITE_CHUNK_ROWS = 100000
+
+HDI_FILE_NAME = 'iScan-Image-1.hdi'
+
+
+def split_rows(total_rows, folders):
+    """
+    把总行数尽量平均地分配到各文件夹。
+    """
+    base, extra = divmod(int(total_rows), int(folders))
+    return [base + (1 if i < extra else 0) for i in range(int(folders))]
+
+
+def make_trajectory(row_count, rng, start_time=_START_TIME):
+    """
+    生成一段车辆轨迹：速度8~15米/秒，朝向缓慢随机变化，偶尔停车。
+
+    Returns:
+        dict: 'TIME'（datetime64[ms]）、'X'、'Y'、'H'、'L'、'B'、'HEADING'、'PITCH'、'ROLL'各列的数组。
+    """
+    intervals = _FRAME_INTERVAL_MS + rng.integers(-_FRAME_JITTER_MS, _FRAME_JITTER_MS + 1, row_count)
+    intervals[0] = 0
+    times = start_time + np.cumsum(intervals).astype('timedelta64[ms]')
+
+    speed = rng.uniform(8.0, 15.0, row_count)
+    speed[rng.random(row_count) < 0.02] = 0.0 # 偶尔停车
+    heading = np.cumsum(rng.normal(0.0, 2.0, row_count)) + rng.uniform(-180.0, 180.0)
+    step = speed * intervals / 1000.0
+    radians = np.radians(heading)
+    # HDI的朝向以正北为0、顺时针为正
+    x = _ORIGIN_X + np.cumsum(step * np.sin(radians))
+    y = _ORIGIN_Y + np.cumsum(step * np.cos(radians))
+    return {
+        'TIME': times,
+        'X': x,
+        'Y': y,
+        'H': 10.0 + np.cumsum(rng.normal(0.0, 0.05, row_count)),
+        'L': _ORIGIN_L + (x - _ORIGIN_X) * _DEGREES_PER_METER_L,
+        'B': _ORIGIN_B + (y - _ORIGIN_Y) * _DEGREES_PER_METER_B,
+        'HEADING': (heading + 180.0) % 360.0 - 180.0,
+        'PITCH': rng.normal(0.0, 1.0, row_count),
+        'ROLL': rng.normal(0.0, 1.0, row_count),
+    }
+
+
+def _timestamp_digits(times):
+    """
+    datetime64[ms]数组转换为YYYYMMDDhhmmssfff字符串列表。
+    """
+    return [text[0:4] + text[5:7] + text[8:10] + text[11:13] + text[14:16] + text[17:19] + text[20:23]
+            for text in np.datetime_as_string(times, unit='ms').tolist()]
+
+
+def format_hdi_lines(trajectory, start, stop):
+    """
+    把轨迹的[start, stop)行格式化为HDI文本行（制表符分隔，21列）。
+    """
+    times = trajectory['TIME'][start:stop]
+    ids = _timestamp_digits(times + _ID_TIME_OFFSET)
+    clock = np.datetime_as_string(times, unit='ms').tolist()
+    columns = [trajectory[name][start:stop].tolist() for name in ('X', 'Y', 'H', 'L', 'B', 'HEADING', 'PITCH', 'ROLL')]
+    return [f"00000000-01-{id_digits}\t01\t{text[0:4]}\t{text[5:7]}\t{text[8:10]}\t{text[11:13]}\t{text[14:16]}"
+            f"\t{text[17:19]}\t{text[20:23]}\t{x:.3f}\t{y:.3f}\t{h:.3f}\t{l:.10f}\t{b:.10f}\t{heading:.4f}"
+            f"\t{pitch:.4f}\t{roll:.4f}\t-5.231\t-9.842\t0.048\t2\n"
+            for id_digits, text, x, y, h, l, b, heading, pitch, roll in zip(ids, clock, *columns)]
+
+
+def write_folder(folder_path, trajectory, rng, photo_drop_rate=0.0, photo_jitter_ms=50, photo_bytes=b''):
+    """
+    写出一个HDI文件及其CCD照片文件夹。
+
+    Args:
+        folder_path (str): HDI文件所在的目录。
+        trajectory (dict): make_trajectory生成的轨迹。
+        photo_drop_rate (float): 丢帧比例（对应行没有照片），用于测试按时间戳匹配。
+        photo_jitter_ms (int): 照片时间戳相对HDI行的最大偏差（毫秒）。
+        photo_bytes (bytes): 每张照片文件的内容，默认为空文件。
+
+    Returns:
+        tuple: (HDI行数, 照片数量, HDI文件字节数)
+    """
+    ccd_path = os.path.join(folder_path, 'CCD')
+    os.makedirs(ccd_path, exist_ok=True)
+    row_count = len(trajectory['TIME'])
+    hdi_file_path = os.path.join(folder_path, HDI_FILE_NAME)
+    with open(hdi_file_path, 'w', encoding='ascii', newline='') as outfile:
+        for start in range(0, row_count, _WRITE_CHUNK_ROWS):
+            outfile.writelines(format_hdi_lines(trajectory, start, min(start + _WRITE_CHUNK_ROWS, row_count)))
+
+    keep = rng.random(row_count) >= photo_drop_rate
+    jitter = rng.integers(-photo_jitter_ms, photo_jitter_ms + 1, row_count).astype('timedelta64[ms]')
+    photo_names = _timestamp_digits((trajectory['TIME'] + _ID_TIME_OFFSET + jitter)[keep])
+    for digits in photo_names:
+        with open(os.path.join(ccd_path, f"00000000-01-{digits}.jpg"), 'wb') as photo:
+            photo.write(photo_bytes)
+    return row_count, len(photo_names), os.path.getsize(hdi_file_path)
+
+
+def generate_dataset(output_dir, total_rows, folders=1, seed=0, photo_drop_rate=0.0, photo_bytes=b'',
+                     progress=False):
+    """
+    生成合成数据集。各文件夹的轨迹首尾相接（时间上连续），行数按split_rows分配。
+
+    Returns:
+        dict: 数据集统计（文件夹数、行数、照片数、HDI总字节数），可直接写入基准测试报告。
+    """
+    rng = np.random.default_rng(seed)
+    start_time = _START_TIME
+    day = str(start_time.astype('datetime64[D]')).replace('-', '')
+    summary = {'output_dir': os.path.abspath(output_dir), 'folders': 0, 'rows': 0, 'photos': 0, 'hdi_bytes': 0,
+               'seed': seed}
+    for index, row_count in enumerate(split_rows(total_rows, folders), start=1):
+        if row_count == 0:
+            continue
+        trajectory = make_trajectory(row_count, rng, start_time)
+        # 下一段轨迹在本段结束后一分钟开始
+        start_time = trajectory['TIME'][-1] + np.timedelta64(60, 's')
+        folder_path = os.path.join(output_dir, f"{day}_{index}（轨迹）", f"{day}_{index}-1(合成路{index}）")
+        rows, photos, hdi_bytes = write_folder(folder_path, trajectory, rng, photo_drop_rate, photo_bytes=photo_bytes)
+        summary['folders'] += 1
+        summary['rows'] += rows
+        summary['photos'] += photos
+        summary['hdi_bytes'] += hdi_bytes
+        if progress:
+            print(f"已生成 {summary['folders']}/{folders} 个文件夹，{summary['rows']} 行")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic HDI trajectories and CCD photo folders.")
+    parser.add_argument('--output_dir', type=str, required=True,
+                        help='输出目录。')
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='HDI总行数（1千~1千万）。默认为 100000。')
+    parser.add_argument('--folders', type=int, default=10,
+                        help='HDI文件夹数（1~1000），行数平均分配。默认为 10。')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='随机种子，相同参数生成的数据完全一致。默认为 0。')
+    parser.add_argument('--photo_drop_rate', type=float, default=0.0,
+                        help='丢帧比例（0~1），对应行没有照片。默认为 0。')
+    parser.add_argument('--photo_bytes', type=int, default=0,
+                        help='每张照片文件的字节数，默认为0（空文件）。')
+    args = parser.parse_args()
+
+    if args.folders < 1 or args.rows < args.folders:
+        parser.error('--folders 至少为1，且 --rows 不能少于 --folders。')
+    summary = generate_dataset(args.output_dir, args.rows, args.folders, args.seed, args.photo_drop_rate,
+                               b'\0' * args.photo_bytes, progress=True)
+    print(f"已生成 {summary['folders']} 个文件夹，{summary['rows']} 行HDI，{summary['photos']} 张照片，"
+          f"HDI共 {summary['hdi_bytes'] / 1e6:.1f} MB，输出到 {summary['output_dir']}")
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# 各脚本都是仓库根目录下的独立模块，测试时把根目录加入导入路径。
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
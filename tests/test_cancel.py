@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# 取消：CSV转Shapefile阶段在写入批次之间响应取消，回滚正在写入的事务。
+import csv
+
+import pytest
+
+from hdi_to_csv_processor import HDI_CSV_HEADER, ProcessingCancelled
+
+
+class CancelAfter:
+    """
+    第calls次检查之后视为已取消的取消标志（与threading.Event的is_set接口相同）。
+    """
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def is_set(self):
+        self.calls -= 1
+        return self.calls < 0
+
+
+def test_convert_csv_to_shp_stops_between_batches(tmp_path):
+    ogr = pytest.importorskip('osgeo.ogr')
+    from hdi_to_csv_processor import convert_csv_to_shp
+
+    csv_path = str(tmp_path / 'merged.csv')
+    with open(csv_path, 'w', newline='', encoding='gbk') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(HDI_CSV_HEADER)
+        writer.writerows([f'{i}.jpg', f'CCD/{i}.jpg', 'road', 30.0 + i * 1e-4, 120.0, 10.0, 90.0]
+                         for i in range(30))
+
+    shp_path = str(tmp_path / 'merged.shp')
+    # 第一批（10行）写完后取消：读第一批前、写入第一批时各检查一次
+    with pytest.raises(ProcessingCancelled):
+        convert_csv_to_shp(csv_path, shp_path, batch_size=10, cancel_event=CancelAfter(2))
+    data_source = ogr.Open(shp_path)
+    assert data_source.GetLayer(0).GetFeatureCount() == 10
+    data_source = None
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# 按键更新模式：重复运行同一批数据时要素数量不变（包括没有配对照片、键为空的行）。
+import csv
+
+import numpy as np
+import pytest
+
+from feature_key_index import FeatureKeyIndex, feature_digest, hash_keys
+
+# FILE_NAME, ROAD_NAME, B, L；第3、4行没有配对照片且内容相同
+ROWS = [
+    ('a.jpg', 'road', 30.1, 120.1),
+    ('b.jpg', 'road', 30.2, 120.2),
+    ('', 'road', 30.3, 120.3),
+    ('', 'road', 30.3, 120.3),
+    ('', 'road', 30.4, 120.4),
+]
+
+
+class ListLayer:
+    """
+    按FID顺序保存要素值的最小图层，只提供FeatureKeyIndex.build用到的接口。
+    """
+
+    class Feature:
+        def __init__(self, fid, values):
+            self.fid = fid
+            self.values = values
+
+        def GetFID(self):
+            return self.fid
+
+        def GetField(self, index):
+            return self.values[index]
+
+    class Defn:
+        def GetFieldIndex(self, name):
+            return 0 if name == 'FILE_NAME' else -1
+
+    def __init__(self):
+        self.features = []
+
+    def GetLayerDefn(self):
+        return self.Defn()
+
+    def GetFeatureCount(self):
+        return len(self.features)
+
+    def ResetReading(self):
+        pass
+
+    def __iter__(self):
+        return iter(self.features)
+
+
+def upsert(index, layer, rows):
+    """
+    按FeatureKeyIndex.plan的结果把rows写入layer（新要素追加，有变化的替换），返回计数。
+    """
+    key_hashes = hash_keys([row[0] for row in rows])
+    digests = np.array([feature_digest(row) for row in rows], dtype=np.uint64)
+    key_hashes, fids, write, counts = index.plan(key_hashes, digests)
+    written_fids = []
+    for i in np.flatnonzero(write).tolist():
+        if fids[i] >= 0:
+            fid = int(fids[i])
+            layer.features[fid] = ListLayer.Feature(fid, rows[i])
+        else:
+            fid = len(layer.features)
+            layer.features.append(ListLayer.Feature(fid, rows[i]))
+        written_fids.append(fid)
+    index.record(key_hashes[write], written_fids, digests[write])
+    return counts
+
+
+@pytest.mark.parametrize('rebuild', [False, True])
+def test_rerun_does_not_duplicate_features(tmp_path, rebuild):
+    output_path = str(tmp_path / 'out.gpkg')
+    open(output_path, 'w').close()
+    layer = ListLayer()
+
+    index = FeatureKeyIndex.load_or_build(output_path, layer, 'FILE_NAME', lambda feature: feature.values)
+    counts = upsert(index, layer, ROWS)
+    index.save(output_path)
+    assert counts['added'] == len(ROWS)
+    assert counts['unkeyed'] == 3
+    assert layer.GetFeatureCount() == len(ROWS)
+
+    if rebuild:
+        # 输出被其他程序修改过：索引失效，扫描图层重建
+        with open(output_path, 'a') as outfile:
+            outfile.write('changed')
+        assert FeatureKeyIndex.load(output_path, 'FILE_NAME') is None
+    index = FeatureKeyIndex.load_or_build(output_path, layer, 'FILE_NAME', lambda feature: feature.values)
+    counts = upsert(index, layer, ROWS)
+    index.save(output_path)
+    assert counts['unchanged'] == len(ROWS)
+    assert counts['added'] == counts['replaced'] == 0
+    assert layer.GetFeatureCount() == len(ROWS)
+
+
+def test_changed_feature_is_replaced(tmp_path):
+    output_path = str(tmp_path / 'out.gpkg')
+    open(output_path, 'w').close()
+    layer = ListLayer()
+    index = FeatureKeyIndex.load_or_build(output_path, layer, 'FILE_NAME', lambda feature: feature.values)
+    upsert(index, layer, ROWS)
+    index.save(output_path)
+
+    changed = [('b.jpg', 'road', 30.25, 120.2), ('c.jpg', 'road', 30.5, 120.5)]
+    index = FeatureKeyIndex.load(output_path, 'FILE_NAME')
+    counts = upsert(index, layer, changed)
+    assert (counts['replaced'], counts['added']) == (1, 1)
+    assert layer.GetFeatureCount() == len(ROWS) + 1
+    assert layer.features[1].values == changed[0]
+
+
+def test_convert_csv_to_shp_rerun_keeps_feature_count(tmp_path):
+    ogr = pytest.importorskip('osgeo.ogr')
+    from hdi_to_csv_processor import HDI_CSV_HEADER, convert_csv_to_shp
+
+    csv_path = str(tmp_path / 'merged.csv')
+    with open(csv_path, 'w', newline='', encoding='gbk') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(HDI_CSV_HEADER)
+        for file_name, road_name, b, l in ROWS:
+            writer.writerow([file_name, f'CCD/{file_name}' if file_name else '', road_name, b, l, 10.0, 90.0])
+
+    shp_path = str(tmp_path / 'merged.shp')
+    for _ in range(2):
+        convert_csv_to_shp(csv_path, shp_path, upsert_key='FILE_NAME')
+        data_source = ogr.Open(shp_path)
+        assert data_source.GetLayer(0).GetFeatureCount() == len(ROWS)
+        data_source = None
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# 结果缓存：命中缓存时警告汇总和错误报告与重新处理时一致。
+import json
+import os
+import shutil
+
+import pytest
+
+from hdi_to_csv_processor import run_hdi_processing
+from synthetic_hdi_data import HDI_FILE_NAME, generate_dataset
+
+
+def make_dataset(input_dir):
+    """
+    生成4个文件夹：丢帧（未配对照片）、列数不足的行、缺少CCD文件夹各占一个。
+    """
+    generate_dataset(input_dir, 400, folders=4, seed=1, photo_drop_rate=0.2)
+    folders = sorted(os.path.dirname(os.path.join(root, name))
+                     for root, _, files in os.walk(input_dir) for name in files if name == HDI_FILE_NAME)
+    with open(os.path.join(folders[1], HDI_FILE_NAME), 'a', encoding='ascii') as outfile:
+        outfile.write('short\trow\n' * 3)
+    shutil.rmtree(os.path.join(folders[2], 'CCD'))
+
+
+def run(input_dir, output_dir, workers):
+    run_hdi_processing(input_dir, input_dir, 'merged', workers=workers, use_cache=True, error_report=True,
+                       write_shp=False, output_dir=str(output_dir))
+    with open(os.path.join(output_dir, 'merged_errors.json'), encoding='utf-8') as infile:
+        return json.load(infile)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_cached_run_reports_same_warnings(tmp_path, workers):
+    input_dir = str(tmp_path / 'input')
+    make_dataset(input_dir)
+    cold = run(input_dir, tmp_path, workers)
+    cached = run(input_dir, tmp_path, workers)
+    assert {'short_rows', 'missing_ccd', 'photo_unmatched'} <= set(cold['categories'])
+    assert cold['categories']['short_rows']['count'] == 3
+    assert cached == cold
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# 轨迹抽稀：各级别满足最小间距且互相嵌套，Douglas-Peucker只保留拐点。
+import numpy as np
+import pytest
+
+from hdi_to_csv_processor import run_hdi_processing
+from trajectory_thinning import along_track_distance, douglas_peucker_mask, min_spacing_select, thin_levels
+
+
+def greedy_select(distance, candidates, fixed, spacing):
+    """
+    逐点贪心选点的参考实现，与min_spacing_select的结果应完全一致。
+    """
+    keep = fixed.copy()
+    fixed_positions = np.flatnonzero(fixed)
+    for first, last in zip(fixed_positions[:-1], fixed_positions[1:]):
+        current = distance[first]
+        for candidate in candidates:
+            if first < candidate < last and distance[candidate] >= current + spacing \
+                    and distance[candidate] <= distance[last] - spacing:
+                keep[candidate] = True
+                current = distance[candidate]
+    return keep
+
+
+def test_min_spacing_select_matches_greedy():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        count = int(rng.integers(2, 60))
+        distance = np.concatenate(([0.0], np.cumsum(rng.choice([0.0, 3.0, 12.0], count - 1))))
+        fixed = rng.random(count) < 0.1
+        fixed[0] = fixed[-1] = True
+        candidates = np.flatnonzero(rng.random(count) < 0.7)
+        for spacing in (1.0, 10.0, 30.0):
+            assert (min_spacing_select(distance, candidates, fixed, spacing)
+                    == greedy_select(distance, candidates, fixed, spacing)).all()
+
+
+def test_thin_levels_spacing_and_nesting():
+    rng = np.random.default_rng(1)
+    count = 2000
+    x = np.cumsum(rng.normal(13.0, 1.0, count))
+    y = np.cumsum(rng.normal(0.0, 1.0, count))
+    heading = rng.normal(0.0, 0.5, count)
+    spacings = [20.0, 200.0, 5.0]
+    masks = thin_levels(x, y, heading, spacings, heading_threshold=10.0, dp_tolerance=0.5)
+    distance = along_track_distance(x, y)
+    for spacing, mask in zip(spacings, masks):
+        assert mask[0] and mask[-1]
+        assert np.diff(distance[mask]).min() >= spacing
+    assert not (masks[1] & ~masks[0]).any()
+    assert not (masks[0] & ~masks[2]).any()
+
+
+def test_douglas_peucker_keeps_corner():
+    x = np.concatenate((np.arange(50.0), np.full(50, 49.0)))
+    y = np.concatenate((np.zeros(50), np.arange(1.0, 51.0)))
+    assert np.flatnonzero(douglas_peucker_mask(x, y, 0.1)).tolist() == [0, 49, 99]
+
+
+@pytest.mark.parametrize('options', [
+    {'thin_heading': 10.0},
+    {'thin_dp_tolerance': 1.0},
+])
+def test_thinning_options_without_spacing_are_rejected(tmp_path, options):
+    with pytest.raises(ValueError):
+        run_hdi_processing(str(tmp_path), str(tmp_path), 'merged', stream=True, **options)
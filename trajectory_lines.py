@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# 轨迹线：把每个HDI文件的点按时间间隔切分为若干段，每段生成一条LineString（WKB由NumPy直接拼出），
+# 并计算道路名称、起止时间、长度和点数等属性，作为低缩放级别下的覆盖范围概览图层。
+import struct
+
+import numpy as np
+
+from hdi_reader import hdi_timestamps_to_epoch_ms
+from trajectory_thinning import along_track_distance, douglas_peucker_mask
+
+# 轨迹线需要的HDI列：日期时间（第2~8列）和投影坐标X/Y（米，用于计算长度）
+TRACK_LINE_COLUMNS = ('YEAR', 'MONTH', 'DAY', 'HOUR', 'MINUTE', 'SECOND', 'MILLISECOND', 'X', 'Y')
+# 默认的切分时间间隔（秒）：相邻两点的时间差超过该值（或时间倒退）时断开
+DEFAULT_TRACK_GAP_SECONDS = 10.0
+
+# 小端LineString的WKB头：字节序(1) + 几何类型(2)
+_WKB_LINESTRING_HEADER = struct.pack('<BI', 1, 2)
+
+
+def track_timestamps(track):
+    """
+    由HDI的日期时间列计算毫秒时间戳，任一字段缺失（-1）的行返回-1。
+    """
+    fields = [np.asarray(track[name], dtype=np.int64) for name in TRACK_LINE_COLUMNS[:7]]
+    valid = np.logical_and.reduce([field >= 0 for field in fields])
+    timestamps = hdi_timestamps_to_epoch_ms(*[np.where(valid, field, 1) for field in fields])
+    timestamps[~valid] = -1
+    return timestamps
+
+
+def split_at_time_gaps(timestamps, max_gap_ms):
+    """
+    在时间间隔超过max_gap_ms或时间倒退处切分。时间戳无效（-1）的点不参与判断。
+
+    Returns:
+        list: [(起始下标, 结束下标（不含）), ...]
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if timestamps.size == 0:
+        return []
+    valid_index = np.flatnonzero(timestamps >= 0)
+    valid_times = timestamps[valid_index]
+    steps = np.diff(valid_times)
+    breaks = valid_index[1:][(steps > max_gap_ms) | (steps < 0)]
+    bounds = np.concatenate(([0], breaks, [timestamps.size]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def linestring_wkb(x, y):
+    """
+    由坐标数组直接拼出LineString的WKB，不逐点调用OGR。
+    """
+    coordinates = np.column_stack((np.asarray(x, dtype='<f8'), np.asarray(y, dtype='<f8')))
+    return _WKB_LINESTRING_HEADER + struct.pack('<I', len(coordinates)) + coordinates.tobytes()
+
+
+def format_epoch_ms(epoch_ms):
+    """
+    毫秒时间戳格式化为 YYYY-MM-DD hh:mm:ss.fff，无效时间返回空字符串。
+    """
+    if epoch_ms < 0:
+        return ''
+    return str(np.datetime64(int(epoch_ms), 'ms')).replace('T', ' ')
+
+
+def build_track_segments(hdi_name, columns, track, max_gap_ms, dp_tolerance=None):
+    """
+    把一个HDI文件的点切分为轨迹段。
+
+    Args:
+        hdi_name (str): 写入HDI_FILE属性的HDI文件名称（通常为相对路径）。
+        columns (list): 该文件处理后的列，见process_hdi_to_columns。
+        track (dict): TRACK_LINE_COLUMNS中各列的数组。
+        max_gap_ms (float): 切分的时间间隔（毫秒）。
+        dp_tolerance (float): Douglas-Peucker容差（米，按投影坐标X/Y计算），给出时每段线只保留简化后的顶点；
+                              长度和点数仍按简化前的全部点计算。
+
+    Returns:
+        list: 每段一个元组 (HDI_FILE, ROAD_NAME, 段号, 起始时间, 结束时间, 长度(米), 点数, WKB)。
+              点数少于2的段无法构成线，不返回。
+    """
+    road_names, l_values, b_values = columns[2], columns[4], columns[3]
+    if len(road_names) == 0:
+        return []
+    l_values = np.asarray(l_values, dtype=np.float64)
+    b_values = np.asarray(b_values, dtype=np.float64)
+    timestamps = track_timestamps(track)
+    distance = along_track_distance(track['X'], track['Y'])
+
+    segments = []
+    for start, stop in split_at_time_gaps(timestamps, max_gap_ms):
+        if stop - start < 2:
+            continue
+        segment_times = timestamps[start:stop]
+        segment_times = segment_times[segment_times >= 0]
+        start_ms = segment_times.min() if segment_times.size else -1
+        end_ms = segment_times.max() if segment_times.size else -1
+        vertices = slice(start, stop)
+        if dp_tolerance:
+            vertices = start + np.flatnonzero(douglas_peucker_mask(np.asarray(track['X'][start:stop]),
+                                                                   np.asarray(track['Y'][start:stop]), dp_tolerance))
+        segments.append((hdi_name, road_names[start], len(segments) + 1,
+                         format_epoch_ms(start_ms), format_epoch_ms(end_ms),
+                         float(distance[stop - 1] - distance[start]), stop - start,
+                         linestring_wkb(l_values[vertices], b_values[vertices])))
+    return segments
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# 轨迹抽稀：按最小间距（沿轨迹累计距离，使用HDI中的投影坐标X/Y）、朝向变化阈值和
+# Douglas-Peucker简化选出要保留的点。逐个HDI文件处理，一次计算累计距离即可得到多个缩放级别的结果；
+# 贪心选点和Douglas-Peucker简化都按整个数组运算，Python循环次数只与点数的对数（或简化的层数）有关，与点数无关。
+import itertools
+
+import numpy as np
+
+# 抽稀需要的HDI列（投影坐标，单位为米）
+THINNING_TRACK_COLUMNS = ('X', 'Y')
+# 查找朝向变化点时第一次检查的点数，找不到时窗口加倍
+_HEADING_WINDOW = 64
+
+
+def along_track_distance(x, y):
+    """
+    沿轨迹的累计距离（米），第一个点为0。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    distance = np.zeros(x.size, dtype=np.float64)
+    if x.size > 1:
+        steps = np.hypot(np.diff(x), np.diff(y))
+        # 坐标缺失的点不计入距离
+        np.cumsum(np.nan_to_num(steps, nan=0.0), out=distance[1:])
+    return distance
+
+
+def heading_change_points(heading, threshold):
+    """
+    朝向变化点：与上一个变化点（起点为第一个有效朝向）的朝向夹角达到threshold（度）的点。
+    与参考点比较的是净变化，直行路段上朝向的随机抖动不会累积成转弯；夹角取0~180度，跨越±180度不会被当作大转弯。
+    每次从参考点之后按逐渐加倍的窗口向量化地查找第一个达到阈值的点，朝向缺失（NaN）的点不参与判断。
+    """
+    heading = np.asarray(heading, dtype=np.float64)
+    keep = np.zeros(heading.size, dtype=bool)
+    valid = np.flatnonzero(np.isfinite(heading))
+    if valid.size == 0:
+        return keep
+    reference = int(valid[0])
+    start = reference + 1
+    window = _HEADING_WINDOW
+    while start < heading.size:
+        stop = min(start + window, heading.size)
+        change = np.abs((heading[start:stop] - heading[reference] + 180.0) % 360.0 - 180.0)
+        hits = np.flatnonzero(change >= threshold)
+        if hits.size == 0:
+            start = stop
+            window *= 2
+            continue
+        reference = start + int(hits[0])
+        keep[reference] = True
+        start = reference + 1
+        window = _HEADING_WINDOW
+    return keep
+
+
+def min_spacing_select(distance, candidates, fixed, spacing):
+    """
+    在fixed（必须保留的点）之间贪心地从candidates中选点，使所有保留点沿轨迹的间距都不小于spacing：
+    从每个固定点出发，依次选出第一个与上一个保留点相距至少spacing、且与下一个固定点也相距至少spacing的候选点。
+
+    每个候选点的下一个候选点用一次searchsorted求出，贪心链再用指针倍增标记：第k轮把已标记的点沿
+    2^k步的跳转表前进一次，log2(保留点数)轮后链上的点全部标记，没有逐点的Python循环。
+
+    Args:
+        distance (numpy.ndarray): 沿轨迹的累计距离（单调不减）。
+        candidates (numpy.ndarray): 候选点的下标（升序）。
+        fixed (numpy.ndarray): 必须保留的点的布尔掩码，应包含首尾点。
+        spacing (float): 最小间距（米）。
+
+    Returns:
+        numpy.ndarray: fixed与选出的候选点合并后的布尔掩码。
+    """
+    keep = fixed.copy()
+    candidates = np.asarray(candidates, dtype=np.int64)
+    candidate_count = candidates.size
+    fixed_positions = np.flatnonzero(fixed)
+    if candidate_count == 0 or fixed_positions.size < 2:
+        return keep
+    candidate_distance = distance[candidates]
+    first, last = fixed_positions[:-1], fixed_positions[1:]
+    # 每个区间内可选的候选点为[起点, 上界)：在下一个固定点之前，且与它相距至少spacing
+    starts = np.searchsorted(candidate_distance, distance[first] + spacing, side='left')
+    bounds = np.minimum(np.searchsorted(candidates, last, side='left'),
+                        np.searchsorted(candidate_distance, distance[last] - spacing, side='right'))
+    # 每个候选点所在区间的上界；超出上界的跳转指向哨兵candidate_count，贪心链在区间内结束
+    gap = np.clip(np.searchsorted(fixed_positions, candidates, side='right') - 1, 0, first.size - 1)
+    jump = np.searchsorted(candidate_distance, candidate_distance + spacing, side='left')
+    jump[jump >= bounds[gap]] = candidate_count
+    jump = np.append(jump, candidate_count)
+
+    reached = np.zeros(candidate_count + 1, dtype=bool)
+    reached[starts[starts < bounds]] = True
+    reached[candidate_count] = False
+    while True:
+        reached[jump[reached]] = True
+        reached[candidate_count] = False
+        if (jump[:candidate_count] == candidate_count).all():
+            break
+        jump = jump[jump]
+    keep[candidates[reached[:candidate_count]]] = True
+    return keep
+
+
+def douglas_peucker_mask(x, y, tolerance):
+    """
+    Douglas-Peucker简化：返回被保留的顶点掩码。同一递归层的所有区段一起计算：
+    把各区段的中间点拼成一个数组，向量化地求出到各自弦的距离和每个区段的最远点，
+    Python循环次数只等于递归层数，长轨迹也不会超出递归深度。
+
+    Args:
+        x, y (numpy.ndarray): 投影坐标（米）。
+        tolerance (float): 允许的最大偏离距离（米）。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    keep = np.zeros(x.size, dtype=bool)
+    if x.size == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    firsts = np.array([0], dtype=np.int64)
+    lasts = np.array([x.size - 1], dtype=np.int64)
+    while True:
+        # 只有首尾两点的区段不再拆分
+        splittable = lasts - firsts >= 2
+        firsts, lasts = firsts[splittable], lasts[splittable]
+        if firsts.size == 0:
+            break
+        inner_counts = lasts - firsts - 1
+        segment = np.repeat(np.arange(firsts.size), inner_counts)
+        offsets = np.cumsum(inner_counts) - inner_counts
+        inner = firsts[segment] + 1 + np.arange(segment.size) - offsets[segment]
+
+        dx = (x[lasts] - x[firsts])[segment]
+        dy = (y[lasts] - y[firsts])[segment]
+        inner_x = x[inner] - x[firsts][segment]
+        inner_y = y[inner] - y[firsts][segment]
+        chord = np.hypot(dx, dy)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # 首尾重合（原地掉头或停车）时取到端点的距离
+            distance = np.where(chord > 0, np.abs(inner_x * dy - inner_y * dx) / chord, np.hypot(inner_x, inner_y))
+        # 坐标缺失的点不参与比较
+        distance = np.nan_to_num(distance, nan=-1.0)
+
+        # 每个区段的最远点（距离相同时取第一个）
+        farthest = np.maximum.reduceat(distance, offsets)
+        is_farthest = np.flatnonzero(distance == farthest[segment])
+        first_hit = np.ones(is_farthest.size, dtype=bool)
+        first_hit[1:] = segment[is_farthest[1:]] != segment[is_farthest[:-1]]
+        is_farthest = is_farthest[first_hit]
+
+        split = farthest > tolerance
+        splits = inner[is_farthest][split]
+        keep[splits] = True
+        firsts, lasts = (np.concatenate((firsts[split], splits)),
+                         np.concatenate((splits, lasts[split])))
+    return keep
+
+
+def thin_levels(x, y, heading, spacings, heading_threshold=None, dp_tolerance=None):
+    """
+    一次计算多个缩放级别的抽稀掩码。
+
+    每个级别内除首尾点外，相邻保留点沿轨迹的间距都不小于spacing（整条轨迹短于spacing时只保留首尾点）。
+    从粗到细逐级选点，较粗级别保留的点在较细级别中一定保留；每一级先在已保留的点之间选出满足间距的形状点
+    （与上一个变化点的朝向夹角达到heading_threshold的点、Douglas-Peucker（dp_tolerance）保留的顶点），
+    再用按间距均匀分布的点填满其余的空隙。
+
+    Args:
+        x, y (numpy.ndarray): 投影坐标（米），即HDI的X/Y列。
+        heading (numpy.ndarray): 朝向（度）。
+        spacings (list): 各级别的最小间距（米）。
+        heading_threshold (float): 朝向变化阈值（度），为None时不按朝向保留。
+        dp_tolerance (float): Douglas-Peucker容差（米），为None时不做简化。
+
+    Returns:
+        list: 与spacings顺序一致的布尔掩码列表。
+    """
+    if any(spacing <= 0 for spacing in spacings):
+        raise ValueError(f"抽稀间距必须大于0: {', '.join(f'{spacing:g}' for spacing in spacings)}")
+    point_count = len(x)
+    if point_count == 0:
+        return [np.zeros(0, dtype=bool) for _ in spacings]
+
+    shape_points = np.zeros(point_count, dtype=bool)
+    if heading_threshold:
+        shape_points |= heading_change_points(heading, heading_threshold)
+    if dp_tolerance:
+        shape_points |= douglas_peucker_mask(x, y, dp_tolerance)
+    shape_candidates = np.flatnonzero(shape_points)
+    all_candidates = np.arange(point_count)
+
+    distance = along_track_distance(x, y)
+    masks = {}
+    coarser = np.zeros(point_count, dtype=bool)
+    coarser[0] = coarser[-1] = True
+    # 从粗到细计算，粗级别的结果作为细级别的固定点，保证各级别嵌套
+    for spacing in sorted(set(spacings), reverse=True):
+        level = min_spacing_select(distance, shape_candidates, coarser, spacing)
+        coarser = min_spacing_select(distance, all_candidates, level, spacing)
+        masks[spacing] = coarser
+    return [masks[spacing] for spacing in spacings]
+
+
+def take_rows(columns, mask):
+    """
+    按布尔掩码从列数据（列表或NumPy数组）中取出行。
+    """
+    mask = np.asarray(mask, dtype=bool)
+    return [column[mask] if isinstance(column, np.ndarray) else list(itertools.compress(column, mask))
+            for column in columns]
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# 监视文件夹模式：定期轮询输入目录，发现新到的（轨迹）文件夹后，等其中的HDI和CCD文件在一段时间内不再变化
+# （复制完成）再逐个处理，把要素追加到已有的输出图层和CSV中，不重建已有输出。
+# 已处理的文件夹记录在状态文件中，重启后不会重复处理。待处理队列有上限，积压的文件夹留在磁盘上，
+# 等队列有空位时再加入；每个文件夹用固定数量的进程解析，负载可预测。
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from hdi_cache import DEFAULT_CACHE_DIR_NAME
+from hdi_to_csv_processor import OUTPUT_FORMAT_SHP, OUTPUT_FORMATS, run_hdi_processing
+from output_crs import parse_output_crs_list
+from photo_metadata import THUMB_DIR_NAME, pillow_available
+from run_log import WarningLog
+
+# 默认轮询间隔（秒）
+DEFAULT_POLL_SECONDS = 30
+# 文件夹内容（文件数、总大小、最新修改时间）保持不变多久（秒）后视为复制完成
+DEFAULT_SETTLE_SECONDS = 120
+# 待处理队列的最大长度
+DEFAULT_QUEUE_SIZE = 8
+# 状态文件名称（位于输出目录的缓存目录下）和格式版本
+WATCH_STATE_FILE_NAME = 'watch_state.json'
+WATCH_STATE_VERSION = 1
+
+# 文件夹状态
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_BASELINE = 'baseline' # 启动监视前已在输出中的文件夹，不再处理
+
+
+def folder_signature(folder_path):
+    """
+    文件夹内容的签名：[HDI文件数, 文件总数, 总大小, 最新修改时间(ns)]。
+    复制过程中文件数、大小或修改时间会变化；缩略图文件夹和以.开头的目录不计入。
+    """
+    hdi_count = file_count = total_size = latest_mtime_ns = 0
+    stack = [folder_path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != THUMB_DIR_NAME:
+                        stack.append(entry.path)
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue # 文件在列出后被移动或删除
+            file_count += 1
+            total_size += stat.st_size
+            latest_mtime_ns = max(latest_mtime_ns, stat.st_mtime_ns)
+            if entry.name.endswith('.hdi'):
+                hdi_count += 1
+    return [hdi_count, file_count, total_size, latest_mtime_ns]
+
+
+def list_candidate_folders(input_dir, output_dir=None):
+    """
+    输入目录下的各个子文件夹（每个为一次采集拷贝的数据，如 20250819_1（轨迹）），按名称排序。
+    """
+    excluded = os.path.abspath(output_dir) if output_dir else None
+    names = []
+    for entry in os.scandir(input_dir):
+        if entry.is_dir() and not entry.name.startswith('.') and os.path.abspath(entry.path) != excluded:
+            names.append(entry.name)
+    return sorted(names)
+
+
+class FolderWatcher:
+    """
+    跟踪输入目录中各文件夹的状态。
+
+    state['folders']以文件夹名为键，值为{'status': 状态, 'signature': 处理时的签名, 'time': 时间, 'error': 错误}。
+    pending记录尚未处理的文件夹最近一次的签名及其首次出现的时间，签名持续settle_seconds不变时文件夹就绪。
+    """
+
+    def __init__(self, input_dir, state_path, settle_seconds=DEFAULT_SETTLE_SECONDS, output_dir=None):
+        self.input_dir = input_dir
+        self.state_path = state_path
+        self.settle_seconds = settle_seconds
+        self.output_dir = output_dir
+        self.pending = {}
+        self.state = {'version': WATCH_STATE_VERSION, 'folders': {}}
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as infile:
+                state = json.load(infile)
+            if state.get('version') != WATCH_STATE_VERSION:
+                raise ValueError(f"监视状态文件版本不兼容: {state_path}")
+            self.state = state
+
+    @property
+    def folders(self):
+        return self.state['folders']
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as outfile:
+            json.dump(self.state, outfile, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.state_path)
+
+    def mark(self, name, status, signature, error=None):
+        self.folders[name] = {'status': status, 'signature': signature, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                              'error': error}
+        self.pending.pop(name, None)
+        self.save()
+
+    def mark_baseline(self):
+        """
+        把当前已有的文件夹记为已在输出中（不处理），返回文件夹数。
+        """
+        count = 0
+        for name in list_candidate_folders(self.input_dir, self.output_dir):
+            if name not in self.folders:
+                signature = folder_signature(os.path.join(self.input_dir, name))
+                if signature[0]:
+                    self.folders[name] = {'status': STATUS_BASELINE, 'signature': signature,
+                                          'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'error': None}
+                    count += 1
+        self.save()
+        return count
+
+    def poll(self, now, busy=()):
+        """
+        检查一遍输入目录，返回已就绪（签名持续settle_seconds不变）的文件夹名。
+        已处理的文件夹不再检查；处理失败的文件夹在内容变化后重新尝试。busy中的文件夹（已在队列中或正在处理）跳过。
+        """
+        ready = []
+        for name in list_candidate_folders(self.input_dir, self.output_dir):
+            record = self.folders.get(name)
+            if name in busy or (record is not None and record['status'] != STATUS_FAILED):
+                continue
+            signature = folder_signature(os.path.join(self.input_dir, name))
+            if not signature[0] or (record is not None and record['signature'] == signature):
+                # 还没有HDI文件，或处理失败后内容没有变化
+                self.pending.pop(name, None)
+                continue
+            previous = self.pending.get(name)
+            if previous is None or previous[0] != signature:
+                self.pending[name] = (signature, now)
+            elif now - previous[1] >= self.settle_seconds:
+                ready.append(name)
+        return ready
+
+
+def watch_folders(input_dir, base_path_for_photos, output_dir, output_file_name, state_path=None,
+                  poll_seconds=DEFAULT_POLL_SECONDS, settle_seconds=DEFAULT_SETTLE_SECONDS,
+                  queue_size=DEFAULT_QUEUE_SIZE, workers=1, once=False, stop_event=None, **process_options):
+    """
+    监视input_dir，逐个处理新到并已复制完成的文件夹，要素追加到output_dir中的输出文件。
+
+    Args:
+        input_dir (str): 采集数据拷入的目录，其下每个子文件夹为一个处理单元。
+        base_path_for_photos (str): 计算照片相对路径的基准路径。
+        output_dir (str): 输出文件所在目录。
+        output_file_name (str): 输出文件名称（不包含扩展名）。
+        state_path (str): 状态文件路径，默认为 <output_dir>/.hdi_cache/watch_state.json。
+        poll_seconds (float): 轮询间隔（秒）。
+        settle_seconds (float): 文件夹内容保持不变多久后开始处理（秒）。
+        queue_size (int): 待处理队列的最大长度，队列满时新就绪的文件夹等下一次轮询再加入。
+        workers (int): 每个文件夹解析HDI的进程数，见run_hdi_processing。
+        once (bool): 为True时处理完所有已就绪的文件夹、没有正在复制的文件夹后退出。
+        stop_event (threading.Event): 被置位后不再加入新的文件夹，当前文件夹处理完后返回。
+        **process_options: 传给run_hdi_processing的其他参数（如output_format、write_csv、write_tracks）。
+    """
+    state_path = state_path or os.path.join(output_dir, DEFAULT_CACHE_DIR_NAME, WATCH_STATE_FILE_NAME)
+    watcher = FolderWatcher(input_dir, state_path, settle_seconds, output_dir)
+    output_format = process_options.get('output_format', OUTPUT_FORMAT_SHP)
+    output_path = os.path.join(output_dir, f"{output_file_name}{OUTPUT_FORMATS[output_format]['extension']}")
+    if not os.path.exists(state_path) and os.path.exists(output_path):
+        # 第一次监视已有的输出：当前已有的文件夹视为已经在输出中，只处理之后新到的文件夹
+        print(f"输出 {output_path} 已存在，{watcher.mark_baseline()} 个已有文件夹视为已处理，只处理新到的文件夹。")
+
+    stop_event = stop_event or threading.Event()
+    work_queue = queue.Queue(maxsize=max(int(queue_size), 1))
+    busy = set()
+    busy_lock = threading.Lock()
+
+    def process_folders():
+        # 只有一个线程写输出：追加到同一组输出文件不能并发
+        while True:
+            name = work_queue.get()
+            if name is None:
+                return
+            folder_path = os.path.join(input_dir, name)
+            signature = folder_signature(folder_path)
+            print(f"开始处理文件夹 {name}")
+            try:
+                run_hdi_processing(folder_path, base_path_for_photos, output_file_name, stream=True, workers=workers,
+                                   output_dir=output_dir, append=True, warning_log=WarningLog(), **process_options)
+            except Exception as e:
+                # 失败时可能已追加了部分要素；内容变化后重新尝试
+                print(f"处理文件夹 {name} 失败（输出中可能已有该文件夹的部分要素）: {e}")
+                watcher.mark(name, STATUS_FAILED, signature, str(e))
+            else:
+                watcher.mark(name, STATUS_DONE, signature)
+                print(f"文件夹 {name} 已追加到 {output_path}")
+            finally:
+                with busy_lock:
+                    busy.discard(name)
+
+    worker_thread = threading.Thread(target=process_folders, daemon=True)
+    worker_thread.start()
+    print(f"正在监视 {input_dir}（每 {poll_seconds:g} 秒检查一次，内容 {settle_seconds:g} 秒不变后处理）")
+    try:
+        while not stop_event.is_set():
+            with busy_lock:
+                busy_now = set(busy)
+            for name in watcher.poll(time.monotonic(), busy_now):
+                # 只有本线程向队列中加入文件夹，队列未满时加入一定成功
+                if work_queue.full():
+                    break # 积压的文件夹留到下一次轮询
+                with busy_lock:
+                    busy.add(name)
+                print(f"文件夹 {name} 已复制完成，加入处理队列（队列中 {work_queue.qsize() + 1} 个）")
+                work_queue.put_nowait(name)
+            if once:
+                with busy_lock:
+                    idle = not busy
+                if idle and not watcher.pending:
+                    break
+            stop_event.wait(poll_seconds)
+    except KeyboardInterrupt:
+        print("正在停止，等待当前文件夹处理完成...")
+    finally:
+        # 丢弃尚未开始的文件夹，下次启动时重新检测
+        while True:
+            try:
+                work_queue.get_nowait()
+            except queue.Empty:
+                break
+        work_queue.put(None)
+        worker_thread.join()
+    print("监视已停止。")
+
+
+if __name__ == "__main__":
+    # 打包为exe后，进程池的子进程需要此调用才能正常启动
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description="Watch a folder and append newly arrived HDI folders to the output.")
+    parser.add_argument('--input_dir', type=str, required=True,
+                        help='采集数据拷入的目录，其下每个子文件夹（如 20250819_1（轨迹））为一个处理单元。')
+    parser.add_argument('--base_path', type=str, default=r'E:\Code',
+                        help='计算照片相对路径的基准路径。默认为 E:\\Code。')
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='输出文件所在目录。默认为 --input_dir。')
+    parser.add_argument('--output_name', type=str, default='merged_hdi_data',
+                        help='输出CSV和图层的名称（不包含扩展名），新文件夹的要素追加到其中。默认为 merged_hdi_data。')
+    parser.add_argument('--format', choices=tuple(name for name, info in OUTPUT_FORMATS.items() if info['append']),
+                        default=OUTPUT_FORMAT_SHP, help='输出格式（需要支持追加要素）。默认为 shp。')
+    parser.add_argument('--output_crs', nargs='+', default=None,
+                        help='点图层的输出坐标系，见 hdi_to_csv_processor.py --output_crs。')
+    parser.add_argument('--no_csv', action='store_true', help='不输出合并CSV文件。')
+    parser.add_argument('--tracks', action='store_true', help='同时追加轨迹线图层 <output_name>_tracks。')
+    parser.add_argument('--photo_metadata', action='store_true',
+                        help='读取照片尺寸和拍摄时间并生成缩略图，见 hdi_to_csv_processor.py --photo_metadata。')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='每个文件夹解析HDI的进程数。默认为1，0表示使用全部CPU核心。')
+    parser.add_argument('--poll_interval', type=float, default=DEFAULT_POLL_SECONDS,
+                        help=f'轮询间隔（秒）。默认为 {DEFAULT_POLL_SECONDS}。')
+    parser.add_argument('--settle_seconds', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help=f'文件夹的文件数、大小和修改时间保持不变多久（秒）后才处理。默认为 {DEFAULT_SETTLE_SECONDS}。')
+    parser.add_argument('--queue_size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f'待处理队列的最大长度。默认为 {DEFAULT_QUEUE_SIZE}。')
+    parser.add_argument('--state_file', type=str, default=None,
+                        help=f'状态文件路径。默认为 <output_dir>/{DEFAULT_CACHE_DIR_NAME}/{WATCH_STATE_FILE_NAME}。')
+    parser.add_argument('--once', action='store_true',
+                        help='处理完当前已就绪的文件夹（且没有正在复制的文件夹）后退出，适合定时任务。')
+    args = parser.parse_args()
+
+    try:
+        parse_output_crs_list(args.output_crs)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.photo_metadata and not pillow_available():
+        parser.error('生成缩略图需要安装Pillow（pip install Pillow）。')
+
+    watch_folders(args.input_dir, args.base_path, args.output_dir or args.input_dir, args.output_name,
+                  args.state_file, args.poll_interval, args.settle_seconds, args.queue_size, args.workers, args.once,
+                  output_format=args.format, write_csv=not args.no_csv, write_tracks=args.tracks,
+                  output_crs=args.output_crs, extract_photo_metadata=args.photo_metadata)